@@ -6,3 +6,4 @@ from . import components
 from . import models
 from . import wizards
 from . import mws
+from . import controllers
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Tools to exercise the connector offline, they aren't loaded by odoo with the addon
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Synthetic catalog shared by the stand-in of MWS and the benchmarks. All the data is derived from the index of the
+# product or the order, so the server and the odoo side generate the same catalog without sharing any state
+
+import hashlib
+from datetime import datetime, timedelta
+
+MARKETPLACES = {
+    'A1RKKUPIHCS9HS':('ES', 'EUR'),
+    'A1PA6795UKMFR9':('DE', 'EUR'),
+    'A13V1IB3VIYZZH':('FR', 'EUR'),
+    'APJ6JRA9NG5V4':('IT', 'EUR'),
+    'A1F83G8C2ARO7P':('UK', 'GBP'),
+}
+
+ORDER_STATUS = ['Pending', 'Unshipped', 'PartiallyShipped', 'Shipped', 'Canceled']
+
+BASE_DATE = datetime(2018, 1, 1)
+
+
+def _hash(value):
+    return int(hashlib.md5(str(value)).hexdigest()[:8], 16)
+
+
+def sku(index):
+    return 'SKU%07d' % index
+
+
+def sku_index(value):
+    if not value or not value.startswith('SKU'):
+        return None
+    try:
+        return int(value[3:])
+    except ValueError:
+        return None
+
+
+def product(index):
+    """
+    Data of the product of the index
+    """
+    seed = _hash(index)
+    return {
+        'sku':sku(index),
+        'asin':'B%09d' % index,
+        'ean':'84%011d' % index,
+        'title':'Synthetic product %d' % index,
+        'price':round(5 + (seed % 20000) / 100., 2),
+        'shipping':round((seed % 500) / 100., 2),
+        'quantity':seed % 50,
+        'fee':round(1 + (seed % 300) / 100., 2),
+    }
+
+
+def order_id(index):
+    return '%03d-%07d-%07d' % (index % 1000, index // 1000, _hash(index) % 10000000)
+
+
+def order(index, skus):
+    """
+    Data of the order of the index with its lines
+    :param skus: number of skus of the catalog
+    """
+    seed = _hash('order-%d' % index)
+    purchase = BASE_DATE + timedelta(minutes=index)
+    marketplace_id = sorted(MARKETPLACES.keys())[seed % len(MARKETPLACES)]
+    lines = []
+    for line in range(1 + seed % 3):
+        prod = product((seed + line * 7919) % max(skus, 1))
+        qty = 1 + (seed >> line) % 3
+        lines.append({
+            'item_id':'%014d' % (index * 10 + line),
+            'sku':prod['sku'],
+            'asin':prod['asin'],
+            'title':prod['title'],
+            'quantity':qty,
+            'price':prod['price'] * qty,
+            'shipping':prod['shipping'],
+        })
+    return {
+        'order_id':order_id(index),
+        'purchase_date':purchase,
+        'update_date':purchase + timedelta(hours=seed % 72),
+        'status':ORDER_STATUS[seed % len(ORDER_STATUS)],
+        'marketplace_id':marketplace_id,
+        'currency':MARKETPLACES[marketplace_id][1],
+        'country':MARKETPLACES[marketplace_id][0],
+        'total':sum(line['price'] + line['shipping'] for line in lines),
+        'lines':lines,
+    }
@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Local stand-in of Amazon MWS to run the connector offline.
+#
+# The server validates the SignatureVersion 2 of the requests, throttles every action with the max_quota and restore_rate
+# of data/quota_mws_data.xml and serves synthetic responses of Orders, Products, Reports, Feeds and Subscriptions
+# built from benchmarks/catalog.py. To use it, start the server and set on the odoo configuration file:
+#
+#   amazon_mws_endpoint = http://localhost:8765
+#
+#   python -m benchmarks.fake_mws --port 8765 --access-key KEY --secret SECRET --skus 100000 --orders 20000
+
+import argparse
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from datetime import datetime
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from . import catalog
+
+_logger = logging.getLogger('fake_mws')
+
+QUOTA_DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'quota_mws_data.xml')
+
+# Quota of the actions that aren't on the data of the addon
+DEFAULT_QUOTA = (20, 1.)
+
+# Max difference in seconds between the Timestamp of a request and the clock of the server
+MAX_TIMESTAMP_SKEW = 15 * 60
+
+ORDERS_PAGE_SIZE = 100
+ITEMS_PAGE_SIZE = 100
+REPORT_LISTING_TYPES = ('_GET_MERCHANT_LISTINGS_ALL_DATA_', '_GET_MERCHANT_LISTINGS_DATA_')
+
+NAMESPACES = {
+    '/Orders/2013-09-01':'https://mws.amazonservices.com/Orders/2013-09-01',
+    '/Products/2011-10-01':'http://mws.amazonservices.com/schema/Products/2011-10-01',
+    '/Subscriptions/2013-07-01':'https://mws.amazonservices.com/Subscriptions/2013-07-01',
+    '/Sellers/2011-07-01':'http://mws.amazonservices.com/schema/Sellers/2011-07-01',
+    '/':'http://mws.amazonaws.com/doc/2009-01-01/',
+}
+
+LISTING_HEADER = ['item-name', 'item-description', 'listing-id', 'seller-sku', 'price', 'quantity', 'open-date', 'image-url',
+                  'item-is-marketplace', 'product-id-type', 'zshop-shipping-fee', 'item-note', 'item-condition', 'zshop-category1',
+                  'zshop-browse-path', 'zshop-storefront-feature', 'asin1', 'asin2', 'asin3', 'will-ship-internationally',
+                  'expedited-shipping', 'zshop-boldface', 'product-id', 'bid-for-featured-placement', 'add-delete',
+                  'pending-quantity', 'fulfillment-channel', 'merchant-shipping-group', 'status']
+
+SALES_HEADER = ['order-id', 'order-item-id', 'purchase-date', 'payments-date', 'buyer-email', 'buyer-name', 'buyer-phone-number', 'sku',
+                'product-name', 'quantity-purchased', 'currency', 'item-price', 'item-tax', 'shipping-price', 'shipping-tax',
+                'ship-service-level', 'ship-service-name', 'recipient-name', 'ship-address-1', 'ship-address-2', 'ship-address-3',
+                'ship-city', 'ship-state', 'ship-postal-code', 'ship-country', 'ship-phone-number', 'delivery-start-date',
+                'delivery-end-date', 'delivery-time-zone', 'delivery-Instructions', 'order-channel', 'order-channel-instance',
+                'external-order-id', 'earliest-ship-date', 'latest-ship-date', 'earliest-delivery-date', 'latest-delivery-date',
+                'is-business-order', 'purchase-order-number', 'price-designation', 'fulfilled-by', 'shipment-status']
+
+
+class MWSFault(Exception):
+
+    def __init__(self, status, code, message):
+        super(MWSFault, self).__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def load_quotas(path=QUOTA_DATA_FILE):
+    """
+    Read max_quota and restore_rate of the actions from the data file of the addon
+    :return: dict with the action as key and the tuple (max_quota, restore_rate) as value
+    """
+    quotas = {}
+    for record in ElementTree.parse(path).getroot().iter('record'):
+        if record.get('model') != 'amazon.control.request':
+            continue
+        values = dict((field.get('name'), field.text) for field in record.iter('field'))
+        quotas[values['request_name']] = (int(values['max_quota']), float(values['restore_rate']))
+    return quotas
+
+
+def iso_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_date(value):
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S') if value else None
+
+
+def enumerated(params, prefix):
+    """
+    Values of an enumerated parameter (prefix1, prefix2, ...) on order
+    """
+    values = []
+    index = 1
+    while '%s%d' % (prefix, index) in params:
+        values.append(params['%s%d' % (prefix, index)])
+        index += 1
+    return values
+
+
+def amount(tag, value, currency):
+    return '<%s><CurrencyCode>%s</CurrencyCode><Amount>%.2f</Amount></%s>' % (tag, currency, value, tag)
+
+
+class ThrottleBuckets(object):
+    """
+    Token buckets by seller and action with the same rules as MWS, a bucket has max_quota requests and gets back
+    one request each restore_rate seconds. The ByNextToken actions share the bucket of their action.
+    """
+
+    def __init__(self, quotas, speedup=1.):
+        self.quotas = quotas
+        self.speedup = speedup
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _get_quota_name(self, action):
+        if action not in self.quotas and action.endswith('ByNextToken'):
+            return action[:-len('ByNextToken')]
+        return action
+
+    def take(self, seller, action):
+        name = self._get_quota_name(action)
+        max_quota, restore_rate = self.quotas.get(name, DEFAULT_QUOTA)
+        restore_rate = restore_rate / self.speedup
+        now = time.time()
+        with self.lock:
+            tokens, last = self.buckets.get((seller, name), (float(max_quota), now))
+            tokens = min(float(max_quota), tokens + (now - last) / restore_rate if restore_rate else max_quota)
+            if tokens < 1:
+                self.buckets[(seller, name)] = (tokens, now)
+                return False
+            self.buckets[(seller, name)] = (tokens - 1, now)
+            return True
+
+
+class FakeMWS(object):
+    """
+    State of the stand-in: credentials, catalog, throttling, pagination tokens, requested reports and submitted feeds
+    """
+
+    def __init__(self, credentials, skus=1000, orders=1000, quotas=None, speedup=1., throttle=True,
+                 orders_page_size=ORDERS_PAGE_SIZE, items_page_size=ITEMS_PAGE_SIZE):
+        self.credentials = credentials
+        self.skus = skus
+        self.orders = orders
+        self.orders_page_size = orders_page_size
+        self.items_page_size = items_page_size
+        self.throttle = throttle
+        self.buckets = ThrottleBuckets(quotas if quotas is not None else load_quotas(), speedup)
+        self.lock = threading.Lock()
+        self.next_tokens = {}
+        self.reports = {}
+        self.report_data = {}
+        self.feeds = {}
+        self.subscriptions = {}
+        self.sequence = 0
+        self.order_index = dict((catalog.order_id(index), index) for index in xrange(orders))
+
+    def _next_id(self):
+        with self.lock:
+            self.sequence += 1
+            return self.sequence
+
+    def _save_next_token(self, family, state):
+        token = base64.b64encode('%s:%d:%d' % (family, self._next_id(), time.time()))
+        with self.lock:
+            self.next_tokens[token] = (family, state)
+        return token
+
+    def _pop_next_token(self, family, token):
+        with self.lock:
+            value = self.next_tokens.pop(token, None)
+        if not value or value[0] != family:
+            raise MWSFault(400, 'InvalidParameterValue', 'Invalid NextToken')
+        return value[1]
+
+    # Signature
+
+    def check_signature(self, method, host, path, query):
+        params = {}
+        for pair in query.split('&'):
+            if not pair:
+                continue
+            key, _, value = pair.partition('=')
+            params[urllib.unquote(key)] = urllib.unquote(value)
+
+        signature = params.pop('Signature', None)
+        if not signature or params.get('SignatureVersion') != '2' or params.get('SignatureMethod') != 'HmacSHA256':
+            raise MWSFault(400, 'MissingParameter', 'The request must be signed with SignatureVersion 2 and HmacSHA256')
+
+        secret = self.credentials.get(params.get('AWSAccessKeyId'))
+        if secret is None:
+            raise MWSFault(401, 'InvalidAccessKeyId', 'The AWS Access Key Id you provided does not exist in our records.')
+
+        timestamp = parse_date(params.get('Timestamp'))
+        if not timestamp or abs((datetime.utcnow() - timestamp).total_seconds()) > MAX_TIMESTAMP_SKEW:
+            raise MWSFault(400, 'RequestExpired', 'Request has expired. Timestamp date is %s' % params.get('Timestamp'))
+
+        description = '&'.join(['%s=%s' % (key, urllib.quote(params[key], safe='-_.~')) for key in sorted(params)])
+        sig_data = method + '\n' + host.lower() + '\n' + path + '\n' + description
+        expected = base64.b64encode(hmac.new(secret, sig_data, hashlib.sha256).digest())
+        if not hmac.compare_digest(expected, signature):
+            raise MWSFault(403, 'SignatureDoesNotMatch',
+                           'The request signature we calculated does not match the signature you provided.')
+        return params
+
+    # Dispatch
+
+    def dispatch(self, method, host, path, query, body):
+        """
+        :return: tuple (status, content type, body)
+        """
+        params = self.check_signature(method, host, path, query)
+        action = params.get('Action')
+        handler = getattr(self, 'action_%s' % action, None)
+        if not handler:
+            raise MWSFault(400, 'InvalidAction', 'The action %s is not valid for this endpoint.' % action)
+
+        seller = params.get('SellerId') or params.get('Merchant')
+        if self.throttle and not self.buckets.take(seller, action):
+            raise MWSFault(503, 'RequestThrottled', 'Request is throttled')
+
+        result = handler(params, body)
+        if isinstance(result, tuple):
+            return (200,) + result
+        return 200, 'text/xml', self.envelope(path, action, result)
+
+    def envelope(self, path, action, result):
+        return ('<?xml version="1.0"?>\n<%(action)sResponse xmlns="%(ns)s"><%(action)sResult>%(result)s</%(action)sResult>'
+                '<ResponseMetadata><RequestId>%(request)s</RequestId></ResponseMetadata></%(action)sResponse>') % {
+                   'action':action,
+                   'ns':NAMESPACES.get(path, NAMESPACES['/']),
+                   'result':result,
+                   'request':self._next_id(),
+               }
+
+    def error_body(self, fault):
+        return ('<?xml version="1.0"?>\n<ErrorResponse xmlns="https://mws.amazonservices.com/"><Error><Type>Sender</Type>'
+                '<Code>%s</Code><Message>%s</Message></Error><RequestID>%s</RequestID></ErrorResponse>') % (
+                   fault.code, escape(fault.message), self._next_id())
+
+    # Orders
+
+    def _order_xml(self, index):
+        order = catalog.order(index, self.skus)
+        items = sum(line['quantity'] for line in order['lines'])
+        shipped = items if order['status'] == 'Shipped' else 0
+        return ('<Order><AmazonOrderId>%(id)s</AmazonOrderId><PurchaseDate>%(purchase)s</PurchaseDate>'
+                '<LastUpdateDate>%(update)s</LastUpdateDate><OrderStatus>%(status)s</OrderStatus>'
+                '<FulfillmentChannel>MFN</FulfillmentChannel><ShipServiceLevel>Std ES Dom_1</ShipServiceLevel>'
+                '<ShippingAddress><Name>Buyer %(index)d</Name><AddressLine1>Calle %(index)d</AddressLine1><City>Madrid</City>'
+                '<StateOrRegion>Madrid</StateOrRegion><PostalCode>28001</PostalCode><CountryCode>%(country)s</CountryCode>'
+                '<Phone>600000000</Phone></ShippingAddress>%(total)s<NumberOfItemsShipped>%(shipped)d</NumberOfItemsShipped>'
+                '<NumberOfItemsUnshipped>%(unshipped)d</NumberOfItemsUnshipped><MarketplaceId>%(marketplace)s</MarketplaceId>'
+                '<BuyerEmail>buyer%(index)d@marketplace.amazon.es</BuyerEmail><BuyerName>Buyer %(index)d</BuyerName>'
+                '<ShipmentServiceLevelCategory>Standard</ShipmentServiceLevelCategory><OrderType>StandardOrder</OrderType>'
+                '<EarliestShipDate>%(purchase)s</EarliestShipDate><LatestShipDate>%(purchase)s</LatestShipDate>'
+                '<EarliestDeliveryDate>%(purchase)s</EarliestDeliveryDate><LatestDeliveryDate>%(purchase)s</LatestDeliveryDate>'
+                '<IsBusinessOrder>false</IsBusinessOrder><IsPrime>false</IsPrime><IsPremiumOrder>false</IsPremiumOrder></Order>') % {
+                   'id':order['order_id'],
+                   'index':index,
+                   'purchase':iso_date(order['purchase_date']),
+                   'update':iso_date(order['update_date']),
+                   'status':order['status'],
+                   'country':order['country'],
+                   'total':amount('OrderTotal', order['total'], order['currency']),
+                   'shipped':shipped,
+                   'unshipped':items - shipped,
+                   'marketplace':order['marketplace_id'],
+               }
+
+    def _filter_orders(self, params):
+        created_after = parse_date(params.get('CreatedAfter'))
+        created_before = parse_date(params.get('CreatedBefore'))
+        updated_after = parse_date(params.get('LastUpdatedAfter'))
+        updated_before = parse_date(params.get('LastUpdatedBefore'))
+        statuses = set(enumerated(params, 'OrderStatus.Status.'))
+        marketplaces = set(enumerated(params, 'MarketplaceId.Id.'))
+        indexes = []
+        for index in xrange(self.orders):
+            order = catalog.order(index, 0)
+            if created_after and order['purchase_date'] < created_after or created_before and order['purchase_date'] > created_before:
+                continue
+            if updated_after and order['update_date'] < updated_after or updated_before and order['update_date'] > updated_before:
+                continue
+            if statuses and order['status'] not in statuses or marketplaces and order['marketplace_id'] not in marketplaces:
+                continue
+            indexes.append(index)
+        return indexes
+
+    def _orders_page(self, indexes, page_size):
+        page, rest = indexes[:page_size], indexes[page_size:]
+        result = '<Orders>%s</Orders>' % ''.join([self._order_xml(index) for index in page])
+        if rest:
+            result = '<NextToken>%s</NextToken>' % self._save_next_token('orders', (rest, page_size)) + result
+        return result + '<LastUpdatedBefore>%s</LastUpdatedBefore>' % iso_date(datetime.utcnow())
+
+    def action_ListOrders(self, params, body):
+        page_size = min(int(params.get('MaxResultsPerPage') or self.orders_page_size), self.orders_page_size)
+        return self._orders_page(self._filter_orders(params), page_size)
+
+    def action_ListOrdersByNextToken(self, params, body):
+        indexes, page_size = self._pop_next_token('orders', params.get('NextToken'))
+        return self._orders_page(indexes, page_size)
+
+    def action_GetOrder(self, params, body):
+        ids = enumerated(params, 'AmazonOrderId.Id.')
+        if len(ids) > 50:
+            raise MWSFault(400, 'InvalidParameterValue', 'The maximum number of AmazonOrderId is 50')
+        return '<Orders>%s</Orders>' % ''.join([self._order_xml(self.order_index[id]) for id in ids if id in self.order_index])
+
+    def _items_page(self, order, lines):
+        page, rest = lines[:self.items_page_size], lines[self.items_page_size:]
+        result = '<AmazonOrderId>%s</AmazonOrderId><OrderItems>%s</OrderItems>' % (order['order_id'], ''.join([
+            ('<OrderItem><ASIN>%s</ASIN><SellerSKU>%s</SellerSKU><OrderItemId>%s</OrderItemId><Title>%s</Title>'
+             '<QuantityOrdered>%d</QuantityOrdered><QuantityShipped>0</QuantityShipped>%s%s<ConditionId>New</ConditionId>'
+             '</OrderItem>') % (line['asin'], line['sku'], line['item_id'], escape(line['title']), line['quantity'],
+                                amount('ItemPrice', line['price'], order['currency']),
+                                amount('ShippingPrice', line['shipping'], order['currency'])) for line in page]))
+        if rest:
+            result = '<NextToken>%s</NextToken>' % self._save_next_token('items', (order, rest)) + result
+        return result
+
+    def action_ListOrderItems(self, params, body):
+        index = self.order_index.get(params.get('AmazonOrderId'))
+        if index is None:
+            raise MWSFault(400, 'InvalidParameterValue', 'Invalid AmazonOrderId: %s' % params.get('AmazonOrderId'))
+        order = catalog.order(index, self.skus)
+        return self._items_page(order, order['lines'])
+
+    def action_ListOrderItemsByNextToken(self, params, body):
+        order, lines = self._pop_next_token('items', params.get('NextToken'))
+        return self._items_page(order, lines)
+
+    # Products
+
+    def _get_product(self, sku):
+        index = catalog.sku_index(sku)
+        if index is None or index >= self.skus:
+            return None
+        return catalog.product(index)
+
+    def _product_error(self, action, attribute, value):
+        return ('<%sResult %s="%s" status="ClientError"><Error><Type>Sender</Type><Code>InvalidParameterValue</Code>'
+                '<Message>%s is an invalid value.</Message></Error></%sResult>') % (action, attribute, escape(value), escape(value), action)
+
+    def _products_response(self, action, results):
+        return ('<?xml version="1.0"?>\n<%(action)sResponse xmlns="%(ns)s">%(results)s<ResponseMetadata><RequestId>%(request)s'
+                '</RequestId></ResponseMetadata></%(action)sResponse>') % {
+                   'action':action,
+                   'ns':NAMESPACES['/Products/2011-10-01'],
+                   'results':''.join(results),
+                   'request':self._next_id(),
+               }
+
+    def _my_price_results(self, params, values, attribute, action):
+        marketplace_id = params.get('MarketplaceId')
+        currency = catalog.MARKETPLACES.get(marketplace_id, ('', 'EUR'))[1]
+        if len(values) > 20:
+            raise MWSFault(400, 'InvalidParameterValue', 'The maximum number of %s is 20' % attribute)
+        results = []
+        for value in values:
+            product = self._get_product(value) if attribute == 'SellerSKU' else self._get_product('SKU' + value[1:])
+            if not product:
+                results.append(self._product_error(action, attribute, value))
+                continue
+            results.append(('<%(action)sResult %(attribute)s="%(value)s" status="Success"><Product><Identifiers><MarketplaceASIN>'
+                            '<MarketplaceId>%(marketplace)s</MarketplaceId><ASIN>%(asin)s</ASIN></MarketplaceASIN></Identifiers>'
+                            '<Offers><Offer><BuyingPrice>%(landed)s%(listing)s%(shipping)s</BuyingPrice>%(regular)s'
+                            '<FulfillmentChannel>MERCHANT</FulfillmentChannel><ItemCondition>New</ItemCondition>'
+                            '<ItemSubCondition>New</ItemSubCondition><SellerId>%(seller)s</SellerId><SellerSKU>%(sku)s</SellerSKU>'
+                            '</Offer></Offers></Product></%(action)sResult>') % {
+                               'action':action,
+                               'attribute':attribute,
+                               'value':escape(value),
+                               'marketplace':marketplace_id,
+                               'asin':product['asin'],
+                               'landed':amount('LandedPrice', product['price'] + product['shipping'], currency),
+                               'listing':amount('ListingPrice', product['price'], currency),
+                               'shipping':amount('Shipping', product['shipping'], currency),
+                               'regular':amount('RegularPrice', product['price'], currency),
+                               'seller':params.get('SellerId'),
+                               'sku':product['sku'],
+                           })
+        return results
+
+    def action_GetMyPriceForSKU(self, params, body):
+        results = self._my_price_results(params, enumerated(params, 'SellerSKUList.SellerSKU.'), 'SellerSKU', 'GetMyPriceForSKU')
+        return 'text/xml', self._products_response('GetMyPriceForSKU', results)
+
+    def action_GetMyPriceForASIN(self, params, body):
+        results = self._my_price_results(params, enumerated(params, 'ASINList.ASIN.'), 'ASIN', 'GetMyPriceForASIN')
+        return 'text/xml', self._products_response('GetMyPriceForASIN', results)
+
+    def action_GetMatchingProductForId(self, params, body):
+        id_type = params.get('IdType')
+        results = []
+        for value in enumerated(params, 'IdList.Id.'):
+            product = self._get_product(value) if id_type == 'SellerSKU' else \
+                self._get_product('SKU' + value[-7:]) if value[-7:].isdigit() else None
+            if not product:
+                results.append(('<GetMatchingProductForIdResult Id="%s" IdType="%s" status="ClientError"><Error><Type>Sender</Type>'
+                                '<Code>InvalidParameterValue</Code><Message>Invalid %s identifier %s</Message></Error>'
+                                '</GetMatchingProductForIdResult>') % (escape(value), id_type, id_type, escape(value)))
+                continue
+            results.append(('<GetMatchingProductForIdResult Id="%(value)s" IdType="%(type)s" status="Success"><Products><Product>'
+                            '<Identifiers><MarketplaceASIN><MarketplaceId>%(marketplace)s</MarketplaceId><ASIN>%(asin)s</ASIN>'
+                            '</MarketplaceASIN></Identifiers><AttributeSets><ItemAttributes xml:lang="es-ES"><Brand>Synthetic</Brand>'
+                            '<Title>%(title)s</Title></ItemAttributes></AttributeSets><Relationships/><SalesRankings/></Product>'
+                            '</Products></GetMatchingProductForIdResult>') % {
+                               'value':escape(value),
+                               'type':id_type,
+                               'marketplace':params.get('MarketplaceId'),
+                               'asin':product['asin'],
+                               'title':escape(product['title']),
+                           })
+        return 'text/xml', self._products_response('GetMatchingProductForId', results)
+
+    def action_GetLowestPricedOffersForSKU(self, params, body):
+        product = self._get_product(params.get('SellerSKU'))
+        if not product:
+            raise MWSFault(400, 'InvalidParameterValue', 'Invalid SellerSKU %s' % params.get('SellerSKU'))
+        currency = catalog.MARKETPLACES.get(params.get('MarketplaceId'), ('', 'EUR'))[1]
+        return ('<Identifier><MarketplaceId>%(marketplace)s</MarketplaceId><SellerSKU>%(sku)s</SellerSKU>'
+                '<ItemCondition>New</ItemCondition></Identifier><Summary><TotalOfferCount>1</TotalOfferCount>'
+                '<LowestPrices><LowestPrice condition="new" fulfillmentChannel="Merchant">%(landed)s%(listing)s%(shipping)s'
+                '</LowestPrice></LowestPrices><BuyBoxPrices><BuyBoxPrice condition="New">%(landed)s%(listing)s%(shipping)s'
+                '</BuyBoxPrice></BuyBoxPrices></Summary><Offers><Offer><MyOffer>true</MyOffer><SubCondition>new</SubCondition>'
+                '%(listing)s%(shipping)s<IsFulfilledByAmazon>false</IsFulfilledByAmazon><IsBuyBoxWinner>true</IsBuyBoxWinner>'
+                '</Offer></Offers>') % {
+                   'marketplace':params.get('MarketplaceId'),
+                   'sku':product['sku'],
+                   'landed':amount('LandedPrice', product['price'] + product['shipping'], currency),
+                   'listing':amount('ListingPrice', product['price'], currency),
+                   'shipping':amount('Shipping', product['shipping'], currency),
+               }
+
+    def action_GetProductCategoriesForSKU(self, params, body):
+        return ('<Self><ProductCategoryId>%s</ProductCategoryId><ProductCategoryName>Synthetic</ProductCategoryName>'
+                '</Self>') % (catalog.sku_index(params.get('SellerSKU')) or 0)
+
+    def action_GetMyFeesEstimate(self, params, body):
+        prefix = 'FeesEstimateRequestList.FeesEstimateRequest.%d.'
+        results = []
+        index = 1
+        while (prefix % index) + 'IdValue' in params:
+            request = dict((key[len(prefix % index):], value) for key, value in params.iteritems() if key.startswith(prefix % index))
+            product = self._get_product(request['IdValue']) if request.get('IdType') == 'SellerSKU' else \
+                self._get_product('SKU' + request['IdValue'][1:])
+            currency = request.get('PriceToEstimateFees.ListingPrice.CurrencyCode', 'EUR')
+            identifier = ('<FeesEstimateIdentifier><MarketplaceId>%s</MarketplaceId><IdType>%s</IdType><SellerId>%s</SellerId>'
+                          '<SellerInputIdentifier>%s</SellerInputIdentifier><IsAmazonFulfilled>%s</IsAmazonFulfilled>'
+                          '<IdValue>%s</IdValue></FeesEstimateIdentifier>') % (
+                             request.get('MarketplaceId'), request.get('IdType'), params.get('SellerId'), escape(request.get('Identifier', '')),
+                             request.get('IsAmazonFulfilled', 'false'), escape(request['IdValue']))
+            if not product:
+                results.append('<FeesEstimateResult>%s<Status>ClientError</Status><Error><Type>Sender</Type>'
+                               '<Code>InvalidParameterValue</Code><Message>Item not found</Message></Error>'
+                               '</FeesEstimateResult>' % identifier)
+            else:
+                price = float(request.get('PriceToEstimateFees.ListingPrice.Amount') or product['price'])
+                referral = round(price * 0.15, 2)
+                results.append(('<FeesEstimateResult>%(identifier)s<Status>Success</Status><FeesEstimate>%(total)s'
+                                 '<FeeDetailList><FeeDetail><FeeType>ReferralFee</FeeType>%(fee)s%(promotion)s%(final)s'
+                                 '</FeeDetail><FeeDetail><FeeType>VariableClosingFee</FeeType>%(closing)s%(promotion)s%(closing_final)s'
+                                 '</FeeDetail></FeeDetailList></FeesEstimate></FeesEstimateResult>') % {
+                                    'identifier':identifier,
+                                    'total':amount('TotalFeesEstimate', referral + product['fee'], currency),
+                                    'fee':amount('FeeAmount', referral, currency),
+                                    'promotion':amount('FeePromotion', 0, currency),
+                                    'final':amount('FinalFee', referral, currency),
+                                    'closing':amount('FeeAmount', product['fee'], currency),
+                                    'closing_final':amount('FinalFee', product['fee'], currency),
+                                })
+            index += 1
+        return '<FeesEstimateResultList>%s</FeesEstimateResultList>' % ''.join(results)
+
+    # Reports
+
+    def _report_request_xml(self, request_id):
+        report = self.reports[request_id]
+        return ('<ReportRequestInfo><ReportRequestId>%(id)s</ReportRequestId><ReportType>%(type)s</ReportType>'
+                '<StartDate>%(date)s</StartDate><EndDate>%(date)s</EndDate><Scheduled>false</Scheduled>'
+                '<SubmittedDate>%(date)s</SubmittedDate><ReportProcessingStatus>_DONE_</ReportProcessingStatus>'
+                '<GeneratedReportId>R%(id)s</GeneratedReportId></ReportRequestInfo>') % {
+                   'id':request_id,
+                   'type':report['type'],
+                   'date':iso_date(report['date']),
+               }
+
+    def action_RequestReport(self, params, body):
+        request_id = str(self._next_id())
+        with self.lock:
+            self.reports[request_id] = {'type':params.get('ReportType'),
+                                        'marketplace':(enumerated(params, 'MarketplaceIdList.Id.') or [None])[0],
+                                        'date':datetime.utcnow()}
+        return self._report_request_xml(request_id)
+
+    def action_GetReportRequestList(self, params, body):
+        ids = enumerated(params, 'ReportRequestIdList.Id.') or sorted(self.reports.keys())
+        return '<HasNext>false</HasNext>' + ''.join([self._report_request_xml(id) for id in ids if id in self.reports])
+
+    def action_GetReportList(self, params, body):
+        ids = enumerated(params, 'ReportRequestIdList.Id.') or sorted(self.reports.keys())
+        return '<HasNext>false</HasNext>' + ''.join([
+            ('<ReportInfo><ReportId>R%(id)s</ReportId><ReportType>%(type)s</ReportType><ReportRequestId>%(id)s</ReportRequestId>'
+             '<AvailableDate>%(date)s</AvailableDate><Acknowledged>false</Acknowledged></ReportInfo>') % {
+                'id':id,
+                'type':self.reports[id]['type'],
+                'date':iso_date(self.reports[id]['date']),
+            } for id in ids if id in self.reports])
+
+    def _listing_report(self):
+        rows = ['\t'.join(LISTING_HEADER)]
+        for index in xrange(self.skus):
+            product = catalog.product(index)
+            row = dict.fromkeys(LISTING_HEADER, '')
+            row.update({'item-name':product['title'], 'listing-id':'L%09d' % index, 'seller-sku':product['sku'],
+                        'price':'%.2f' % product['price'], 'quantity':str(product['quantity']),
+                        'open-date':'2018-01-01 00:00:00 MET', 'item-is-marketplace':'y', 'product-id-type':'4',
+                        'item-condition':'11', 'asin1':product['asin'], 'product-id':product['ean'],
+                        'fulfillment-channel':'DEFAULT', 'merchant-shipping-group':'Plantilla de Amazon', 'status':'Active'})
+            rows.append('\t'.join([row[column] for column in LISTING_HEADER]))
+        return '\n'.join(rows) + '\n'
+
+    def _sales_report(self):
+        rows = ['\t'.join(SALES_HEADER)]
+        for index in xrange(self.orders):
+            order = catalog.order(index, self.skus)
+            for line in order['lines']:
+                row = dict.fromkeys(SALES_HEADER, '')
+                row.update({'order-id':order['order_id'], 'order-item-id':line['item_id'],
+                            'purchase-date':iso_date(order['purchase_date']), 'payments-date':iso_date(order['purchase_date']),
+                            'buyer-email':'buyer%d@marketplace.amazon.es' % index, 'buyer-name':'Buyer %d' % index,
+                            'sku':line['sku'], 'product-name':line['title'], 'quantity-purchased':str(line['quantity']),
+                            'currency':order['currency'], 'item-price':'%.2f' % line['price'], 'item-tax':'0.00',
+                            'shipping-price':'%.2f' % line['shipping'], 'shipping-tax':'0.00', 'ship-service-level':'Standard',
+                            'recipient-name':'Buyer %d' % index, 'ship-address-1':'Calle %d' % index, 'ship-city':'Madrid',
+                            'ship-state':'Madrid', 'ship-postal-code':'28001', 'ship-country':order['country'],
+                            'is-business-order':'false', 'fulfilled-by':'', 'shipment-status':order['status']})
+                rows.append('\t'.join([row[column] for column in SALES_HEADER]))
+        return '\n'.join(rows) + '\n'
+
+    def action_GetReport(self, params, body):
+        request_id = (params.get('ReportId') or '')[1:]
+        if request_id not in self.reports:
+            raise MWSFault(400, 'InvalidParameterValue', 'Invalid ReportId %s' % params.get('ReportId'))
+        report_type = self.reports[request_id]['type']
+        # The synthetic reports are the same for all the requests of a type, they are generated once
+        with self.lock:
+            data = self.report_data.get(report_type)
+        if data is None:
+            data = self._listing_report() if report_type in REPORT_LISTING_TYPES else self._sales_report()
+            with self.lock:
+                self.report_data[report_type] = data
+        return 'text/plain;charset=Cp1252', data
+
+    # Feeds
+
+    def _feed_xml(self, feed_id):
+        feed = self.feeds[feed_id]
+        return ('<FeedSubmissionInfo><FeedSubmissionId>%(id)s</FeedSubmissionId><FeedType>%(type)s</FeedType>'
+                '<SubmittedDate>%(date)s</SubmittedDate><FeedProcessingStatus>_DONE_</FeedProcessingStatus>'
+                '</FeedSubmissionInfo>') % {'id':feed_id, 'type':feed['type'], 'date':iso_date(feed['date'])}
+
+    def action_SubmitFeed(self, params, body):
+        feed_id = str(50000000000 + self._next_id())
+        messages = body.count('<Message>') or max(body.count('\n') - 1, 0)
+        with self.lock:
+            self.feeds[feed_id] = {'type':params.get('FeedType'), 'date':datetime.utcnow(), 'size':len(body), 'messages':messages}
+        return self._feed_xml(feed_id)
+
+    def action_GetFeedSubmissionList(self, params, body):
+        ids = enumerated(params, 'FeedSubmissionIdList.Id.') or sorted(self.feeds.keys())
+        return '<HasNext>false</HasNext>' + ''.join([self._feed_xml(id) for id in ids if id in self.feeds])
+
+    def action_GetFeedSubmissionResult(self, params, body):
+        feed_id = params.get('FeedSubmissionId')
+        if feed_id not in self.feeds:
+            raise MWSFault(400, 'InvalidParameterValue', 'Invalid FeedSubmissionId %s' % feed_id)
+        messages = self.feeds[feed_id]['messages']
+        return 'text/xml', ('<?xml version="1.0" encoding="UTF-8"?>\n<AmazonEnvelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                            'xsi:noNamespaceSchemaLocation="amzn-envelope.xsd"><Header><DocumentVersion>1.02</DocumentVersion>'
+                            '<MerchantIdentifier>%s</MerchantIdentifier></Header><MessageType>ProcessingReport</MessageType>'
+                            '<Message><MessageID>1</MessageID><ProcessingReport><DocumentTransactionID>%s</DocumentTransactionID>'
+                            '<StatusCode>Complete</StatusCode><ProcessingSummary><MessagesProcessed>%d</MessagesProcessed>'
+                            '<MessagesSuccessful>%d</MessagesSuccessful><MessagesWithError>0</MessagesWithError>'
+                            '<MessagesWithWarning>0</MessagesWithWarning></ProcessingSummary></ProcessingReport></Message>'
+                            '</AmazonEnvelope>') % (params.get('Merchant'), feed_id, messages, messages)
+
+    # Subscriptions
+
+    def action_RegisterDestination(self, params, body):
+        return ''
+
+    def action_DeregisterDestination(self, params, body):
+        return ''
+
+    def action_ListRegisteredDestinations(self, params, body):
+        return '<DestinationList/>'
+
+    def action_CreateSubscription(self, params, body):
+        key = (params.get('MarketplaceId'), params.get('Subscription.NotificationType'))
+        with self.lock:
+            self.subscriptions[key] = params.get('Subscription.IsEnabled', 'true')
+        return ''
+
+    def action_DeleteSubscription(self, params, body):
+        with self.lock:
+            self.subscriptions.pop((params.get('MarketplaceId'), params.get('NotificationType')), None)
+        return ''
+
+    def action_ListSubscriptions(self, params, body):
+        marketplace_id = params.get('MarketplaceId')
+        return '<SubscriptionList>%s</SubscriptionList>' % ''.join([
+            '<member><NotificationType>%s</NotificationType><IsEnabled>%s</IsEnabled></member>' % (key[1], enabled)
+            for key, enabled in self.subscriptions.items() if key[0] == marketplace_id])
+
+    def action_GetServiceStatus(self, params, body):
+        return '<Status>GREEN</Status><Timestamp>%s</Timestamp>' % iso_date(datetime.utcnow())
+
+
+class FakeMWSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self, method):
+        url = urlparse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        mws = self.server.mws
+        try:
+            status, content_type, data = mws.dispatch(method, self.headers.get('Host', ''), url.path, url.query, body)
+        except MWSFault as fault:
+            status, content_type, data = fault.status, 'text/xml', mws.error_body(fault)
+        except Exception as e:
+            _logger.exception('Error serving %s', self.path)
+            status, content_type, data = 500, 'text/xml', mws.error_body(MWSFault(500, 'InternalError', str(e)))
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Content-MD5', base64.encodestring(hashlib.md5(data).digest()).strip('\n'))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+class FakeMWSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, mws):
+        HTTPServer.__init__(self, address, FakeMWSHandler)
+        self.mws = mws
+
+
+def serve_in_thread(mws, host='127.0.0.1', port=0):
+    """
+    Start the stand-in on a daemon thread, useful for the benchmarks
+    :return: the server, the endpoint is http://host:server.server_port
+    """
+    server = FakeMWSServer((host, port), mws)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in of Amazon MWS')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--access-key', required=True, help='AWSAccessKeyId of the backend')
+    parser.add_argument('--secret', required=True, help='Secret key of the backend')
+    parser.add_argument('--skus', type=int, default=1000, help='Number of products of the catalog')
+    parser.add_argument('--orders', type=int, default=1000, help='Number of orders')
+    parser.add_argument('--orders-page-size', type=int, default=ORDERS_PAGE_SIZE)
+    parser.add_argument('--items-page-size', type=int, default=ITEMS_PAGE_SIZE)
+    parser.add_argument('--speedup', type=float, default=1., help='Factor applied to the restore rates of the quotas')
+    parser.add_argument('--no-throttle', action='store_true', help='Disable the emulation of the quotas')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    mws = FakeMWS(credentials={args.access_key:args.secret}, skus=args.skus, orders=args.orders, speedup=args.speedup,
+                  throttle=not args.no_throttle, orders_page_size=args.orders_page_size, items_page_size=args.items_page_size)
+    server = FakeMWSServer((args.host, args.port), mws)
+    _logger.info('Fake MWS listening on http://%s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
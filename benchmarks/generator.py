@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Generator of the synthetic catalog on odoo: backend, products with their details by marketplace, BoMs, stock and
+# historic offers. The data is the same that benchmarks/catalog.py serves on the stand-in of MWS
+
+import logging
+
+from . import catalog
+
+_logger = logging.getLogger(__name__)
+
+BACKEND_NAME = 'Benchmark %d'
+COMMIT_EACH = 1000
+
+
+def get_backend(env, products):
+    return env['amazon.backend'].search([('name', '=', BACKEND_NAME % products)], limit=1)
+
+
+def _get_marketplaces(env, number):
+    marketplaces = env['amazon.config.marketplace'].search([('id_mws', 'in', sorted(catalog.MARKETPLACES.keys()))], order='id')
+    return marketplaces[:number]
+
+
+def _create_backend(env, products, marketplaces, access_key, secret):
+    warehouse = env['stock.warehouse'].search([], limit=1)
+    return env['amazon.backend'].create({
+        'name':BACKEND_NAME % products,
+        'access_key':access_key,
+        'key':secret,
+        'seller':'BENCHMARKSELLER',
+        'token':'amzn.mws.benchmark',
+        'warehouse_id':warehouse.id,
+        'sale_prefix':'bench%d-' % products,
+        'stock_sync':True,
+        'marketplace_ids':[(6, 0, marketplaces.ids)],
+    })
+
+
+def _create_offers(env, detail, product, offers):
+    currency = detail.marketplace_id.country_id.currency_id
+    lines = []
+    for index in range(offers):
+        lines.append((0, 0, {'id_seller':'BENCHMARKSELLER' if not index else 'SELLER%d' % index,
+                             'price':product['price'] + index,
+                             'currency_price_id':currency.id,
+                             'price_ship':product['shipping'],
+                             'currency_ship_price_id':currency.id,
+                             'is_buybox':not index,
+                             'is_lower_price':not index,
+                             'condition':'new'}))
+    env['amazon.historic.product.offer'].create({'offer_date':catalog.BASE_DATE,
+                                                 'product_detail_id':detail.id,
+                                                 'offer_ids':lines})
+
+
+def generate(env, products, marketplaces=3, offers=5, bom_each=10, access_key='BENCHMARK', secret='BENCHMARK'):
+    """
+    Create the catalog of the benchmark if it doesn't exist, the data is committed on batches so a big catalog can be
+    generated once and reused by the next runs
+    :param products: number of products
+    :param marketplaces: number of marketplaces where the products are sold
+    :param offers: number of offers of the historic of each detail
+    :param bom_each: one of each bom_each products is a kit of two other products (only with mrp installed)
+    :return: backend of the catalog
+    """
+    backend = get_backend(env, products)
+    markets = _get_marketplaces(env, marketplaces)
+    if not backend:
+        backend = _create_backend(env, products, markets, access_key, secret)
+        env.cr.commit()
+
+    amazon_product_model = env['amazon.product.product']
+    created = amazon_product_model.search_count([('backend_id', '=', backend.id)])
+    if created >= products:
+        return backend
+
+    _logger.info('Generating %d products of the benchmark catalog from %d', products, created)
+    location = backend.warehouse_id.lot_stock_id
+    has_bom = 'mrp.bom' in env
+    for index in xrange(created, products):
+        product = catalog.product(index)
+        amazon_product = amazon_product_model.create({
+            'name':product['title'],
+            'type':'product',
+            'default_code':product['sku'],
+            'barcode':product['ean'],
+            'backend_id':backend.id,
+            'sku':product['sku'],
+            'asin':product['asin'],
+            'id_type_product':'EAN',
+            'id_product':product['ean'],
+            'product_product_market_ids':[(0, 0, {'marketplace_id':market.id,
+                                                  'title':product['title'],
+                                                  'price':product['price'],
+                                                  'price_ship':product['shipping'],
+                                                  'currency_price':market.country_id.currency_id.id,
+                                                  'currency_ship_price':market.country_id.currency_id.id,
+                                                  'stock':product['quantity'],
+                                                  'merchant_shipping_group':'Plantilla de Amazon'}) for market in markets],
+        })
+        if product['quantity'] and location:
+            env['stock.quant'].sudo().create({'product_id':amazon_product.odoo_id.id,
+                                              'location_id':location.id,
+                                              'qty':product['quantity']})
+        if has_bom and bom_each and index > 1 and not index % bom_each:
+            components = amazon_product_model.search([('backend_id', '=', backend.id), ('sku', 'in', [catalog.sku(index - 1),
+                                                                                                      catalog.sku(index - 2)])])
+            env['mrp.bom'].create({'product_tmpl_id':amazon_product.product_tmpl_id.id,
+                                   'product_id':amazon_product.odoo_id.id,
+                                   'type':'phantom',
+                                   'bom_line_ids':[(0, 0, {'product_id':component.odoo_id.id, 'product_qty':1})
+                                                   for component in components]})
+        if offers:
+            for detail in amazon_product.product_product_market_ids:
+                _create_offers(env, detail, product, offers)
+
+        if not (index + 1) % COMMIT_EACH:
+            env.cr.commit()
+            env.clear()
+            _logger.info('Generated %d/%d products', index + 1, products)
+
+    env.cr.commit()
+    return backend
+
+
+def offer_changed_message(product, marketplace_id, offers, time_change):
+    """
+    Body of an AnyOfferChanged notification of SQS for the product
+    """
+    currency = catalog.MARKETPLACES[marketplace_id][1]
+    amounts = lambda tag, value:'<%s><Amount>%.2f</Amount><CurrencyCode>%s</CurrencyCode></%s>' % (tag, value, currency, tag)
+    offer_lines = []
+    for index in range(offers):
+        price = product['price'] + index
+        offer_lines.append('<Offer><SellerId>%s</SellerId><SubCondition>new</SubCondition><SellerFeedbackRating>'
+                           '<SellerPositiveFeedbackRating>9%d</SellerPositiveFeedbackRating><FeedbackCount>%d</FeedbackCount>'
+                           '</SellerFeedbackRating><ShippingTime minimumHours="24" maximumHours="48" availabilityType="NOW"/>'
+                           '%s%s<IsFulfilledByAmazon>false</IsFulfilledByAmazon><IsBuyBoxWinner>%s</IsBuyBoxWinner>'
+                           '<IsFeaturedMerchant>true</IsFeaturedMerchant><ShipsDomestically>true</ShipsDomestically></Offer>' % (
+                               'BENCHMARKSELLER' if not index else 'SELLER%d' % index, index % 10, 100 + index,
+                               amounts('ListingPrice', price), amounts('Shipping', product['shipping']), 'true' if not index else 'false'))
+    return ('<Notification><NotificationMetaData><NotificationType>AnyOfferChanged</NotificationType><PayloadVersion>1.0'
+            '</PayloadVersion><UniqueId>%(sku)s-%(time)s</UniqueId><PublishTime>%(time)s</PublishTime><SellerId>BENCHMARKSELLER'
+            '</SellerId><MarketplaceId>%(marketplace)s</MarketplaceId></NotificationMetaData><NotificationPayload>'
+            '<AnyOfferChangedNotification><OfferChangeTrigger><MarketplaceId>%(marketplace)s</MarketplaceId><ASIN>%(asin)s</ASIN>'
+            '<ItemCondition>new</ItemCondition><TimeOfOfferChange>%(time)s</TimeOfOfferChange></OfferChangeTrigger><Summary>'
+            '<NumberOfOffers><OfferCount condition="new" fulfillmentChannel="Merchant">%(count)d</OfferCount></NumberOfOffers>'
+            '<LowestPrices><LowestPrice condition="new" fulfillmentChannel="Merchant">%(landed)s%(listing)s%(shipping)s</LowestPrice>'
+            '</LowestPrices><BuyBoxPrices><BuyBoxPrice condition="new">%(landed)s%(listing)s%(shipping)s</BuyBoxPrice>'
+            '</BuyBoxPrices></Summary><Offers>%(offers)s</Offers></AnyOfferChangedNotification></NotificationPayload>'
+            '</Notification>') % {
+               'sku':product['sku'],
+               'time':time_change.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+               'marketplace':marketplace_id,
+               'asin':product['asin'],
+               'count':offers,
+               'landed':amounts('LandedPrice', product['price'] + product['shipping']),
+               'listing':amounts('ListingPrice', product['price']),
+               'shipping':amounts('Shipping', product['shipping']),
+               'offers':''.join(offer_lines),
+           }
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Benchmarks of the hot paths of the connector against the stand-in of MWS (benchmarks/fake_mws.py).
+#
+# The benchmarks must be run on a database dedicated to them, without the job runner, because the catalog is committed
+# to be reused by the next runs and the queue jobs created during the run are deleted at the end. For each stage the
+# wall time, the queries of the cursor of the stage, the peak RSS of the process during the stage and its increase over
+# the RSS at the start of the stage are reported. The peak of the process is reset before each stage (/proc/self/clear_refs),
+# where it can't be reset the peak is of the whole run, so run the stages one by one to get their own peak.
+#
+#   python -m benchmarks.run -c odoo.conf -d benchmark --products 100000 --save-baseline baseline.json
+#   python -m benchmarks.run -c odoo.conf -d benchmark --products 100000 --baseline baseline.json --stages export_stock
+
+import argparse
+import json
+import logging
+import re
+import resource
+import sys
+import time
+import urllib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import requests
+
+from . import catalog
+from . import fake_mws
+from . import generator
+
+_logger = logging.getLogger('benchmarks')
+
+STAGES = ['http_pool', 'xml_parser', 'export_stock', 'stock_feed_xml', 'inventory_report', 'sqs_offers', 'list_orders']
+
+# Metrics compared with the baseline, a lower value is better for all of them
+COMPARED_METRICS = ('wall_time', 'queries', 'peak_rss_mb')
+
+
+class Context(object):
+
+    def __init__(self, env, backend, args, mws):
+        self.env = env
+        self.backend = backend
+        self.args = args
+        self.mws = mws
+
+
+def _read_status_mb(field):
+    """
+    Read a memory field (VmRSS, VmHWM) of /proc/self/status in megabytes, None if it isn't available
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak RSS of the process to its current RSS, so the peak of a stage isn't the one of the previous stages
+    :return: True if the peak has been reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def _rss_mb():
+    rss = _read_status_mb('VmRSS')
+    # ru_maxrss is in kilobytes on linux
+    return rss if rss is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _peak_rss_mb():
+    peak = _read_status_mb('VmHWM')
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _get_api(ctx):
+    from odoo.addons.connector_amazon.components.backend_adapter import AmazonAPI
+    return AmazonAPI(ctx.backend)
+
+
+# Stages
+
+def stage_http_pool(ctx):
+    """
+    Latency of the calls to MWS with the shared keep-alive session against a new connection by call
+    """
+    from odoo.addons.connector_amazon.mws.mws import Orders, get_session
+    api = Orders(backend=ctx.backend)
+    calls = ctx.args.calls
+    throttle, ctx.mws.throttle = ctx.mws.throttle, False
+    try:
+        timings = {}
+        for name, send in (('unpooled', lambda url:requests.get(url, headers={'Connection':'close'})),
+                           ('pooled', lambda url:get_session(api.domain).get(url))):
+            start = time.time()
+            for i in xrange(calls):
+                params = {'AWSAccessKeyId':ctx.backend.access_key, 'SellerId':ctx.backend.seller, 'SignatureVersion':'2',
+                          'SignatureMethod':'HmacSHA256', 'Version':api.version, 'Action':'GetServiceStatus',
+                          'Timestamp':datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+                description = '&'.join(['%s=%s' % (key, urllib.quote(params[key], safe='-_.~')) for key in sorted(params)])
+                url = '%s%s?%s&Signature=%s' % (api.domain, api.uri, description,
+                                                urllib.quote(api.calc_signature('GET', description)))
+                send(url).raise_for_status()
+            timings[name] = (time.time() - start) * 1000 / calls
+    finally:
+        ctx.mws.throttle = throttle
+    return {'calls':calls,
+            'unpooled_ms_per_call':round(timings['unpooled'], 3),
+            'pooled_ms_per_call':round(timings['pooled'], 3),
+            'speedup':round(timings['unpooled'] / timings['pooled'], 2) if timings['pooled'] else None}
+
+
+def stage_xml_parser(ctx):
+    """
+    Parse of a ListOrders response with the parser of xml2dict plus the namespace regex and with the iterparse parser
+    """
+    from odoo.addons.connector_amazon.mws import utils
+    namespace_regex = re.compile(' xmlns(:ns2)?="[^"]+"|(ns2:)|(xml:)')
+    orders = min(ctx.args.orders, 1000)
+    payload = ctx.mws.envelope('/Orders/2013-09-01', 'ListOrders',
+                               '<Orders>%s</Orders>' % ''.join([ctx.mws._order_xml(index) for index in xrange(orders)]))
+    rounds = ctx.args.rounds
+    start = time.time()
+    for i in xrange(rounds):
+        old = utils.xml2dict().fromstring(namespace_regex.sub('', payload))
+    old_time = (time.time() - start) * 1000 / rounds
+    start = time.time()
+    for i in xrange(rounds):
+        new = utils.iterxml2dict().fromstring(payload)
+    new_time = (time.time() - start) * 1000 / rounds
+    if old != new:
+        raise AssertionError('The parsers return different dicts')
+    return {'orders':orders,
+            'bytes':len(payload),
+            'xml2dict_ms':round(old_time, 3),
+            'iterxml2dict_ms':round(new_time, 3),
+            'speedup':round(old_time / new_time, 2) if new_time else None}
+
+
+def stage_export_stock(ctx):
+    ctx.env['amazon.product.product']._export_stock_backend(ctx.backend)
+    return {'feeds_to_throw':ctx.env['amazon.feed.tothrow'].search_count([('backend_id', '=', ctx.backend.id),
+                                                                           ('launched', '=', False)])}
+
+
+def stage_stock_feed_xml(ctx):
+    feed_model = ctx.env['amazon.feed.tothrow']
+    domain = [('backend_id', '=', ctx.backend.id), ('type', '=', '_POST_INVENTORY_AVAILABILITY_DATA_'), ('launched', '=', False)]
+    if not feed_model.search_count(domain):
+        # The stock of the catalog is already exported, we create a stock feed of all the details
+        ctx.env.cr.execute("""SELECT detail.id, product.sku, detail.stock, market.id_mws
+                              FROM amazon_product_product_detail detail
+                              JOIN amazon_product_product product ON product.id = detail.product_id
+                              JOIN amazon_config_marketplace market ON market.id = detail.marketplace_id
+                              WHERE product.backend_id = %s""", (ctx.backend.id,))
+        for detail_id, sku, stock, id_mws in ctx.env.cr.fetchall():
+            feed_model.create({'backend_id':ctx.backend.id,
+                               'type':'_POST_INVENTORY_AVAILABILITY_DATA_',
+                               'model':'amazon.product.product.detail',
+                               'identificator':detail_id,
+                               'data':{'sku':sku, 'Quantity':str(stock or 0), 'id_mws':id_mws}})
+        # batch_update_feeds marks the feeds as launched on a new cursor, so these must be committed
+        ctx.env.cr.commit()
+    feeds = feed_model.search(domain)
+    queries = ctx.env.cr.sql_log_count
+    start = time.time()
+    ids = _get_api(ctx)._submit_stock_update(feeds)
+    return {'feeds_to_throw':len(feeds), 'submitted_feeds':len(ids), 'wall_time':time.time() - start,
+            'queries':ctx.env.cr.sql_log_count - queries}
+
+
+def stage_inventory_report(ctx):
+    api = _get_api(ctx)
+    result = api._submit_report('submit_inventory_request')
+    if isinstance(result, Exception):
+        raise result
+    products = {}
+    for report_id, id_mws in result['report_ids']:
+        marketplace = ctx.backend.marketplace_ids.filtered(lambda market:market.id_mws == id_mws)
+        data = api._get_data_report(report_id, api._get_header_product_fieldnames(marketplace))
+        if data:
+            products = api._extract_info_product(data, marketplace, products)
+    return {'reports':len(result['report_ids']), 'products':len(products)}
+
+
+def stage_sqs_offers(ctx):
+    message_model = ctx.env['amazon.config.sqs.message']
+    markets = ctx.backend.marketplace_ids
+    messages = message_model.browse()
+    time_change = datetime.utcnow()
+    for index in xrange(ctx.args.messages):
+        product = catalog.product(index % ctx.args.products)
+        market = markets[index % len(markets)]
+        messages |= message_model.create({'id_message':'benchmark-%d-%d' % (index, time.time()),
+                                          'recept_handle':'benchmark',
+                                          'body':generator.offer_changed_message(product, market.id_mws, ctx.args.offers,
+                                                                                 time_change + timedelta(seconds=index))})
+    ctx.env.cr.commit()
+    queries = ctx.env.cr.sql_log_count
+    start = time.time()
+    for message in messages:
+        message_model._process_message(message)
+    return {'messages':len(messages), 'wall_time':time.time() - start, 'queries':ctx.env.cr.sql_log_count - queries}
+
+
+def stage_list_orders(ctx):
+    pages = orders = lines = 0
+    for page, _next_token in _get_api(ctx)._list_orders({'date_start':catalog.BASE_DATE.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                                         'marketplace_ids':ctx.backend._get_crypt_codes_marketplaces()}):
+        pages += 1
+        orders += len(page)
+        lines += sum(len(order.get('lines', [])) for order in page)
+    return {'pages':pages, 'orders':orders, 'lines':lines}
+
+
+# Run
+
+def run_stage(ctx, name):
+    stage = globals()['stage_%s' % name]
+    if not _reset_peak_rss():
+        _logger.warning('The peak RSS can\'t be reset, the peak RSS of %s is the one of the whole run', name)
+    start_rss = _rss_mb()
+    queries = ctx.env.cr.sql_log_count
+    start = time.time()
+    metrics = stage(ctx) or {}
+    peak_rss = _peak_rss_mb()
+    result = OrderedDict([('wall_time', time.time() - start),
+                          ('queries', ctx.env.cr.sql_log_count - queries),
+                          ('peak_rss_mb', round(peak_rss, 1)),
+                          ('rss_increase_mb', round(max(peak_rss - start_rss, 0), 1))])
+    # The stages with a setup measure only their hot path
+    result.update(metrics)
+    result['wall_time'] = round(result['wall_time'], 3)
+    ctx.env.cr.commit()
+    ctx.env.clear()
+    return result
+
+
+def speed_up_quotas(env, speedup):
+    """
+    Divide the restore rates of MWS by the speedup of the stand-in, so the quota control waits the same as the server
+    :return: original restore rates to restore them at the end
+    """
+    original = {}
+    if speedup != 1:
+        for control in env['amazon.control.request'].search([]):
+            original[control.id] = control.restore_rate
+            control.restore_rate = control.restore_rate / speedup
+        env.cr.commit()
+    return original
+
+
+def restore_quotas(env, original):
+    for control in env['amazon.control.request'].browse(original.keys()):
+        control.restore_rate = original[control.id]
+    env.cr.commit()
+
+
+def clean_up(env, backend, started):
+    """
+    Remove the data created by the stages, the catalog is kept
+    """
+    env.cr.execute("DELETE FROM amazon_feed_tothrow WHERE backend_id = %s", (backend.id,))
+    env.cr.execute("DELETE FROM amazon_feed WHERE backend_id = %s", (backend.id,))
+    env.cr.execute("DELETE FROM amazon_config_sqs_message WHERE id_message LIKE 'benchmark-%%'")
+    env.cr.execute("""DELETE FROM amazon_historic_product_offer
+                      WHERE message_body IS NOT NULL AND product_detail_id IN (SELECT detail.id
+                                                                               FROM amazon_product_product_detail detail
+                                                                               JOIN amazon_product_product product ON product.id = detail.product_id
+                                                                               WHERE product.backend_id = %s)""", (backend.id,))
+    env.cr.execute("DELETE FROM queue_job WHERE date_created >= %s", (started,))
+    env.cr.commit()
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of the regressions (stage, metric, baseline value, value)
+    """
+    regressions = []
+    for stage, metrics in results['stages'].iteritems():
+        base = baseline.get('stages', {}).get(stage)
+        if not base:
+            print '%-18s no baseline' % stage
+            continue
+        for metric in COMPARED_METRICS:
+            if not base.get(metric) or metrics.get(metric) is None:
+                continue
+            change = (metrics[metric] - base[metric]) / float(base[metric])
+            flag = ''
+            if change > tolerance:
+                flag = ' REGRESSION'
+                regressions.append((stage, metric, base[metric], metrics[metric]))
+            print '%-18s %-12s %12s -> %-12s %+7.1f%%%s' % (stage, metric, base[metric], metrics[metric], change * 100, flag)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the Amazon connector')
+    parser.add_argument('-c', '--config', help='Configuration file of odoo')
+    parser.add_argument('-d', '--database', required=True, help='Database dedicated to the benchmarks')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Stages to run: %s' % ','.join(STAGES))
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--marketplaces', type=int, default=3)
+    parser.add_argument('--offers', type=int, default=5, help='Offers by historic and by SQS message')
+    parser.add_argument('--bom-each', type=int, default=10, help='One of each n products is a kit')
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200, help='AnyOfferChanged messages to process')
+    parser.add_argument('--calls', type=int, default=200, help='Calls of the http_pool stage')
+    parser.add_argument('--rounds', type=int, default=20, help='Rounds of the xml_parser stage')
+    parser.add_argument('--endpoint', help='Stand-in of MWS already running, by default one is started in-process')
+    parser.add_argument('--quota-speedup', type=float, default=100., help='Factor applied to the restore rates of MWS')
+    parser.add_argument('--baseline', help='Json file with the results to compare with')
+    parser.add_argument('--save-baseline', help='Save the results on this json file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed increase over the baseline (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error('Unknown stages: %s' % ', '.join(sorted(unknown)))
+
+    import odoo
+    odoo.tools.config.parse_config((['-c', args.config] if args.config else []) + ['-d', args.database])
+    from odoo.addons.connector_amazon.mws import mws as mws_module
+
+    access_key, secret = 'BENCHMARK', 'BENCHMARK'
+    mws = fake_mws.FakeMWS(credentials={access_key:secret}, skus=args.products, orders=args.orders, speedup=args.quota_speedup)
+    if args.endpoint:
+        mws_module.ENDPOINT = args.endpoint
+    else:
+        server = fake_mws.serve_in_thread(mws)
+        mws_module.ENDPOINT = 'http://127.0.0.1:%d' % server.server_port
+
+    results = {'date':datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+               'params':{'products':args.products, 'marketplaces':args.marketplaces, 'offers':args.offers, 'orders':args.orders,
+                         'messages':args.messages, 'quota_speedup':args.quota_speedup},
+               'stages':OrderedDict()}
+    started = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    registry = odoo.registry(args.database)
+    with odoo.api.Environment.manage(), registry.cursor() as cr:
+        env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+        backend = generator.generate(env, args.products, args.marketplaces, args.offers, args.bom_each, access_key, secret)
+        original_quotas = speed_up_quotas(env, args.quota_speedup)
+        ctx = Context(env, backend, args, mws)
+        try:
+            for name in stages:
+                _logger.info('Running stage %s', name)
+                results['stages'][name] = run_stage(ctx, name)
+                print '%-18s %s' % (name, json.dumps(results['stages'][name]))
+        finally:
+            cr.rollback()
+            restore_quotas(env, original_quotas)
+            clean_up(env, backend, started)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('params') != results['params']:
+            print 'The params of the baseline are different: %s' % baseline.get('params')
+        regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
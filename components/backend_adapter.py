@@ -4,18 +4,19 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 # This project is based on connector-magneto, developed by Camptocamp SA
 
-import StringIO
-import ast
+import json
 import logging
 import re
+import types
+import uuid
 import odoo
 
+from collections import Counter
 from datetime import datetime, timedelta
 
 import boto3
 import dateutil.parser
 import unicodecsv
-from lxml import etree
 from odoo import api
 from odoo.addons.component.core import AbstractComponent
 from odoo.addons.queue_job.exception import FailedJobError, RetryableJobError
@@ -23,9 +24,21 @@ from odoo.fields import Datetime
 from odoo.modules.registry import RegistryManager
 
 # from ..models.config.common import MAX_NUMBER_SQS_MESSAGES_TO_RECEIVE
+from ..mws.envelope import EnvelopeWriter
+from ..mws.feed_parts import split_envelope, split_flat_file
 from ..mws.mws import MWSError
 
 MAX_NUMBER_FFED_TO_PROCESS = 5000000
+# Feeds to throw that are given to a submitter at once, it is set with amazon_feeds_to_throw_page_size on the odoo configuration file
+FEEDS_TO_THROW_PAGE_SIZE = int(odoo.tools.config.get('amazon_feeds_to_throw_page_size', 50000))
+
+# Submitters of the feeds to throw, the migrations go first because they add inventory feeds
+FEED_SUBMITTERS = [('Migrate_backend', '_migrate_backend_feeds', 'migrate backend'),
+                   ('_POST_FLAT_FILE_INVLOADER_DATA_', '_submit_add_inventory_request', 'add inventory'),
+                   ('_POST_FLAT_FILE_FULFILLMENT_DATA_', '_submit_confirm_shipment', 'confirm shipments'),
+                   ('_POST_INVENTORY_AVAILABILITY_DATA_', '_submit_stock_update', 'stock update'),
+                   ('_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_', '_submit_stock_price_update', 'update stock price'),
+                   ('_POST_PRODUCT_DATA_DELETE_', '_submit_delete_inventory_request', 'delete inventory'), ]
 
 _logger = logging.getLogger(__name__)
 
@@ -43,6 +56,12 @@ AMAZON_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 AMAZON_ORDER_ID_PATTERN = '^([\d]{3}-[\d]{7}-[\d]{7})+$'
 
+# Max number of skus that MWS accepts on a request of GetMyPriceForSKU, GetCompetitivePricingForSKU or GetLowestOfferListingsForSKU
+MAX_SKUS_PRODUCTS_REQUEST = 20
+
+# Max number of estimates that MWS accepts on a request of GetMyFeesEstimate
+MAX_FEES_ESTIMATE_REQUEST = 20
+
 AMAZON_SUBMIT_REPORT_METHOD_DICT = {'submit_inventory_request':'_GET_MERCHANT_LISTINGS_ALL_DATA_',
                                     'submit_sales_request':'_GET_FLAT_FILE_ORDERS_DATA_',
                                     'submit_updated_sales_request':'_GET_FLAT_FILE_ALL_ORDERS_DATA_BY_LAST_UPDATE_'}
@@ -54,6 +73,8 @@ AMAZON_METHOD_LIST = ['get_inventory',
                       'list_items_from_order',
                       'get_category_product',
                       'get_my_price_product',
+                      'get_my_price_products',
+                      'get_my_estimate_fees',
                       'get_lowest_price_and_buybox',
                       'get_offers_changed',
                       'save_feed_response',
@@ -92,8 +113,14 @@ class AmazonAPI(object):
         return ''
 
     @api.multi
-    def batch_update_feeds(self, feeds):
+    def batch_update_feeds(self, feeds, feed_batch=None, feed_part=None):
+        """
+        Mark the feeds to throw as launched on a new cursor
+        :param feed_batch: batch of the amazon.feed where the feeds to throw have been submitted
+        :param feed_part: part of the batch where the feeds to throw have been submitted
+        """
         if feeds:
+            date_launched = datetime.now().isoformat(sep=' ')
             with api.Environment.manage():
                 with odoo.registry(
                         feeds.env.cr.dbname).cursor() as new_cr:
@@ -103,17 +130,86 @@ class AmazonAPI(object):
                         while feeds:
                             batch_update = feeds[0:1000]
                             feeds -= batch_update
-                            # do not attach new env to self because it may be
-                            # huge, and the cache is cleaned after each unlink
-                            # so we do not want to much record is the env in
-                            # which we call unlink because odoo would prefetch
-                            # fields, cleared right after.
-                            batch_update.with_env(new_env).write({'launched':True, 'date_launched':datetime.now().isoformat(sep=' ')})
+                            # The feeds are updated with sql because the pending changes replaced while they were
+                            # submitted are deleted, and the orm would fail writing them
+                            new_env.cr.execute("""UPDATE amazon_feed_tothrow
+                                                  SET launched = TRUE, date_launched = %s, feed_batch = COALESCE(%s, feed_batch),
+                                                      feed_part = COALESCE(%s, feed_part),
+                                                      write_uid = %s, write_date = (now() at time zone 'UTC')
+                                                  WHERE id = ANY(%s)""",
+                                               (date_launched, feed_batch, feed_part, new_env.uid, batch_update.ids))
                             new_env.cr.commit()
                     except Exception as e:
                         _logger.exception(
                             "Failed to update feeds : %s" % (feeds._name, str(e)))
 
+    def _read_feeds_data(self, feeds):
+        """
+        Read the data of the feeds to throw with a query
+        :return: list of tuples with the id, the dict of the data and the create date of each feed
+        """
+        if not feeds:
+            return []
+        feeds.env.cr.execute("""SELECT id, data, create_date FROM amazon_feed_tothrow WHERE id = ANY(%s) ORDER BY create_date, id""",
+                             (feeds.ids,))
+        return [(feed_id, json.loads(data), create_date) for feed_id, data, create_date in feeds.env.cr.fetchall()]
+
+    def _get_json_text(self, value):
+        """
+        Text of a value of the data of a feed, the same that the ->> operator of postgres returns
+        """
+        if value is None or isinstance(value, basestring):
+            return value
+        return json.dumps(value)
+
+    def _read_last_feeds_data(self, feeds, keys=None):
+        """
+        Read the data of the feeds to throw with a query, when there are some feeds of the same sku on a marketplace only the last one is read
+        :param keys: keys of the data to read, if they aren't informed all the data is read
+        :return: dict {id_mws: {sku: data}}, the data has on '_feed_ids' the ids of all the feeds of the sku
+        """
+        dict_products = {}
+        if not feeds:
+            return dict_products
+        # The feeds are grouped by the sku and marketplace columns, only the data of the last feed of each sku is loaded
+        feeds.env.cr.execute("""SELECT DISTINCT ON (id_mws, sku) id_mws, array_agg(id) OVER (PARTITION BY id_mws, sku), data
+                                FROM amazon_feed_tothrow
+                                WHERE id = ANY(%s)
+                                ORDER BY id_mws, sku, create_date DESC, id DESC""",
+                             (feeds.ids,))
+        for id_mws, feed_ids, data in feeds.env.cr.fetchall():
+            element = json.loads(data)
+            if keys:
+                element = {key:self._get_json_text(element.get(key)) for key in keys}
+            element['_feed_ids'] = feed_ids
+            dict_products.setdefault(id_mws, {})[element['sku']] = element
+        return dict_products
+
+    def _get_pending_parts(self, dict_products):
+        """
+        Count the products of each feed to throw, a feed to throw is launched when all its products have been submitted
+        """
+        pending_parts = Counter()
+        for products in dict_products.itervalues():
+            for product in products.itervalues():
+                pending_parts.update(product['_feed_ids'])
+        return pending_parts
+
+    def _mark_part_launched(self, products, pending_parts, feed_batch, feed_part):
+        """
+        Mark as launched the feeds to throw whose products have been submitted on a part, so if a next part fails only
+        the feeds of the parts not submitted are pending
+        :param products: products submitted on the part
+        """
+        feed_ids = []
+        for product in products:
+            for feed_id in product['_feed_ids']:
+                pending_parts[feed_id] -= 1
+                if pending_parts[feed_id] <= 0:
+                    feed_ids.append(feed_id)
+        self.batch_update_feeds(self._backend.env['amazon.feed.tothrow'].browse(feed_ids), feed_batch=feed_batch,
+                                feed_part=feed_part)
+
     @api.multi
     def _save_sqs_messages(self, messages, remove_messages=True):
         """
@@ -232,68 +328,69 @@ class AmazonAPI(object):
         return
 
     @api.multi
+    def _get_feeds_to_throw_groups(self, feed_type):
+        """
+        Get the marketplaces of the feeds of a type pending to throw, the feeds without marketplace are on the group ''
+        """
+        self._backend.env.cr.execute("""SELECT DISTINCT COALESCE(split_part(pending_key, ',', 1), '')
+                                        FROM amazon_feed_tothrow
+                                        WHERE backend_id = %s AND type = %s AND launched IS NOT TRUE""",
+                                     (self._backend.id, feed_type))
+        return [row[0] for row in self._backend.env.cr.fetchall()]
+
+    def _get_feeds_to_throw_pages(self, feed_type, marketplace, limit):
+        """
+        Generator of the pages of the feeds of a group pending to throw, the pages are read by id so the feeds that
+        aren't marked as launched by the submitter aren't read again
+        :return: recordsets of amazon.feed.tothrow
+        """
+        feed_model = self._backend.env['amazon.feed.tothrow']
+        last_id = 0
+        while limit > 0:
+            self._backend.env.cr.execute("""SELECT id FROM amazon_feed_tothrow
+                                            WHERE backend_id = %s AND type = %s AND launched IS NOT TRUE
+                                              AND COALESCE(split_part(pending_key, ',', 1), '') = %s AND id > %s
+                                            ORDER BY id
+                                            LIMIT %s""",
+                                         (self._backend.id, feed_type, marketplace, last_id, min(limit, FEEDS_TO_THROW_PAGE_SIZE)))
+            ids = [row[0] for row in self._backend.env.cr.fetchall()]
+            if not ids:
+                return
+            last_id = ids[-1]
+            limit -= len(ids)
+            yield feed_model.browse(ids)
+
     def _submit_feeds(self):
         """
         Method that get feeds of our database and submit the method of every type of feed
+        Each type and marketplace is submitted on pages, if a group fails the rest of groups are submitted
         :return: None
         """
-        feeds_to_throw = self._backend.env['amazon.feed.tothrow'].search([('backend_id', '=', self._backend.id),
-                                                                          ('launched', '=', False), ],
-                                                                         order='type',
-                                                                         limit=MAX_NUMBER_FFED_TO_PROCESS)
-
-        if feeds_to_throw:
-
-            try:
-                # If there are migrate feeds this method is the charge of add inventory feeds
-                migrate_backend_feeds = feeds_to_throw.filtered(lambda f:f.type == 'Migrate_backend')
-                if migrate_backend_feeds:
-                    self._migrate_backend_feeds(migrate_feeds=migrate_backend_feeds)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds migrate backend(%s): %s' % (self._backend.name, e.message))
-
-            try:
-                add_inventory_feeds = feeds_to_throw.filtered(lambda f:f.type == '_POST_FLAT_FILE_INVLOADER_DATA_')
-                if add_inventory_feeds:
-                    self._submit_add_inventory_request(arguments=add_inventory_feeds)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds add inventory(%s): %s' % (self._backend.name, e.message))
-
-            try:
-                confirm_shipments = feeds_to_throw.filtered(lambda f:f.type == '_POST_FLAT_FILE_FULFILLMENT_DATA_')
-                if confirm_shipments:
-                    self._submit_confirm_shipment(arguments=confirm_shipments)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds confirm shipments(%s): %s' % (self._backend.name, e.message))
-
-            try:
-                update_stock_feeds = feeds_to_throw.filtered(lambda f:f.type == '_POST_INVENTORY_AVAILABILITY_DATA_')
-
-                if update_stock_feeds:
-                    self._submit_stock_update(arguments=update_stock_feeds)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds stock update(%s): %s' % (self._backend.name, e.message))
-
-            try:
-                update_stock_price_feeds = feeds_to_throw.filtered(lambda f:f.type == '_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_')
-                if update_stock_price_feeds:
-                    self._submit_stock_price_update(arguments=update_stock_price_feeds)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds update stock price(%s): %s' % (self._backend.name, e.message))
-
-            try:
-                delete_inventory_feeds = feeds_to_throw.filtered(lambda f:f.type == '_POST_PRODUCT_DATA_DELETE_')
-                if delete_inventory_feeds:
-                    self._submit_delete_inventory_request(arguments=delete_inventory_feeds)
-            except Exception as e:
-                _logger.error('Error has been ocurred on feeds add inventory(%s): %s' % (self._backend.name, e.message))
-
-    def _save_feed(self, response, params, xml_csv):
+        limit = MAX_NUMBER_FFED_TO_PROCESS
+        for feed_type, submitter, name in FEED_SUBMITTERS:
+            for marketplace in self._get_feeds_to_throw_groups(feed_type):
+                try:
+                    # The changes of a failed group are rolled back, so the next groups have a clean transaction
+                    with self._backend.env.cr.savepoint():
+                        for feeds in self._get_feeds_to_throw_pages(feed_type, marketplace, limit):
+                            limit -= len(feeds)
+                            getattr(self, submitter)(feeds)
+                            # The feeds of the page aren't needed anymore
+                            feeds.invalidate_cache(ids=feeds.ids)
+                except Exception as e:
+                    _logger.error('Error has been ocurred on feeds %s(%s) of %s: %s' % (name, self._backend.name, marketplace or '-',
+                                                                                      e.message))
+                if limit <= 0:
+                    return
+
+    def _save_feed(self, response, params, xml_csv, feed_batch=None, feed_part=None):
         """
         Method to save the feed that have been launched rigth now
         :param response:
         :param params:
         :param xml_csv:
+        :param feed_batch: batch of the feeds to throw submitted, it is shared by all the parts of the batch
+        :param feed_part: number of the part of the batch
         :return:
         """
         amz_feed = self._backend.env['amazon.feed']
@@ -307,6 +404,8 @@ class AmazonAPI(object):
                     'feed_processing_status':info_feed.getvalue('FeedProcessingStatus'),
                     'params':params.encode('utf8') if params else None,
                     'xml_csv':xml_csv.decode('utf8') if xml_csv else None,
+                    'feed_batch':feed_batch,
+                    'feed_part':feed_part,
                     'backend_id':self._backend.id}
 
             amz_feed.create(vals)
@@ -330,17 +429,6 @@ class AmazonAPI(object):
         """
         feedsApi = Feeds(backend=self._backend)
 
-        top = etree.Element('AmazonEnvelope')
-
-        header = etree.SubElement(top, 'Header')
-        docVersion = etree.SubElement(header, 'DocumentVersion')
-        docVersion.text = '1.01'
-        merchantId = etree.SubElement(header, 'MerchantIdentifier')
-        merchantId.text = self._backend.token
-
-        messageType = etree.SubElement(top, 'MessageType')
-        messageType.text = 'Product'
-
         dict_products = {}
 
         '''
@@ -352,9 +440,7 @@ class AmazonAPI(object):
                          
                          {'amazon_product_id': 70144, 'new_backend_id': 6, 'marketplace_ids': [1, 2, 3, 4, 5, 9]}
         '''
-        for feed_to_throw in arguments:
-            element = ast.literal_eval(feed_to_throw.data)
-            element['create_date'] = feed_to_throw.create_date
+        for feed_id, element, create_date in self._read_feeds_data(arguments):
             amazon_product = self._backend.env['amazon.product.product'].browse(element['amazon_product_id'])
             marketplaces = self._backend.env['amazon.config.marketplace'].browse(element['marketplace_ids'])
 
@@ -364,43 +450,37 @@ class AmazonAPI(object):
                 if not dict_products.get(market.id_mws):
                     dict_products[market.id_mws] = {}
 
-                # We check if the sku is added on this marketplace
+                # The sku is deleted once on each marketplace, it is launched with all the feeds that delete it
                 if not dict_products[market.id_mws].get(amazon_product.sku):
-                    dict_products[market.id_mws][amazon_product.sku] = {'sku':amazon_product.sku, 'create_date':element['create_date']}
-                elif dict_products[market.id_mws][amazon_product.sku]['create_date'] < element['create_date']:
-                    dict_products[market.id_mws].pop(amazon_product.sku)
-                    dict_products[market.id_mws][amazon_product.sku] = {'sku':amazon_product.sku, 'create_date':element['create_date']}
+                    dict_products[market.id_mws][amazon_product.sku] = {'sku':amazon_product.sku, '_feed_ids':[]}
+                dict_products[market.id_mws][amazon_product.sku]['_feed_ids'].append(feed_id)
 
         ids = []
+        feed_batch = uuid.uuid4().hex
+        params = str(arguments)
+        part = 0
+        pending_parts = self._get_pending_parts(dict_products)
         for id_market in dict_products.keys():
-            i = 1
-
-            for product in dict_products[id_market].values():
-                message = etree.SubElement(top, 'Message')
-                messageID = etree.SubElement(message, 'MessageID')
-                messageID.text = str(i)
-                i += 1
-
-                operationType = etree.SubElement(message, 'OperationType')
-                operationType.text = 'Delete'
-
-                product_node = etree.SubElement(message, 'Product')
-
-                sku = etree.SubElement(product_node, 'SKU')
-                sku.text = product['sku']
-
-            xml = etree.tostring(top, pretty_print=True, xml_declaration=True, encoding='UTF-8')
-
-            xml = xml.replace('<AmazonEnvelope>',
-                              '<AmazonEnvelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="amzn-envelope.xsd">')
-
-            _logger.info('_POST_PRODUCT_DATA_ - Delete product feed: [%s]' % xml)
-            response = feedsApi.submit_feed(feed=xml,
-                                            feed_type='_POST_PRODUCT_DATA_',
-                                            marketplaceids=[id_market])
-
-            ids.append({'id_feed':self._save_feed(response=response, params=str(arguments), xml_csv=xml) or 'Error',
-                        'id_mws':id_market})
+            products = dict_products[id_market].values()
+            sent = 0
+            messages = (('Delete', 'Product', [('SKU', product['sku'])]) for product in products)
+            for envelope in split_envelope(self._backend.token, 'Product', messages):
+                part += 1
+                _logger.info('_POST_PRODUCT_DATA_ - Delete product feed of %s (part %d): %s', id_market, part, envelope.summary())
+                response = feedsApi.submit_feed(feed=envelope.file,
+                                                feed_type='_POST_PRODUCT_DATA_',
+                                                marketplaceids=[id_market],
+                                                content_md5=envelope.md5)
+
+                ids.append({'id_feed':self._save_feed(response=response, params=params, xml_csv=envelope.content, feed_batch=feed_batch,
+                                                      feed_part=part) or 'Error',
+                            'id_mws':id_market})
+                self._mark_part_launched(products[sent:sent + envelope.messages], pending_parts, feed_batch, part)
+                sent += envelope.messages
+                envelope.close()
+
+        # The feeds without products haven't anything to submit
+        self.batch_update_feeds(arguments.browse([feed_id for feed_id in arguments.ids if feed_id not in pending_parts]))
 
         return ids
 
@@ -413,8 +493,7 @@ class AmazonAPI(object):
         :return:
         """
         self._submit_delete_inventory_request(migrate_feeds)
-        for feed in migrate_feeds:
-            element = ast.literal_eval(feed.data)
+        for feed_id, element, create_date in self._read_feeds_data(migrate_feeds):
             amazon_product = self._backend.env['amazon.product.product'].browse(element['amazon_product_id'])
             for market_id in element['marketplace_ids']:
                 detail = amazon_product.get_market_detail_product(market_id)
@@ -462,8 +541,6 @@ class AmazonAPI(object):
         """
         feedsApi = Feeds(backend=self._backend)
 
-        dict_products = {}
-
         '''
         Dict structure
         dict_products = {'A1RKKUPIHCS9HS':
@@ -471,66 +548,32 @@ class AmazonAPI(object):
                          'CH-N74Z-DD0S': {'sku': 'CH-N74Z-DD0S', 'Quantity': 5,'id_mws':'A1RKKUPIHCS9HS'},
                          '9P-NBB6-095H': {'sku': '9P-NBB6-095H', 'Quantity': 4, 'id_mws': 'A1RKKUPIHCS9HS'}}}
         '''
-        for feed_to_throw in arguments:
-            element = ast.literal_eval(feed_to_throw.data)
-            element['create_date'] = feed_to_throw.create_date
-            # If there isn't the markeplace added we add this
-            if not dict_products.get(element['id_mws']):
-                dict_products[element['id_mws']] = {}
-
-            # We check if the sku is added on this marketplace
-            if not dict_products[element['id_mws']].get(element['sku']):
-                dict_products[element['id_mws']][element['sku']] = element
-            elif dict_products[element['id_mws']][element['sku']]['create_date'] < element['create_date']:
-                dict_products[element['id_mws']].pop(element['sku'])
-                dict_products[element['id_mws']][element['sku']] = element
+        dict_products = self._read_last_feeds_data(arguments, keys=('sku', 'Quantity'))
 
         ids = []
+        feed_batch = uuid.uuid4().hex
+        params = str(arguments)
+        part = 0
+        pending_parts = self._get_pending_parts(dict_products)
         for id_market in dict_products.keys():
-            i = 1
-
-            top = etree.Element('AmazonEnvelope')
-
-            header = etree.SubElement(top, 'Header')
-            docVersion = etree.SubElement(header, 'DocumentVersion')
-            docVersion.text = '1.01'
-            merchantId = etree.SubElement(header, 'MerchantIdentifier')
-            merchantId.text = self._backend.token
-
-            messageType = etree.SubElement(top, 'MessageType')
-            messageType.text = 'Inventory'
-
-            for product in dict_products[id_market].values():
-                message = etree.SubElement(top, 'Message')
-                messageID = etree.SubElement(message, 'MessageID')
-                messageID.text = str(i)
-                i += 1
-
-                operationType = etree.SubElement(message, 'OperationType')
-                operationType.text = 'Update'
-
-                inventory = etree.SubElement(message, 'Inventory')
-
-                sku = etree.SubElement(inventory, 'SKU')
-                sku.text = product['sku']
-                quantity = etree.SubElement(inventory, 'Quantity')
-                quantity.text = str(product['Quantity'])
-
-            xml = etree.tostring(top, pretty_print=True, xml_declaration=True, encoding='UTF-8')
-
-            xml = xml.replace('<AmazonEnvelope>',
-                              '<AmazonEnvelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="amzn-envelope.xsd">')
-
-            _logger.info('_POST_INVENTORY_AVAILABILITY_DATA_ feed: [%s]' % xml)
-            response = feedsApi.submit_feed(feed=xml,
-                                            feed_type='_POST_INVENTORY_AVAILABILITY_DATA_',
-                                            marketplaceids=[id_market])
-
-            ids.append({'id_feed':self._save_feed(response=response, params=str(arguments), xml_csv=xml) or 'Error', 'id_mws':id_market})
-
-            xml = None
-
-        self.batch_update_feeds(arguments)
+            products = dict_products[id_market].values()
+            sent = 0
+            messages = (('Update', 'Inventory', [('SKU', product['sku']), ('Quantity', str(product['Quantity']))])
+                        for product in products)
+            for envelope in split_envelope(self._backend.token, 'Inventory', messages):
+                part += 1
+                _logger.info('_POST_INVENTORY_AVAILABILITY_DATA_ feed of %s (part %d): %s', id_market, part, envelope.summary())
+                response = feedsApi.submit_feed(feed=envelope.file,
+                                                feed_type='_POST_INVENTORY_AVAILABILITY_DATA_',
+                                                marketplaceids=[id_market],
+                                                content_md5=envelope.md5)
+
+                ids.append({'id_feed':self._save_feed(response=response, params=params, xml_csv=envelope.content, feed_batch=feed_batch,
+                                                      feed_part=part) or 'Error',
+                            'id_mws':id_market})
+                self._mark_part_launched(products[sent:sent + envelope.messages], pending_parts, feed_batch, part)
+                sent += envelope.messages
+                envelope.close()
 
         return ids
 
@@ -558,50 +601,20 @@ class AmazonAPI(object):
         '''
         feed_ids = []
         for id_market in dict_products.keys():
-            i = 1
-
-            top = etree.Element('AmazonEnvelope')
-
-            header = etree.SubElement(top, 'Header')
-            docVersion = etree.SubElement(header, 'DocumentVersion')
-            docVersion.text = '1.01'
-            merchantId = etree.SubElement(header, 'MerchantIdentifier')
-            merchantId.text = self._backend.token
-
-            messageType = etree.SubElement(top, 'MessageType')
-            messageType.text = 'Price'
-
-            for product in dict_products[id_market].values():
-                message = etree.SubElement(top, 'Message')
-                messageID = etree.SubElement(message, 'MessageID')
-                messageID.text = str(i)
-
-                operationType = etree.SubElement(message, 'OperationType')
-                operationType.text = 'Update'
+            with EnvelopeWriter(self._backend.token, 'Price') as envelope:
+                for product in dict_products[id_market].values():
+                    envelope.add_message('Update', 'Price', [('SKU', product['sku']),
+                                                             ('StandardPrice', product['price'], {'currency':product['currency']})])
 
-                price = etree.SubElement(message, 'Price')
+            _logger.info('_POST_PRODUCT_PRICING_DATA_ feed of %s: %s', id_market, envelope.summary())
 
-                sku = etree.SubElement(price, 'SKU')
-                sku.text = product['sku']
-                standard_price = etree.SubElement(price, 'StandardPrice')
-                standard_price.text = product['price']
-                standard_price.set('currency', product['currency'])
-                i += 1
-
-            xml = etree.tostring(top, pretty_print=True, xml_declaration=True, encoding='UTF-8')
-
-            xml = xml.replace('<AmazonEnvelope>',
-                              '<AmazonEnvelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="amzn-envelope.xsd">')
-
-            _logger.info('_POST_PRODUCT_PRICING_DATA_ feed: [%s]' % xml)
-
-            response = feedsApi.submit_feed(feed=xml,
+            response = feedsApi.submit_feed(feed=envelope.file,
                                             feed_type='_POST_PRODUCT_PRICING_DATA_',
-                                            marketplaceids=[id_market])
+                                            marketplaceids=[id_market],
+                                            content_md5=envelope.md5)
 
-            feed_ids.append(self._save_feed(response=response, params=str(arguments), xml_csv=xml))
-
-            xml = None
+            feed_ids.append(self._save_feed(response=response, params=str(arguments), xml_csv=envelope.content))
+            envelope.close()
 
         return feed_ids
 
@@ -613,54 +626,48 @@ class AmazonAPI(object):
         """
         feedsApi = Feeds(backend=self._backend)
 
-        dict_products = {}
-
         '''
         Dict structure
         dict_products = [{'sku': 'D5-0BJZ-39B4', 'price': '84.80', 'Quantity': 4, 'id_mws':'A1RKKUPIHCS9HS', 'handling_time':2},
                          {'sku': 'CH-N74Z-DD0S', 'price': '24,45', 'Quantity': 5, 'id_mws':'A1RKKUPIHCS9HS', 'handling_time':4}]
         '''
 
-        for feed_to_throw in arguments:
-            element = ast.literal_eval(feed_to_throw.data)
-            element['create_date'] = feed_to_throw.create_date
-            # If there isn't the markeplace added we add this
-            if not dict_products.get(element['id_mws']):
-                dict_products[element['id_mws']] = {}
-
-            # We check if the sku is added on this marketplace
-            if not dict_products[element['id_mws']].get(element['sku']):
-                dict_products[element['id_mws']][element['sku']] = element
-            elif dict_products[element['id_mws']][element['sku']]['create_date'] < element['create_date']:
-                dict_products[element['id_mws']].pop(element['sku'])
-                dict_products[element['id_mws']][element['sku']] = element
+        dict_products = self._read_last_feeds_data(arguments, keys=('sku', 'Price', 'minimum-seller-allowed-price',
+                                                                    'maximum-seller-allowed-price', 'Quantity',
+                                                                    'fulfillment-channel', 'handling-time'))
 
         feed_ids = []
+        feed_batch = uuid.uuid4().hex
+        params = str(arguments)
+        part = 0
+        pending_parts = self._get_pending_parts(dict_products)
         for id_market in dict_products.keys():
 
             titles = ('sku', 'price', 'minimum-seller-allowed-price', 'maximum-seller-allowed-price', 'quantity', 'fulfillment-channel', 'leadtime-to-ship')
-            csv_data = '\t'
-            csv_data = csv_data.join(titles) + '\n'
+            header = '\t'.join(titles) + '\n'
+            rows = []
+            products = dict_products[id_market].values()
+            sent = 0
 
-            for product in dict_products[id_market].values():
-                data = '\t'
+            for product in products:
                 product_data = (product.get('sku') or '', product.get('Price') or '', product.get('minimum-seller-allowed-price') or '',
                                 product.get('maximum-seller-allowed-price') or '', product.get('Quantity') or '0',
                                 product.get('fulfillment-channel') or '',
                                 product.get('handling-time') or '')
-                data = data.join(product_data) + '\n'
-                csv_data = csv_data + data
-
-            _logger.info('_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_ feed: [%s]' % csv_data)
+                rows.append('\t'.join(product_data) + '\n')
 
-            response = feedsApi.submit_feed(feed=csv_data,
-                                            feed_type='_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_',
-                                            marketplaceids=[id_market])
+            for csv_data, number_rows in split_flat_file(header, rows):
+                part += 1
+                _logger.info('_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_ feed of %s (part %d): %d rows, %d bytes', id_market, part,
+                             number_rows, len(csv_data))
 
-            feed_ids.append(self._save_feed(response=response, params=str(arguments), xml_csv=csv_data))
+                response = feedsApi.submit_feed(feed=csv_data,
+                                                feed_type='_POST_FLAT_FILE_PRICEANDQUANTITYONLY_UPDATE_DATA_',
+                                                marketplaceids=[id_market])
 
-        # We are going to write the feed as launched
-        self.batch_update_feeds(arguments)
+                feed_ids.append(self._save_feed(response=response, params=params, xml_csv=csv_data, feed_batch=feed_batch, feed_part=part))
+                self._mark_part_launched(products[sent:sent + number_rows], pending_parts, feed_batch, part)
+                sent += number_rows
 
         return feed_ids
 
@@ -679,24 +686,13 @@ class AmazonAPI(object):
                          {'sku': 'CH-N74Z-DD0S', 'product-id-type': 'ASIN', 'product-id': 'B44S70ERQA', 'item-condition': '11', 'price': '24,45', 'Quantity': 5, 'id_mws':'A1RKKUPIHCS9HS', 'handling_time':4}]
         '''
 
-        dict_products = {}
-
-        # We are going to create a dict to transform on csv
-        for feed_to_throw in arguments:
-            element = ast.literal_eval(feed_to_throw.data)
-            element['create_date'] = feed_to_throw.create_date
-
-            if not dict_products.get(element['id_mws']):
-                dict_products[element['id_mws']] = {}
-
-            # We check if the sku is added on this marketplace
-            if not dict_products[element['id_mws']].get(element['sku']):
-                dict_products[element['id_mws']][element['sku']] = element
-            elif dict_products[element['id_mws']][element['sku']]['create_date'] < element['create_date']:
-                dict_products[element['id_mws']].pop(element['sku'])
-                dict_products[element['id_mws']][element['sku']] = element
+        dict_products = self._read_last_feeds_data(arguments)
 
         feed_ids = []
+        feed_batch = uuid.uuid4().hex
+        params = str(arguments)
+        part = 0
+        pending_parts = self._get_pending_parts(dict_products)
 
         for id_market in dict_products.keys():
 
@@ -710,10 +706,12 @@ class AmazonAPI(object):
                       'supplier_declared_dg_hz_regulation4', 'supplier_declared_dg_hz_regulation5', 'hazmat_united_nations_regulatory_id', 'handling-time',
                       'safety_data_sheet_url', 'item_weight', 'item_weight_unit_of_measure', 'item_volume', 'item_volume_unit_of_measure', 'flash_point',
                       'ghs_classification_class1', 'ghs_classification_class2', 'ghs_classification_class3', 'list_price', 'uvp_list_price')
-            csv_data = '\t'
-            csv_data = csv_data.join(titles) + '\n'
+            header = '\t'.join(titles) + '\n'
+            rows = []
+            products = dict_products[id_market].values()
+            sent = 0
 
-            for product in dict_products[id_market].values():
+            for product in products:
                 data = '\t'
                 product_data = (product.get('sku') or '', product.get('product-id') or '', product.get('product-id-type') or '', product.get('price') or '',
                                 product.get('minimum-seller-allowed-price') or '', product.get('maximum-seller-allowed-price') or '',
@@ -738,21 +736,19 @@ class AmazonAPI(object):
                                 product.get('flash_point') or '', product.get('ghs_classification_class1') or '',
                                 product.get('ghs_classification_class2') or '',
                                 product.get('ghs_classification_class3') or '', product.get('list_price') or '', product.get('uvp_list_price') or '', '\n')
-                data = data.join(product_data) + '\n'
-                csv_data = csv_data + data
-
-            _logger.info('_POST_FLAT_FILE_INVLOADER_DATA_ feed: [%s]' % csv_data)
+                rows.append(data.join(product_data) + '\n')
 
-            response = feedsApi.submit_feed(feed=csv_data,
-                                            feed_type='_POST_FLAT_FILE_INVLOADER_DATA_',
-                                            marketplaceids=[id_market])
+            for csv_data, number_rows in split_flat_file(header, rows):
+                part += 1
+                _logger.info('_POST_FLAT_FILE_INVLOADER_DATA_ feed of %s (part %d): %d rows, %d bytes', id_market, part, number_rows, len(csv_data))
 
-            feed_ids.append(self._save_feed(response=response, params=str(arguments), xml_csv=csv_data))
+                response = feedsApi.submit_feed(feed=csv_data,
+                                                feed_type='_POST_FLAT_FILE_INVLOADER_DATA_',
+                                                marketplaceids=[id_market])
 
-        self.batch_update_feeds(arguments)
-
-        with odoo.registry(arguments.env.cr.dbname).cursor() as new_cr:
-            new_env = api.Environment(new_cr, arguments.env.uid, arguments.env.context)
+                feed_ids.append(self._save_feed(response=response, params=params, xml_csv=csv_data, feed_batch=feed_batch, feed_part=part))
+                self._mark_part_launched(products[sent:sent + number_rows], pending_parts, feed_batch, part)
+                sent += number_rows
 
         return feed_ids
 
@@ -781,8 +777,7 @@ class AmazonAPI(object):
             row.append('\n')
             csv_data = csv_data + data.join(row)
         """
-        for feed_to_throw in arguments:
-            element = ast.literal_eval(feed_to_throw.data)
+        for feed_id, element, create_date in self._read_feeds_data(arguments):
 
             _logger.info('_POST_FLAT_FILE_FULFILLMENT_DATA_ feed: [%s]' % arguments)
 
@@ -791,8 +786,8 @@ class AmazonAPI(object):
                                             marketplaceids=[self._backend._get_marketplace_default().id_mws])
 
             feed_ids.append(self._save_feed(response=response, params=str(arguments), xml_csv=arguments))
-
-        self.batch_update_feeds(arguments)
+            # Each shipment is marked when it is submitted, so a failure doesn't submit again the previous ones
+            self.batch_update_feeds(arguments.browse(feed_id))
 
         return feed_ids
 
@@ -846,11 +841,11 @@ class AmazonAPI(object):
 
         return
 
-    def _get_report(self, report_list_id):
+    def _get_report(self, report_list_id, stream=False):
         report_api = Reports(backend=self._backend)
 
         try:
-            response = report_api.get_report(report_id=report_list_id)
+            response = report_api.get_report(report_id=report_list_id, stream=stream)
             if response and response.response and response.response.status_code == 200:
                 return response
         except MWSError as e:
@@ -1002,6 +997,43 @@ class AmazonAPI(object):
 
         return []
 
+    def _get_prices_from_my_offers(self, offers, sku, product):
+        if isinstance(offers, list):
+            _logger.error('There are several offers on a get_product_data search')
+            exc = Exception()
+            raise exc
+        offer = offers['Offer']
+        # There are any situations on which MWS return more than one offer with different sku, we need filter this
+        if isinstance(offer, list):
+            for of in offers['Offer']:
+                if of.getvalue('SellerSKU') == sku:
+                    offer = of
+                    break
+        product['price_unit'] = offer['BuyingPrice']['ListingPrice'].getvalue('Amount')
+        product['currency_price_unit'] = offer['BuyingPrice']['ListingPrice'].getvalue('CurrencyCode')
+        product['price_shipping'] = offer['BuyingPrice']['Shipping'].getvalue('Amount')
+        product['currency_shipping'] = offer['BuyingPrice']['Shipping'].getvalue('CurrencyCode')
+        return product
+
+    def _add_estimate_fee(self, sku, marketplace_id, product, product_api=None):
+        try:
+            fee = self._get_my_estimate_fee(marketplace_id=marketplace_id,
+                                            type_sku_asin='SellerSKU',
+                                            id_type=sku,
+                                            price=product['price_unit'],
+                                            currency=product['currency_price_unit'],
+                                            ship_price=product['price_shipping'],
+                                            currency_ship=product['currency_shipping'],
+                                            product_api=product_api)
+            if fee:
+                product['fee'] = fee
+        except Exception as efee:
+            _logger.error("Recovering fee product from product_api (%s) failed with sku %s and marketplace %s",
+                          'get_my_estimate_fee',
+                          sku,
+                          marketplace_id)
+        return product
+
     def _get_my_price_product(self, sku, marketplace_id, product_api=None, product={}, get_fee=True):
         if not product_api:
             product_api = Products(backend=self._backend)
@@ -1012,39 +1044,9 @@ class AmazonAPI(object):
                     response._response_dict[response._rootkey].get('Product') and response._response_dict[response._rootkey]['Product'].get('Offers') \
                     and response._response_dict[response._rootkey]['Product']['Offers'].get('Offer'):
 
-                aux = response._response_dict[response._rootkey]['Product']['Offers']
-                if isinstance(aux, list):
-                    _logger.error('There are several offers on a get_product_data search')
-                    exc = Exception()
-                    raise exc
-                offer = aux['Offer']
-                # There are any situations on which MWS return more than one offer with different sku, we need filter this
-                if isinstance(offer, list):
-                    aux = aux['Offer']
-                    for of in aux:
-                        if of.getvalue('SellerSKU') == sku:
-                            offer = of
-                            break
-                product['price_unit'] = offer['BuyingPrice']['ListingPrice'].getvalue('Amount')
-                product['currency_price_unit'] = offer['BuyingPrice']['ListingPrice'].getvalue('CurrencyCode')
-                product['price_shipping'] = offer['BuyingPrice']['Shipping'].getvalue('Amount')
-                product['currency_shipping'] = offer['BuyingPrice']['Shipping'].getvalue('CurrencyCode')
+                self._get_prices_from_my_offers(response._response_dict[response._rootkey]['Product']['Offers'], sku, product)
                 if get_fee:
-                    try:
-                        fee = self._get_my_estimate_fee(marketplace_id=marketplace_id,
-                                                        type_sku_asin='SellerSKU',
-                                                        id_type=sku,
-                                                        price=product['price_unit'],
-                                                        currency=product['currency_price_unit'],
-                                                        ship_price=product['price_shipping'],
-                                                        currency_ship=product['currency_shipping'])
-                        if fee:
-                            product['fee'] = fee
-                    except Exception as efee:
-                        _logger.error("Recovering fee product from product_api (%s) failed with sku %s and marketplace %s",
-                                      'get_my_estimate_fee',
-                                      sku,
-                                      marketplace_id)
+                    self._add_estimate_fee(sku, marketplace_id, product, product_api)
 
         except Exception as e:
             _logger.error("Recovering price's product from product_api (%s) failed with sku %s and marketplace %s", 'get_my_price_for_sku', sku, marketplace_id)
@@ -1052,6 +1054,84 @@ class AmazonAPI(object):
 
         return product
 
+    def _get_my_price_products(self, skus, marketplace_id, product_api=None, get_fee=True):
+        """
+        Get the prices of our offers for a list of skus of the same marketplace, the skus are requested
+        on batches of MAX_SKUS_PRODUCTS_REQUEST
+        :param skus: list of skus
+        :param marketplace_id: id_mws of the marketplace
+        :return: dict with the sku as key and the prices as value, the skus that MWS returns with error have
+        only the key 'error' with the code of this
+        """
+        if not product_api:
+            product_api = Products(backend=self._backend)
+
+        products = {}
+        for index in xrange(0, len(skus), MAX_SKUS_PRODUCTS_REQUEST):
+            batch = skus[index:index + MAX_SKUS_PRODUCTS_REQUEST]
+            try:
+                response = product_api.get_my_price_for_sku(marketplaceid=marketplace_id, skus=batch)
+            except Exception as e:
+                _logger.error("Recovering price's product from product_api (%s) failed with skus %s and marketplace %s", 'get_my_price_for_sku', batch,
+                              marketplace_id)
+                raise e
+
+            results = response._response_dict.get(response._rootkey) if response and response._response_dict else None
+            if not results:
+                continue
+            if not isinstance(results, list):
+                results = [results]
+
+            for result in results:
+                sku = result.getvalue('SellerSKU')
+                if result.getvalue('status') != 'Success':
+                    products[sku] = {'error':result['Error'].getvalue('Code') if result.get('Error') else result.getvalue('status')}
+                    continue
+                product = {}
+                if result.get('Product') and result['Product'].get('Offers') and result['Product']['Offers'].get('Offer'):
+                    self._get_prices_from_my_offers(result['Product']['Offers'], sku, product)
+                products[sku] = product
+
+        if get_fee:
+            estimates = [(marketplace_id, 'SellerSKU', sku, product['price_unit'], product['currency_price_unit'], product['price_shipping'],
+                          product['currency_shipping']) for sku, product in products.iteritems() if product.get('price_unit')]
+            try:
+                fees = self._get_my_estimate_fees(estimates, product_api)
+                for sku, product in products.iteritems():
+                    if fees.get((marketplace_id, sku)):
+                        product['fee'] = fees[(marketplace_id, sku)]
+            except Exception as efee:
+                _logger.error("Recovering fee products from product_api (%s) failed with skus %s and marketplace %s",
+                              'get_my_estimate_fees',
+                              skus,
+                              marketplace_id)
+
+        return products
+
+    def _get_fee_from_estimate(self, estimate):
+        """
+        Sum the fee details of a FeesEstimate
+        :param estimate: FeesEstimate node of a FeesEstimateResult
+        :return: dict with the Amount, Promotion and Final fee
+        """
+        if not estimate or not estimate.get('FeeDetailList') or not estimate['FeeDetailList'].get('FeeDetail'):
+            return
+
+        detail_list = estimate['FeeDetailList']['FeeDetail']
+        if not isinstance(detail_list, list):
+            detail_list = [detail_list]
+
+        fee = {}
+        for detail in detail_list:
+            fee['Amount'] = float(detail['FeeAmount'].getvalue('Amount')) if not fee.get('Amount') else \
+                fee['Amount'] + float(detail['FeeAmount'].getvalue('Amount'))
+            fee['Promotion'] = float(detail['FeePromotion'].getvalue('Amount')) if not fee.get('Promotion') else \
+                fee['Promotion'] + float(detail['FeePromotion'].getvalue('Amount'))
+            fee['Final'] = float(detail['FinalFee'].getvalue('Amount')) if not fee.get('Final') else \
+                fee['Final'] + float(detail['FinalFee'].getvalue('Amount'))
+
+        return fee
+
     def _get_my_estimate_fee(self, marketplace_id, type_sku_asin, id_type, price, currency, ship_price=0, currency_ship=None, product_api=None):
         if not product_api:
             product_api = Products(backend=self._backend)
@@ -1069,23 +1149,47 @@ class AmazonAPI(object):
 
         if response and response._response_dict and response._response_dict[response._rootkey] and \
                 response._response_dict[response._rootkey].get('FeesEstimateResultList') and \
-                response._response_dict[response._rootkey]['FeesEstimateResultList'].get('FeesEstimateResult') and \
-                response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult'].get('FeesEstimate') and \
-                response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult']['FeesEstimate'].get('FeeDetailList') and \
-                response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult']['FeesEstimate']['FeeDetailList'].get('FeeDetail'):
-            detail_list = response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult']['FeesEstimate']['FeeDetailList'][
-                'FeeDetail']
-
-            fee = {}
-            for detail in detail_list:
-                fee['Amount'] = float(detail['FeeAmount'].getvalue('Amount')) if not fee.get('Amount') else \
-                    fee['Amount'] + float(detail['FeeAmount'].getvalue('Amount'))
-                fee['Promotion'] = float(detail['FeePromotion'].getvalue('Amount')) if not fee.get('Promotion') else \
-                    fee['Promotion'] + float(detail['FeePromotion'].getvalue('Amount'))
-                fee['Final'] = float(detail['FinalFee'].getvalue('Amount')) if not fee.get('Final') else \
-                    fee['Final'] + float(detail['FinalFee'].getvalue('Amount'))
-
-            return fee
+                response._response_dict[response._rootkey]['FeesEstimateResultList'].get('FeesEstimateResult'):
+            return self._get_fee_from_estimate(response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult'].get('FeesEstimate'))
+
+    def _get_my_estimate_fees(self, estimates, product_api=None):
+        """
+        Get the fees of a list of estimates, the estimates are requested on batches of MAX_FEES_ESTIMATE_REQUEST
+        :param estimates: list of tuples (marketplace_id, type_sku_asin, id_type, price, currency, ship_price, currency_ship)
+        :return: dict with the tuple (marketplace_id, id_type) as key and the fee as value
+        """
+        if not product_api:
+            product_api = Products(backend=self._backend)
+
+        fees = {}
+        for index in xrange(0, len(estimates), MAX_FEES_ESTIMATE_REQUEST):
+            batch = estimates[index:index + MAX_FEES_ESTIMATE_REQUEST]
+            response = product_api.get_my_fee_estimate(marketplaceids=[estimate[0] for estimate in batch],
+                                                       types=[estimate[1] for estimate in batch],
+                                                       ids=[estimate[2] for estimate in batch],
+                                                       prices=[estimate[3] for estimate in batch],
+                                                       currency_prices=[estimate[4] for estimate in batch],
+                                                       shipping_prices=[estimate[5] or 0 for estimate in batch],
+                                                       currency_ship_prices=[estimate[6] or estimate[4] for estimate in batch])
+
+            if not response or not response._response_dict or not response._response_dict[response._rootkey] or \
+                    not response._response_dict[response._rootkey].get('FeesEstimateResultList') or \
+                    not response._response_dict[response._rootkey]['FeesEstimateResultList'].get('FeesEstimateResult'):
+                continue
+
+            results = response._response_dict[response._rootkey]['FeesEstimateResultList']['FeesEstimateResult']
+            if not isinstance(results, list):
+                results = [results]
+
+            for result in results:
+                identifier = result.get('FeesEstimateIdentifier')
+                if not identifier or result.getvalue('Status') != 'Success':
+                    continue
+                fee = self._get_fee_from_estimate(result.get('FeesEstimate'))
+                if fee:
+                    fees[(identifier.getvalue('MarketplaceId'), identifier.getvalue('IdValue'))] = fee
+
+        return fees
 
     def _get_category_product(self, sku, marketplace_id, product_api=None, product={}):
 
@@ -1159,31 +1263,86 @@ class AmazonAPI(object):
                                      'marketplace_id':order_dict.getvalue('MarketplaceId'),
                                      })
         if with_items:
-            try:
-                self._list_items_from_order(order)
-            except Exception as e:
-                _logger.error("Getting list items order from order_api (%s) failed with id_order %s (%s)", '_get_order_data_from_dict',
-                              order['order_id'],
-                              e.message)
+            self._add_items_to_orders([order])
 
         return order
 
+    def _add_items_to_orders(self, orders, orders_api=None):
+        """
+        Get the lines of the orders, if MWS rejects the requests the orders are returned without lines and these will be
+        read when the orders are imported. The throttled requests and the empty quotas raise RetryableJobError, these
+        aren't caught so the job is retried.
+        """
+        try:
+            self._list_items_from_orders(orders, orders_api=orders_api)
+        except MWSError as e:
+            _logger.error("Getting list items order from order_api (%s) failed with id_order %s (%s)", '_add_items_to_orders',
+                          [order['order_id'] for order in orders],
+                          e.message)
+
     def _list_items_from_order(self, order):
         '''
         Get the lines of the order
         :param order: order dictionary
         :return: Nothing, the lines are saved on a order param
         '''
-        orders_api = Orders(backend=self._backend)
-        response_item = orders_api.list_order_items(amazon_order_id=order['order_id'])
-        if response_item and \
-                response_item._response_dict and \
-                response_item._response_dict[response_item._rootkey] and \
-                response_item._response_dict[response_item._rootkey].get('OrderItems') and \
-                response_item._response_dict[response_item._rootkey]['OrderItems'].get('OrderItem'):
-            order['lines'] = []
+        self._list_items_from_orders([order])
+
+    def _list_items_from_orders(self, orders, orders_api=None):
+        '''
+        Get the lines of the orders, a ListOrderItems request is sent concurrently for each order respecting the quota of
+        the request and the next pages of lines are read with ListOrderItemsByNextToken
+        :param orders: list of order dictionaries
+        :return: Nothing, the lines are saved on each order
+        '''
+        if not orders:
+            return
+        if not orders_api:
+            orders_api = Orders(backend=self._backend)
+
+        responses = orders_api.list_order_items_concurrently([order['order_id'] for order in orders])
+        pending = []
+        for order, response in zip(orders, responses):
+            next_token = self._add_order_items(order, response)
+            if next_token:
+                pending.append((order, next_token))
+
+        while pending:
+            responses = orders_api.list_order_items_by_next_tokens([next_token for _order, next_token in pending])
+            next_pending = []
+            for (order, _next_token), response in zip(pending, responses):
+                next_token = self._add_order_items(order, response)
+                if next_token:
+                    next_pending.append((order, next_token))
+            pending = next_pending
+
+    def _add_order_items(self, order, response_item):
+        """
+        Add the lines of a response to the order, if the response can't be parsed the order is returned without lines
+        and these will be read when the order is imported
+        :return: NextToken of the next page of lines or None if it is the last one or the response can't be parsed
+        """
+        try:
+            return self._add_items_from_response(order, response_item)
+        except (KeyError, AttributeError, TypeError, ValueError, ZeroDivisionError) as e:
+            _logger.error("Parsing list items order failed with id_order %s (%s)", order['order_id'], e)
+            order.pop('lines', None)
+            return None
+
+    def _add_items_from_response(self, order, response_item):
+        '''
+        Add the lines of a response of ListOrderItems or ListOrderItemsByNextToken to the order
+        :param order: order dictionary
+        :return: NextToken of the next page of lines or None if it is the last one
+        '''
+        if not response_item or not response_item._response_dict or not response_item._response_dict[response_item._rootkey]:
+            return None
+
+        result = response_item._response_dict[response_item._rootkey]
+        if result.get('OrderItems') and result['OrderItems'].get('OrderItem'):
+            order.setdefault('lines', [])
             # If the result have one item, the result is a dict, however if the result have more than one item the result is a list
-            items = response_item._response_dict[response_item._rootkey]['OrderItems']['OrderItem']
+            items = result['OrderItems']['OrderItem']
             items = items if isinstance(items, list) else [items]
             for order_item in items:
                 item = {}
@@ -1205,85 +1364,76 @@ class AmazonAPI(object):
                     item['price_unit'] = (float(item['item_price'])) / float(item['quantity_purchased'])
                 order['lines'].append(item)
 
-    def _list_orders_next_token(self, arguments, orders_api=None):
-        token = arguments.get('NextToken')
-        if not token:
-            return
+        return result['NextToken']['value'] if result.get('NextToken') else None
 
-        if not orders_api:
-            orders_api = Orders(backend=self._backend)
+    def _get_orders_page(self, response, with_items=True, orders_api=None):
+        """
+        Get the orders of a page of ListOrders or ListOrdersByNextToken, the lines of all the orders of the page are read
+        concurrently
+        :param response: response of MWS
+        :param with_items: if it is False only the headers of the orders are returned
+        :return: tuple with the list of orders of the page and the NextToken of the next page (None on the last page)
+        """
+        orders = []
+        next_token = None
+        if response and response._response_dict and response._response_dict[response._rootkey]:
+            result = response._response_dict[response._rootkey]
+            if result.get('Orders') and result['Orders'].get('Order'):
+                # If the result have one item, the result is a dict, however if the result have more than one item the result is a list
+                orders_dict = result['Orders']['Order']
+                orders_dict = orders_dict if isinstance(orders_dict, list) else [orders_dict]
+                for order in orders_dict:
+                    aux = self._get_order_data_from_dict(order, with_items=False)
+                    if aux:
+                        orders.append(aux)
+                if with_items:
+                    self._add_items_to_orders(orders, orders_api=orders_api)
 
-        response = orders_api.list_orders_by_next_token(token=token)
+            if result.get('NextToken'):
+                next_token = result['NextToken']['value']
 
-        orders = {}
-        if response and response._response_dict and response._response_dict[response._rootkey] and response._response_dict[response._rootkey].get('Orders') and \
-                response._response_dict[response._rootkey]['Orders'].get('Order'):
-            # If the result have one item, the result is a dict, however if the result have more than one item the result is a list
-            orders_dict = response._response_dict[response._rootkey]['Orders']['Order']
-            orders_dict = orders_dict if isinstance(orders_dict, list) else [orders_dict]
-            for order in orders_dict:
-                aux = self._get_order_data_from_dict(order)
-                if aux:
-                    orders[aux['order_id']] = aux
+        return orders, next_token
 
-            if response._response_dict[response._rootkey].get('NextToken'):
-                new_orders = self._list_orders_next_token(arguments={'NextToken':response._response_dict[response._rootkey]['NextToken']['value']},
-                                                          orders_api=orders_api)
-                orders.update(new_orders)
+    def _list_orders_next_token(self, arguments, orders_api=None):
+        """
+        Generator of the pages of orders from a NextToken
+        """
+        token = arguments.get('NextToken')
+        if not orders_api:
+            orders_api = Orders(backend=self._backend)
 
-        return orders
+        while token:
+            response = orders_api.list_orders_by_next_token(token=token)
+            orders, token = self._get_orders_page(response, with_items=not arguments.get('headers_only'), orders_api=orders_api)
+            yield orders, token
 
     def _list_orders(self, arguments):
-        try:
-            orders_api = Orders(backend=self._backend)
-            marketplace_ids = arguments.get('marketplace_ids') or self._backend._get_crypt_codes_marketplaces()
-            order_status = None
-            date_start = None
-            date_end = None
-            last_update_start = None
-            last_update_end = None
-            if arguments:
-                if arguments.get('date_start'):
-                    date_start = arguments['date_start']
-                if arguments.get('date_end'):
-                    date_end = arguments['date_end']
-                if arguments.get('update_start'):
-                    last_update_start = arguments['update_start']
-                if arguments.get('update_end'):
-                    last_update_end = arguments['update_end']
-                if arguments.get('order_status'):
-                    order_status = arguments['order_status']
-
-            if not order_status:
-                order_status = arguments.get('order_status') or self._backend.env['amazon.config.order.status'].search([]).mapped('name')
-
-            response = orders_api.list_orders(marketplaceids=marketplace_ids,
-                                              orderstatus=order_status,
-                                              created_before=date_end,
-                                              created_after=date_start,
-                                              lastupdatedbefore=last_update_end,
-                                              lastupdatedafter=last_update_start)
-            orders = {}
-            if response and response._response_dict and response._response_dict[response._rootkey] and response._response_dict[response._rootkey].get(
-                    'Orders') and \
-                    response._response_dict[response._rootkey]['Orders'].get('Order'):
-                # If the result have one item, the result is a dict, however if the result have more than one item the result is a list
-                orders_dict = response._response_dict[response._rootkey]['Orders']['Order']
-                orders_dict = orders_dict if isinstance(orders_dict, list) else [orders_dict]
-                for order in orders_dict:
-                    aux = self._get_order_data_from_dict(order)
-                    if aux:
-                        orders[aux['order_id']] = aux
+        """
+        Generator of the pages of orders, each page is a tuple with the list of orders and the NextToken of the next page
+        (None on the last page). If there is a NextToken on the arguments the listing is resumed from it
+        :param arguments: filters of the listing, with headers_only the lines of the orders aren't read
+        """
+        orders_api = Orders(backend=self._backend)
+        if arguments.get('NextToken'):
+            for page in self._list_orders_next_token(arguments=arguments, orders_api=orders_api):
+                yield page
+            return
 
-                if response._response_dict[response._rootkey].get('NextToken'):
-                    new_orders = self._list_orders_next_token(arguments={'NextToken':response._response_dict[response._rootkey]['NextToken']['value']},
-                                                              orders_api=orders_api)
+        marketplace_ids = arguments.get('marketplace_ids') or self._backend._get_crypt_codes_marketplaces()
+        order_status = arguments.get('order_status') or self._backend.env['amazon.config.order.status'].search([]).mapped('name')
 
-                    orders.update(new_orders)
+        response = orders_api.list_orders(marketplaceids=marketplace_ids,
+                                          orderstatus=order_status,
+                                          created_before=arguments.get('date_end'),
+                                          created_after=arguments.get('date_start'),
+                                          lastupdatedbefore=arguments.get('update_end'),
+                                          lastupdatedafter=arguments.get('update_start'))
+        orders, next_token = self._get_orders_page(response, with_items=not arguments.get('headers_only'), orders_api=orders_api)
+        yield orders, next_token
 
-            return orders
-        except Exception as e:
-            raise e
+        for page in self._list_orders_next_token(arguments={'NextToken':next_token, 'headers_only':arguments.get('headers_only')},
+                                                 orders_api=orders_api):
+            yield page
 
     def _get_order(self, order_ids, with_items=True):
         orders_api = Orders(backend=self._backend)
@@ -1297,7 +1447,9 @@ class AmazonAPI(object):
                 orders_dict = response._response_dict[response._rootkey]['Orders']['Order']
                 orders_dict = orders_dict if isinstance(orders_dict, list) else [orders_dict]
                 for order_dict in orders_dict:
-                    orders.append(self._get_order_data_from_dict(order_dict, with_items=with_items))
+                    orders.append(self._get_order_data_from_dict(order_dict, with_items=False))
+                if with_items:
+                    self._add_items_to_orders(orders, orders_api=orders_api)
 
                 if len(orders) > 1:
                     return orders
@@ -1385,25 +1537,22 @@ class AmazonAPI(object):
         rep_list_id = self._get_report_list_ids(report_id)
         # If there isn't the rep_list_id, we assume that there aren't data and the report had not been created
         if rep_list_id:
-            response = self._get_report(report_list_id=rep_list_id)
+            response = self._get_report(report_list_id=rep_list_id, stream=True)
             assert response
             if response:
-                file = StringIO.StringIO()
-                file.write(response.response.content)
-                file.seek(0)
                 reader = unicodecsv.DictReader(
-                    file, fieldnames=headers,
+                    response.parsed, fieldnames=headers,
                     delimiter='\t', quoting=False,
                     encoding=response.response.encoding)
                 reader.next()  # we pass the file header
                 return (response.response.encoding, reader)
             return
 
-    def _get_feed_response(self, feed_id):
+    def _get_feed_response(self, feed_id, stream=False):
         feeds_api = Feeds(backend=self._backend)
 
         try:
-            response = feeds_api.get_feed_submission_result(feedid=feed_id)
+            response = feeds_api.get_feed_submission_result(feedid=feed_id, stream=stream)
             if response and response.response and response.response.status_code == 200:
                 return response
         except Exception as e:
@@ -1423,14 +1572,11 @@ class AmazonAPI(object):
             _logger.error("feed_api('%s') failed", '_get_result_feed.headers')
             raise e
 
-        response = self._get_feed_response(feed_id=feed_id)
+        response = self._get_feed_response(feed_id=feed_id, stream=True)
         assert response
         if response:
-            file = StringIO.StringIO()
-            file.write(response.response.content)
-            file.seek(0)
             reader = unicodecsv.DictReader(
-                file, fieldnames=headers,
+                response.parsed, fieldnames=headers,
                 delimiter='\t', quoting=False,
                 encoding=response.response.encoding)
             reader.next()  # we pass the file header
@@ -1748,7 +1894,24 @@ class AmazonAPI(object):
             return ase
 
         try:
-            return self._api(method, arguments)
+            result = self._api(method, arguments)
+        except MWSError as mwse:
+            raise RetryableJobError('An error has been produced on MWS API', ignore_retry='RequestThrottled' in mwse.message, seconds=90)
+        except Exception as e:
+            _logger.error("api('%s', %s) failed", method, arguments)
+            raise e
+
+        if isinstance(result, types.GeneratorType):
+            return self._iter_call(method, arguments, result)
+        return result
+
+    def _iter_call(self, method, arguments, pages):
+        """
+        The methods that return generators call to MWS while these are iterated, so the errors are handled here
+        """
+        try:
+            for page in pages:
+                yield page
         except MWSError as mwse:
             raise RetryableJobError('An error has been produced on MWS API', ignore_retry='RequestThrottled' in mwse.message, seconds=90)
         except Exception as e:
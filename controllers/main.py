@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import hmac
+
+from odoo import http
+from odoo.http import request
+
+# Parameter with the token that the scrapers must send on the url to read the metrics
+METRICS_TOKEN_PARAM = 'connector_amazon.metrics_token'
+
+
+class AmazonMetricsController(http.Controller):
+
+    @http.route('/connector_amazon/metrics', type='http', auth='none', methods=['GET'], csrf=False)
+    def metrics(self, token=None, **kwargs):
+        """
+        Counters of the MWS requests on the Prometheus text format, the endpoint is disabled while the token isn't configured
+        """
+        env = request.env(user=1)
+        metrics_token = env['ir.config_parameter'].get_param(METRICS_TOKEN_PARAM)
+        # The token is compared in constant time, so it can't be guessed from the time of the responses
+        if not metrics_token or not token or not hmac.compare_digest(token.encode('utf-8'), metrics_token.encode('utf-8')):
+            return request.not_found()
+        body = env['amazon.control.request.stat'].get_prometheus_metrics()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4')])
@@ -3,17 +3,21 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import ast
 import inspect
+import json
 import logging
 import os
 from datetime import datetime, timedelta
 
+import dateutil.parser
 from decorator import contextmanager
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from odoo.addons.connector.checkpoint import checkpoint
 
 from ...components.backend_adapter import AmazonAPI
+from odoo.addons.queue_job.exception import RetryableJobError
 from odoo.addons.queue_job.job import STARTED, ENQUEUED, PENDING
+from ..amazon_binding.common import get_job_identity_key
 from ..config.common import AMAZON_NUMBER_MESSAGES_CHANGE_PRICE_RECOVER
 
 _logger = logging.getLogger(__name__)
@@ -68,6 +72,32 @@ class AmazonBackend(models.Model):
         string='Import updated sales from date',
     )
 
+    import_sales_next_token = fields.Char(
+        string='NextToken of the sales listing',
+        help='NextToken of the last page of sales processed, the listing is resumed from it if it was interrupted',
+        readonly=True,
+        copy=False,
+    )
+
+    import_sales_next_token_filters = fields.Char(
+        string='Filters of the sales listing',
+        readonly=True,
+        copy=False,
+    )
+
+    import_updated_sales_next_token = fields.Char(
+        string='NextToken of the updated sales listing',
+        help='NextToken of the last page of updated sales processed, the listing is resumed from it if it was interrupted',
+        readonly=True,
+        copy=False,
+    )
+
+    import_updated_sales_next_token_filters = fields.Char(
+        string='Filters of the updated sales listing',
+        readonly=True,
+        copy=False,
+    )
+
     export_updated_prices = fields.Datetime(
         string='Export updated prices',
     )
@@ -111,20 +141,27 @@ class AmazonBackend(models.Model):
 
     sqs_account_id = fields.Many2one('amazon.config.sqs.account', 'SQS account')
 
+    # Requests to MWS by hour shared by all the actions, if it is 0 the reservations of quota classes are not applied
+    mws_hourly_budget = fields.Integer('MWS hourly budget', default=0)
+    quota_reservation_ids = fields.One2many(comodel_name='amazon.control.quota.reservation',
+                                            inverse_name='backend_id',
+                                            string='Quota reservations', )
+
     _sql_constraints = [
         ('sale_prefix_uniq', 'unique(sale_prefix)',
          "A backend with the same sale prefix already exists")
     ]
 
     def check_same_import_jobs(self, model, key, backend=None):
+        """
+        Check if there is a pending, enqueued or started job to import the record, the jobs of import_record are found
+        by their identity key
+        """
         if not backend:
             backend = self
-        job = self.env['queue.job'].search([('channel', '=', 'root.amazon'),
-                                            ('state', 'in', (STARTED, ENQUEUED, PENDING)),
-                                            ('func_string', 'ilike', str(backend)),
-                                            ('model_name', 'ilike', model),
-                                            ('func_string', 'ilike', key)])
-        if job:
+        identity_key = get_job_identity_key(model, backend, key, 'import_record')
+        if identity_key and self.env['queue.job'].search_count([('amazon_identity_key', '=', identity_key),
+                                                                ('state', 'in', (STARTED, ENQUEUED, PENDING))]):
             return True
         return False
 
@@ -239,6 +276,56 @@ class AmazonBackend(models.Model):
                 sup_product.export_products_from_supplierinfo()
             product_id = sup_product.product_id.id
 
+    @api.model
+    def _get_sales_next_token_fields(self, filters):
+        """
+        The listings of created and updated sales are resumed independently, each one has its NextToken and filters
+        :return: tuple with the names of the fields of the NextToken and the filters of the listing
+        """
+        if filters.get('update_start'):
+            return 'import_updated_sales_next_token', 'import_updated_sales_next_token_filters'
+        return 'import_sales_next_token', 'import_sales_next_token_filters'
+
+    @api.multi
+    def _get_resume_sales_filters(self, filters):
+        """
+        If a listing of sales of the same kind was interrupted we return its filters, so the listing is resumed from its
+        NextToken and the import dates are moved to the end of the interrupted listing
+        """
+        self.ensure_one()
+        token_field, filters_field = self._get_sales_next_token_fields(filters)
+        if self[token_field] and self[filters_field]:
+            return json.loads(self[filters_field])
+        return filters
+
+    @api.multi
+    def _is_sales_listing_pending(self, filters):
+        """
+        Check if the listing of sales has been interrupted, the import dates aren't moved until it is finished
+        """
+        self.ensure_one()
+        token_field = self._get_sales_next_token_fields(filters)[0]
+        return bool(self[token_field])
+
+    @api.multi
+    def _run_sales_listing(self, sale_binding_model, filters):
+        """
+        Run a listing of sales, the import dates are only moved when it has finished
+        :return: True if the listing has finished without errors and without a pending NextToken
+        """
+        self.ensure_one()
+        try:
+            result = sale_binding_model.import_batch(self, filters=filters)
+        except RetryableJobError as e:
+            result = e
+        if isinstance(result, Exception):
+            _logger.warning('The listing of sales of %s has failed, the import dates are not moved: %s', self.name, result)
+            return False
+        if self._is_sales_listing_pending(filters):
+            _logger.warning('The listing of sales of %s has been interrupted, it will be resumed', self.name)
+            return False
+        return True
+
     @api.multi
     def _import_sale_orders(self,
                             import_start_time=None,
@@ -282,8 +369,10 @@ class AmazonBackend(models.Model):
                 sale_binding_model = self.env['amazon.sale.order']
                 if user != self.env.user:
                     sale_binding_model = sale_binding_model.sudo(user)
-                filters = {'date_start':import_start_time.isoformat(), 'date_end':import_end_time.isoformat()}
-                sale_binding_model.import_batch(backend, filters=filters)
+                filters = backend._get_resume_sales_filters({'date_start':import_start_time.isoformat(), 'date_end':import_end_time.isoformat()})
+                import_end_time = dateutil.parser.parse(filters['date_end'])
+                if not backend._run_sales_listing(sale_binding_model, filters):
+                    continue
 
             if update_import_date:
                 backend.write({'import_sales_from_date':import_end_time})
@@ -313,9 +402,12 @@ class AmazonBackend(models.Model):
                 else:
                     import_start_time = import_end_time
 
-            sale_binding_model.import_batch(backend, filters={'update_start':import_start_time.isoformat(),
-                                                              'update_end':import_end_time.isoformat(),
-                                                              'update_sales_flag':True})
+            filters = backend._get_resume_sales_filters({'update_start':import_start_time.isoformat(),
+                                                         'update_end':import_end_time.isoformat(),
+                                                         'update_sales_flag':True})
+            import_end_time = dateutil.parser.parse(filters['update_end'])
+            if not backend._run_sales_listing(sale_binding_model, filters):
+                continue
             if update_import_date:
                 backend.write({'import_updated_sales_from_date':import_end_time})
 
@@ -2,9 +2,122 @@
 # © 2018 Halltic eSolutions S.L.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from datetime import datetime, timedelta
+
 from odoo import api, models, fields
 from odoo.addons.queue_job.exception import FailedJobError, RetryableJobError
-from odoo.addons.queue_job.job import job, related_action
+from odoo.addons.queue_job.job import job, related_action, DelayableRecordset, Job
+
+
+def mws_actions(*actions, **kwargs):
+    """ Declare the MWS actions that a job method consumes, the jobs are
+    delayed until the quotas of these actions have room.
+
+    ``data_actions`` are the actions consumed when the external id is a
+    tuple with the id and the data of the record, the data that has been
+    read on the listing isn't requested again.
+
+    Usage::
+
+        @job(default_channel='root.amazon')
+        @mws_actions('GetOrder', 'ListOrderItems', data_actions=('ListOrderItems',))
+        @api.model
+        def import_record(self, backend, external_id):
+    """
+    data_actions = kwargs.get('data_actions')
+
+    def decorate(func):
+        func.mws_actions = actions
+        func.mws_data_actions = data_actions
+        return func
+
+    return decorate
+
+
+def job_identity(func):
+    """ Declare that a job method called with a backend and an external id
+    does the same work for the same arguments, so only one job of the
+    method for each model, backend and external id can be pending,
+    enqueued or started. Enqueue it again returns the existing job.
+
+    Usage::
+
+        @job(default_channel='root.amazon')
+        @job_identity
+        @api.model
+        def import_record(self, backend, external_id):
+    """
+    func.job_identity = True
+    return func
+
+
+def get_job_identity_key(model, backend, external_id, method):
+    """ Deterministic key of the work of a job, the external id can be the
+    id or a tuple with the id and the data of the record """
+    if isinstance(external_id, (tuple, list)):
+        external_id = external_id[0] if external_id else None
+    if not isinstance(external_id, basestring):
+        return None
+    return '%s,%s,%s,%s' % (model, backend.id, external_id, method)
+
+
+class AmazonDelayableRecordset(DelayableRecordset):
+    """ Delayable that sets the eta of the jobs of methods decorated with
+    ``mws_actions`` to the date when the quotas of the actions will be
+    available for them, each job reserves a token of the projected
+    buckets so the jobs are not dispatched to be throttled, and the
+    identity key of the jobs of methods decorated with ``job_identity``.
+    """
+
+    def __getattr__(self, name):
+        method = getattr(self.recordset, name)
+        actions = getattr(method, 'mws_actions', None)
+        data_actions = getattr(method, 'mws_data_actions', None)
+        # The overrides of a method keep the identity of the method that they extend
+        identity = any(getattr(getattr(cls, name, None), 'job_identity', False) for cls in type(self.recordset).__mro__) and \
+                   not self.recordset.env.context.get('amazon_no_job_identity')
+        if not actions and not identity:
+            return super(AmazonDelayableRecordset, self).__getattr__(name)
+
+        def amazon_delay(backend, *args, **kwargs):
+            recordset = self.recordset
+            external_id = args[0] if args else kwargs.get('external_id')
+            identity_key = None
+            if identity:
+                identity_key = get_job_identity_key(recordset._name, backend, external_id, name)
+                if identity_key:
+                    # If the work is already enqueued its job is returned instead of build a new one
+                    same_job = recordset.env['queue.job'].sudo()._get_same_identity_job(identity_key)
+                    if same_job:
+                        return Job.load(recordset.env, same_job.uuid)
+                    # The key is read from the context when the job is stored (queue.job create)
+                    self.recordset = recordset.with_context(amazon_identity_key=identity_key)
+
+            job_actions = actions
+            if data_actions is not None and isinstance(external_id, (tuple, list)) and len(external_id) > 1 and external_id[1]:
+                job_actions = data_actions
+            if job_actions:
+                # Each job reserves its tokens, so the jobs enqueued together are spread on the time
+                wait = recordset.env['amazon.control.request'].reserve_quota_eta(job_actions, backend.id)
+                if wait:
+                    quota_eta = datetime.now() + timedelta(seconds=wait)
+                    eta = self.eta
+                    if isinstance(eta, (int, long, float)):
+                        eta = datetime.now() + timedelta(seconds=eta)
+                    if not eta or eta < quota_eta:
+                        self.eta = quota_eta
+            try:
+                job = super(AmazonDelayableRecordset, self).__getattr__(name)(backend, *args, **kwargs)
+            finally:
+                self.recordset = recordset
+            if identity_key and not recordset.env['queue.job'].sudo().search_count([('uuid', '=', job.uuid)]):
+                # Other transaction has stored the job of the key at the same time, so this one hasn't been stored
+                same_job = recordset.env['queue.job'].sudo()._get_same_identity_job(identity_key)
+                if same_job:
+                    return Job.load(recordset.env, same_job.uuid)
+            return job
+
+        return amazon_delay
 
 
 class AmazonBinding(models.AbstractModel):
@@ -33,6 +146,10 @@ class AmazonBinding(models.AbstractModel):
          'A binding already exists with the same Amazon ID.'),
     ]
 
+    @api.multi
+    def with_delay(self, *args, **kwargs):
+        return AmazonDelayableRecordset(self, *args, **kwargs)
+
     @job(default_channel='root.amazon')
     @api.model
     def import_batch(self, backend, filters=None):
@@ -61,6 +178,7 @@ class AmazonBinding(models.AbstractModel):
             return e
 
     @job(default_channel='root.amazon')
+    @job_identity
     @api.model
     def import_record(self, backend, external_id, force=False):
         """ Import a Amazon record """
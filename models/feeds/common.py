@@ -3,11 +3,17 @@
 # © 2018 Halltic eSolutions S.L.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import ast
+import json
 import logging
 
+import psycopg2
 from odoo import models, fields, api
 from odoo.addons.component.core import Component
 from odoo.addons.queue_job.job import job
+from odoo.tools import mute_logger
+
+from ..amazon_binding.common import mws_actions
 
 _logger = logging.getLogger(__name__)
 
@@ -63,6 +69,10 @@ class AmazonFeed(models.Model):
 
     xml_csv = fields.Char('File (xml/csv) submitted on feed')
 
+    # The feeds to throw of a batch are split on parts (mws/feed_parts.py), each part is a feed of the batch
+    feed_batch = fields.Char('Batch of feeds to throw', index=True, readonly=True)
+    feed_part = fields.Integer('Part of the batch', readonly=True)
+
     def get_feed_types(self):
         lst = []
         for key, value in FEED_TYPES.iteritems():
@@ -82,6 +92,7 @@ class AmazonFeed(models.Model):
         return _super.export_batch(backend, filters=filters)
 
     @job(default_channel='root.amazon')
+    @mws_actions('GetFeedSubmissionResult')
     @api.model
     def import_record(self, backend, external_id):
         exception = None
@@ -103,9 +114,16 @@ class AmazonFeedToThrow(models.Model):
     model = fields.Char('Model on the change will do', required=True)
     identificator = fields.Char('Identificator of the object on the change will do', required=True)
     marketplace_id = fields.Many2one('amazon.config.marketplace', "Marketplace")
-    data = fields.Char('Data to send to csv or xml', required=True)
+    data = fields.Char('Data to send to csv or xml (json)', required=True)
     launched = fields.Boolean('Define if the data has been launched or not', default=False)
     date_launched = fields.Datetime('When the data has been launched if it is informed')
+    feed_batch = fields.Char('Batch of the feeds where the data has been launched', index=True, readonly=True)
+    feed_part = fields.Integer('Part of the batch where the data has been launched', readonly=True)
+    # There is only one change pending to launch of each type, marketplace and sku, the new changes replace it
+    pending_key = fields.Char('Marketplace and sku of the change', readonly=True, copy=False)
+    # The sku and the marketplace of the data are saved on their own columns to group the changes without read the json
+    sku = fields.Char('Sku of the change', readonly=True, copy=False)
+    id_mws = fields.Char('Marketplace of the change on MWS', readonly=True, copy=False)
 
     def get_feed_types(self):
         lst = []
@@ -113,6 +131,94 @@ class AmazonFeedToThrow(models.Model):
             lst.append((key, value))
         return lst
 
+    @api.model_cr
+    def init(self):
+        # The data was saved as the repr of a dict, the data pending to launch is saved as json to be read with sql
+        self.env.cr.execute("""SELECT id, data FROM amazon_feed_tothrow
+                               WHERE launched IS NOT TRUE AND data NOT LIKE '{"%' AND data <> '{}'""")
+        for feed_id, data in self.env.cr.fetchall():
+            try:
+                data = json.dumps(ast.literal_eval(data))
+            except (ValueError, SyntaxError):
+                _logger.warning('The data of the feed to throw %s can not be read: %s', feed_id, data)
+                continue
+            self.env.cr.execute('UPDATE amazon_feed_tothrow SET data = %s WHERE id = %s', (data, feed_id))
+
+        # The changes pending to launch saved before the sku had its own column are completed, only the last change of
+        # each sku gets the pending key
+        self.env.cr.execute("""SELECT backend_id, type, pending_key FROM amazon_feed_tothrow
+                               WHERE pending_key IS NOT NULL AND launched IS NOT TRUE""")
+        pending_keys = set(self.env.cr.fetchall())
+        self.env.cr.execute("""SELECT id, backend_id, type, marketplace_id, data FROM amazon_feed_tothrow
+                               WHERE launched IS NOT TRUE AND sku IS NULL AND data LIKE '{"%'
+                               ORDER BY create_date DESC, id DESC""")
+        for feed_id, backend_id, feed_type, marketplace_id, data in self.env.cr.fetchall():
+            try:
+                data = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(data, dict) or not data.get('sku'):
+                continue
+            pending_key = self._get_pending_key({'data':data, 'marketplace_id':marketplace_id})
+            if (backend_id, feed_type, pending_key) in pending_keys:
+                pending_key = None
+            elif pending_key:
+                pending_keys.add((backend_id, feed_type, pending_key))
+            self.env.cr.execute('UPDATE amazon_feed_tothrow SET sku = %s, id_mws = %s, pending_key = %s WHERE id = %s',
+                                (data['sku'], data.get('id_mws'), pending_key, feed_id))
+
+        self.env.cr.execute("""CREATE UNIQUE INDEX IF NOT EXISTS amazon_feed_tothrow_pending_key_uniq
+                               ON amazon_feed_tothrow (backend_id, type, pending_key)
+                               WHERE pending_key IS NOT NULL AND launched IS NOT TRUE""")
+        # Index of the pages of feeds pending to throw read by the submitter of feeds
+        self.env.cr.execute("""CREATE INDEX IF NOT EXISTS amazon_feed_tothrow_pending_index
+                               ON amazon_feed_tothrow (backend_id, type, id)
+                               WHERE launched IS NOT TRUE""")
+
+    @api.model
+    def _dump_data(self, vals):
+        data = vals.get('data')
+        if isinstance(data, dict):
+            vals = dict(vals, data=json.dumps(data), sku=data.get('sku'), id_mws=data.get('id_mws'))
+        return vals
+
+    @api.model
+    def _get_pending_key(self, vals):
+        data = vals.get('data')
+        if not isinstance(data, dict) or not data.get('sku'):
+            return None
+        marketplace = data.get('id_mws') or vals.get('marketplace_id')
+        return '%s,%s' % (marketplace, data['sku']) if marketplace else None
+
+    def _delete_pending_change(self, vals):
+        # The changes are replaced instead of updated, so a change that is being submitted is never modified and if it
+        # is replaced meanwhile, the new data will be launched on the next feed
+        self.env.cr.execute("""DELETE FROM amazon_feed_tothrow
+                               WHERE backend_id = %s AND type = %s AND pending_key = %s AND launched IS NOT TRUE""",
+                            (vals['backend_id'], vals['type'], vals['pending_key']))
+
+    @api.model
+    def create(self, vals):
+        pending_key = self._get_pending_key(vals)
+        vals = self._dump_data(vals)
+        if not pending_key or not vals.get('backend_id') or not vals.get('type'):
+            return super(AmazonFeedToThrow, self).create(vals)
+
+        vals['pending_key'] = pending_key
+        try:
+            with mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+                self._delete_pending_change(vals)
+                return super(AmazonFeedToThrow, self).create(vals)
+        except psycopg2.IntegrityError:
+            # Other transaction has saved a change of the same sku at the same time, the last one is kept
+            _logger.debug('The change %s of %s is already pending', vals['type'], pending_key)
+            self._delete_pending_change(vals)
+            return super(AmazonFeedToThrow, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        return super(AmazonFeedToThrow, self).write(self._dump_data(vals))
+
 class AmazonFeedResult(models.Model):
     _name = 'amazon.feed.result'
 
@@ -77,10 +77,6 @@ class AmazonFixData(models.Model):
     @job(default_channel='root.amazon')
     @api.model
     def run_delayed_jobs(self, backend):
-        # delayable = self.with_delay(priority=7, eta=datetime.now())
-        # delayable.description = '%s.%s' % (self._name, 'clean_duplicate_jobs()')
-        # delayable.clean_duplicate_jobs()
-
         delayable2 = self.with_delay(priority=7, eta=datetime.now())
         delayable2.description = '%s.%s' % (self._name, 'throw_concurrent_jobs()')
         delayable2.throw_concurrent_jobs()
@@ -97,10 +93,6 @@ class AmazonFixData(models.Model):
         delayable5.description = '%s.%s' % (self._name, 'clean_sqs_messages()')
         delayable5.clean_sqs_messages()
 
-        delayable7 = self.with_delay(priority=7, eta=datetime.now())
-        delayable7.description = '%s.%s' % (self._name, 'clean_old_quota_control_data()')
-        delayable7.clean_old_quota_control_data()
-
         delayable8 = self.with_delay(priority=7, eta=datetime.now())
         count = self.env['queue.job'].search_count([('channel', 'ilike', 'root.amazon'),
                                                     ('name', 'ilike', 'set_pending_hang_jobs'),
@@ -192,10 +184,12 @@ class AmazonFixData(models.Model):
     @job(default_channel='root.amazon')
     @api.model
     def clean_old_quota_control_data(self):
-        time_to_requeue = datetime.now() - timedelta(hours=1)
-        requests = self.env['amazon.control.date.request'].search([('create_date', '<', time_to_requeue.isoformat(sep=' '))], )
-
-        self.batch_unlink(requests)
+        """
+        The quota control is saved on minute slots that are reused, so there isn't old data to clean. The job is kept
+        because the jobs enqueued before the minute slots must be able to run, nothing enqueues it now
+        :return:
+        """
+        return True
 
     @job(default_channel='root.amazon')
     @api.model
@@ -306,49 +300,6 @@ class AmazonFixData(models.Model):
 
         self.batch_requeue(jobs)
 
-    @job(default_channel='root.amazon')
-    @api.model
-    def clean_duplicate_jobs(self):
-        """
-                Clean duplicate jobs
-                :return:
-                """
-        queue_job_env = self.env['queue.job']
-        queue_job_env._cr.execute(""" SELECT 
-                                                    id, func_string
-                                                FROM 
-                                                    queue_job
-                                                WHERE
-                                                    func_string in
-                                                        (SELECT 
-                                                            func_string
-                                                        FROM 
-                                                            queue_job
-                                                        WHERE 
-                                                            channel = 'root.amazon'
-                                                            and state in ('pending', 'started', 'enqueued')
-                                                        GROUP BY func_string
-                                                        HAVING COUNT(func_string)>1)
-                                                AND state in ('pending', 'started', 'enqueued')
-                                                ORDER BY func_string
-                                                        """)
-
-        jobs_ids = queue_job_env._cr.dictfetchall()
-        task = ''
-        list_ids = []
-        i = 0
-        for id_job in jobs_ids:
-            if task == id_job['func_string']:
-                list_ids.append(id_job['id'])
-                i += 1
-                if i > AMAZON_MAX_DELETE_JOBS:
-                    break
-
-            task = id_job['func_string']
-
-        jobs = queue_job_env.browse(list_ids)
-        self.batch_unlink(jobs)
-
     @job(default_channel='root.amazon')
     @api.model
     def get_service_level_order_or_partner_name(self):
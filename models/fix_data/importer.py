@@ -9,7 +9,7 @@ import inspect
 from datetime import datetime, timedelta
 
 from odoo.addons.component.core import Component
-from odoo.addons.queue_job.job import FAILED, STARTED, ENQUEUED, DONE
+from odoo.addons.queue_job.job import FAILED, STARTED, ENQUEUED
 
 AMAZON_SAVE_OLD_FEED = 10000
 AMAZON_SAVE_OLD_FEED_TO_THROW = 50000
@@ -42,12 +42,6 @@ class ProductFixData(Component):
 
         _logger.info('Connector_amazon [%s] log: Finish set the Amazon hang jobs to pending' % inspect.stack()[0][3])
 
-    def _clean_old_quota_control_data(self):
-        _logger.info('Connector_amazon [%s] log: Clean Amazon old quota control' % inspect.stack()[0][3])
-        time_to_requeue = datetime.now() - timedelta(days=1)
-        self.env['amazon.control.date.request'].search([('request_date', '<', time_to_requeue.isoformat(sep=' '))]).unlink()
-        _logger.info('Connector_amazon [%s] log: Finish clean Amazon old quota control' % inspect.stack()[0][3])
-
     def _delete_old_feeds(self):
         _logger.info('Connector_amazon [%s] log: Delete Amazon old feeds' % inspect.stack()[0][3])
         count_feeds = self.env['amazon.feed'].search_count([])
@@ -112,45 +106,6 @@ class ProductFixData(Component):
 
         _logger.info('Connector_amazon [%s] log: Finish throw Amazon concurrent jobs' % inspect.stack()[0][3])
 
-    def _clean_duplicate_jobs(self):
-        """
-        Clean duplicate jobs
-        :return:
-        """
-        _logger.info('Connector_amazon [%s] log: Clean Amazon duplicate jobs' % inspect.stack()[0][3])
-        queue_job_env = self.env['queue.job']
-        queue_job_env._cr.execute(""" SELECT 
-                                                    id, func_string
-                                                FROM 
-                                                    queue_job
-                                                WHERE
-                                                    func_string in
-                                                    (SELECT 
-                                                        func_string
-                                                    FROM 
-                                                        queue_job
-                                                    WHERE 
-                                                        channel = 'root.amazon'
-                                                        and state in ('pending', 'started', 'enqueued')
-                                                    GROUP BY func_string
-                                                    HAVING COUNT(func_string)>1
-                                                    ORDER BY func_string)
-                                                    AND state in ('pending', 'started', 'enqueued')
-                                                        """)
-
-        jobs_ids = queue_job_env._cr.dictfetchall()
-        task = ''
-        for id_job in jobs_ids:
-            if task == id_job['func_string']:
-                queue_job_env.browse(id_job['id']).write({'state':DONE,
-                                                          'exc_info':None,
-                                                          'date_done':datetime.now(),
-                                                          'result':'Duplicate task at the same time'})
-
-            task = id_job['func_string']
-
-        _logger.info('Connector_amazon [%s] log: Finish clean Amazon duplicate jobs' % inspect.stack()[0][3])
-
     def _get_service_level_order_or_partner_name(self):
         _logger.info('Connector_amazon [%s] log: Start get service level of Amazon orders' % inspect.stack()[0][3])
 
@@ -197,10 +152,6 @@ class ProductFixData(Component):
 
     def run(self):
 
-        try:
-            self._clean_duplicate_jobs()
-        except Exception as e:
-            _logger.info('Connector_amazon log: exception executing _clean_duplicate_jobs [%s]' % e.message)
         try:
             self._throw_concurrent_jobs()
         except Exception as e:
@@ -217,10 +168,6 @@ class ProductFixData(Component):
             self._delete_old_offers()
         except Exception as e:
             _logger.info('Connector_amazon log: exception executing _delete_old_offers [%s]' % e.message)
-        try:
-            self._clean_old_quota_control_data()
-        except Exception as e:
-            _logger.info('Connector_amazon log: exception executing _clean_old_quota_control_data [%s]' % e.message)
         try:
             self._set_pending_hang_jobs()
         except Exception as e:
@@ -14,7 +14,9 @@ from odoo.addons.queue_job.exception import RetryableJobError
 from odoo.addons.queue_job.job import job
 from odoo.exceptions import UserError
 
+from ...components.backend_adapter import MAX_SKUS_PRODUCTS_REQUEST
 from ...models.config.common import AMAZON_DEFAULT_PERCENTAGE_FEE
+from ..amazon_binding.common import mws_actions
 
 _logger = logging.getLogger(__name__)
 
@@ -75,11 +77,13 @@ class AmazonProductProduct(models.Model):
     RECOMPUTE_QTY_STEP = 1000  # products at a time
 
     @job(default_channel='root.amazon')
+    @mws_actions('GetMyPriceForSKU', 'GetMyFeesEstimate')
     @api.model
     def import_prices(self, backend, filters):
         self._get_first_price(backend, filters)
 
     @job(default_channel='root.amazon')
+    @mws_actions('GetMatchingProductForId', 'GetMyPriceForSKU', 'GetMyFeesEstimate')
     @api.model
     def import_record(self, backend, external_id):
         _super = super(AmazonProductProduct, self)
@@ -96,6 +100,7 @@ class AmazonProductProduct(models.Model):
             raise e
 
     @job(default_channel='root.amazon')
+    @mws_actions('GetMyPriceForSKU', 'GetMyFeesEstimate')
     @api.model
     def export_record(self, backend, internal_id):
         _super = super(AmazonProductProduct, self)
@@ -200,8 +205,9 @@ class AmazonProductProduct(models.Model):
                                                                                '|',
                                                                                ('percentage_fee', '=', False),
                                                                                ('first_price_searched', '=', False)],
-                                                                              limit=quota_control.max_request_quota_time -
-                                                                                    (quota_control.max_request_quota_time / 4))
+                                                                              limit=(quota_control.max_request_quota_time -
+                                                                                     (quota_control.max_request_quota_time / 4)) *
+                                                                                    MAX_SKUS_PRODUCTS_REQUEST)
         product_importer = self.env['amazon.product.product']
         user = backend.warehouse_id.company_id.user_tech_id
         if not user:
@@ -209,10 +215,16 @@ class AmazonProductProduct(models.Model):
         if user != self.env.user:
             product_importer = product_importer.sudo(user)
 
+        # The prices are requested on batches of skus of the same marketplace, so we throw a job for each batch
+        details_by_marketplace = {}
         for detail in search_first_price:
-            delayable = product_importer.with_delay(priority=1, eta=datetime.now() + timedelta(minutes=5))
-            delayable.description = '%s.%s' % (self._name, 'get_price_first_time()')
-            delayable.import_prices(backend, filters={'method':'first_price', 'product_detail':detail.id})
+            details_by_marketplace.setdefault(detail.marketplace_id.id, []).append(detail.id)
+
+        for detail_ids in details_by_marketplace.values():
+            for batch_ids in chunks(detail_ids, MAX_SKUS_PRODUCTS_REQUEST):
+                delayable = product_importer.with_delay(priority=1, eta=datetime.now() + timedelta(minutes=5))
+                delayable.description = '%s.%s' % (self._name, 'get_price_first_time()')
+                delayable.import_prices(backend, filters={'method':'first_price', 'product_details':batch_ids})
 
         _logger.info('connector_amazon [%s][%s] log: Finish get initial fees on backend %s' % (os.getpid(), inspect.stack()[0][3], backend.name))
         return
@@ -221,8 +233,14 @@ class AmazonProductProduct(models.Model):
         assert filters
         with backend.work_on(self._name) as work:
             importer = work.component(usage='amazon.product.price.import')
-            detail = self.env['amazon.product.product.detail'].browse(filters['product_detail'])
             result = None
+            if filters.get('product_details'):
+                details = self.env['amazon.product.product.detail'].browse(filters['product_details'])
+                result = importer.run_update_prices(details)
+                if not result:
+                    raise RetryableJobError(msg='The prices can\'t be recovered', seconds=600)
+                return
+            detail = self.env['amazon.product.product.detail'].browse(filters['product_detail'])
             if filters['method'] == 'first_price':
                 result = importer.run_update_price(detail)
             elif filters['method'] == 'first_offer':
@@ -959,6 +977,22 @@ class ProductProductAdapter(Component):
             _logger.error('There aren\'t (%s) parameters for %s', 'get_my_price')
             raise
 
+    def get_my_prices(self, arguments):
+        try:
+            assert arguments
+            return self._call(method='get_my_price_products', arguments=arguments)
+        except AssertionError:
+            _logger.error('There aren\'t (%s) parameters for %s', 'get_my_prices')
+            raise
+
+    def get_my_estimate_fees(self, arguments):
+        try:
+            assert arguments
+            return self._call(method='get_my_estimate_fees', arguments=arguments)
+        except AssertionError:
+            _logger.error('There aren\'t (%s) parameters for %s', 'get_my_estimate_fees')
+            raise
+
     def get_category(self, arguments):
         try:
             assert arguments
@@ -564,8 +564,7 @@ class ProductPriceImporter(Component):
     _apply_on = ['amazon.product.product']
     _usage = 'amazon.product.price.import'
 
-    def run_update_price(self, detail):
-        prices = self.run_get_price(detail)
+    def _update_detail_prices(self, detail, prices):
         if prices:
             vals = {}
             price_unit = float(prices.get('price_unit') or 0.)
@@ -583,6 +582,31 @@ class ProductPriceImporter(Component):
                 return True
         return False
 
+    def run_update_price(self, detail):
+        prices = self.run_get_price(detail)
+        return self._update_detail_prices(detail, prices)
+
+    def run_update_prices(self, details):
+        """
+        Update the prices of several details of the same marketplace getting these with batched requests
+        :param details: amazon.product.product.detail recordset
+        :return: True if the prices of any detail have been recovered
+        """
+        details = details.filtered('sku')
+        if not details:
+            return False
+        prices = self.backend_adapter.get_my_prices([details.mapped('sku'), details[0].marketplace_id.id_mws])
+        recovered = False
+        for detail in details:
+            detail_prices = prices.get(detail.sku)
+            if not detail_prices or detail_prices.get('error'):
+                _logger.info('connector_amazon [%s][%s] log: The prices of sku %s can\'t be recovered (%s)' %
+                             (os.getpid(), inspect.stack()[0][3], detail.sku, detail_prices.get('error') if detail_prices else ''))
+                continue
+            recovered = True
+            self._update_detail_prices(detail, detail_prices)
+        return recovered
+
     def run_first_offer(self, detail):
         prices = self.backend_adapter.get_lowest_price([detail.sku, detail.marketplace_id.id_mws]) if detail.sku else None
         return prices
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+import psycopg2
+from odoo import models, fields, api
+from odoo.addons.queue_job.job import STARTED, ENQUEUED, PENDING, DONE
+from odoo.tools import mute_logger
+
+_logger = logging.getLogger(__name__)
+
+
+class QueueJob(models.Model):
+    """ The jobs of the methods decorated with ``job_identity`` are stored
+    with an identity key, there can only be one pending, enqueued or started
+    job with the same key. """
+    _inherit = 'queue.job'
+
+    amazon_identity_key = fields.Char(readonly=True, copy=False)
+
+    @api.model_cr
+    def init(self):
+        self.env.cr.execute("""CREATE UNIQUE INDEX IF NOT EXISTS queue_job_amazon_identity_key_uniq
+                               ON queue_job (amazon_identity_key)
+                               WHERE amazon_identity_key IS NOT NULL AND state IN ('pending', 'enqueued', 'started')""")
+
+    def _get_same_identity_job(self, identity_key):
+        return self.search([('amazon_identity_key', '=', identity_key),
+                            ('state', 'in', (PENDING, ENQUEUED, STARTED))], limit=1)
+
+    @api.model
+    def create(self, vals):
+        # The delayable returns the existing job of the key before the job is built (AmazonDelayableRecordset), here
+        # we only store the key
+        identity_key = self.env.context.get('amazon_identity_key')
+        if not identity_key:
+            return super(QueueJob, self).create(vals)
+
+        try:
+            with mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+                return super(QueueJob, self).create(dict(vals, amazon_identity_key=identity_key))
+        except psycopg2.IntegrityError:
+            # Other transaction has stored the same job at the same time, its job is returned instead of store a
+            # duplicate, the delayable returns it to the caller
+            _logger.debug('The job %s is already enqueued', identity_key)
+            return self._get_same_identity_job(identity_key)
+
+    @api.multi
+    def requeue(self):
+        # A failed job can't be requeued while other job of its key is pending, enqueued or started, it is set as done
+        duplicates = self.browse()
+        identity_keys = set()
+        for job in self.filtered('amazon_identity_key'):
+            if job.amazon_identity_key in identity_keys or \
+                    (job.state not in (PENDING, ENQUEUED, STARTED) and job._get_same_identity_job(job.amazon_identity_key)):
+                duplicates |= job
+            identity_keys.add(job.amazon_identity_key)
+
+        if duplicates:
+            _logger.info('Jobs not requeued because their work is already enqueued: %s', duplicates.mapped('uuid'))
+            duplicates.write({'state':DONE,
+                              'exc_info':None,
+                              'date_done':fields.Datetime.now(),
+                              'result':'Duplicate task at the same time'})
+        return super(QueueJob, self - duplicates).requeue()
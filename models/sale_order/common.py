@@ -15,6 +15,7 @@ from odoo.addons.queue_job.job import job
 from odoo.exceptions import UserError
 
 from ...models.config.common import AMAZON_DEFAULT_PERCENTAGE_FEE
+from ..amazon_binding.common import mws_actions, job_identity
 
 _logger = logging.getLogger(__name__)
 
@@ -42,6 +43,7 @@ class AmazonSaleOrder(models.Model):
     id_amazon_order = fields.Char(string='Amazon Order Id', help='An Amazon-defined order identifier, in 3-7-7 format.', required=True)
     date_purchase = fields.Datetime('The date of purchase', required=False)
     order_status_id = fields.Many2one('amazon.config.order.status', "order_status_id", required=False)
+    last_status_check = fields.Datetime('Last check of the status on Amazon', readonly=True, copy=False)
     fullfillment_channel = fields.Selection(selection=[('AFN', 'Amazon Fullfillment'), ('MFN', 'Merchant fullfillment')],
                                             help='How the order was fulfilled: by Amazon (AFN) or by the seller (MFN).', default='MFN', required=True)
     sales_channel = fields.Char('The sales channel of the first item in the order.', required=False, related='marketplace_sale_id.name')
@@ -93,6 +95,13 @@ class AmazonSaleOrder(models.Model):
                              store=True,
                              readonly=True)
 
+    @api.model_cr
+    def init(self):
+        # Index of the selection of the sales to update, the amazon id is added to read the sales only from the index
+        self.env.cr.execute("DROP INDEX IF EXISTS amazon_sale_order_update_index")
+        self.env.cr.execute("""CREATE INDEX IF NOT EXISTS amazon_sale_order_update_check_index
+                               ON amazon_sale_order (backend_id, order_status_id, date_purchase, last_status_check, id_amazon_order)""")
+
     @api.multi
     def name_get(self):
         result = []
@@ -121,6 +130,8 @@ class AmazonSaleOrder(models.Model):
         return result
 
     @job(default_channel='root.amazon')
+    @mws_actions('GetOrder', 'ListOrderItems', data_actions=('ListOrderItems',))
+    @job_identity
     @api.model
     def import_record(self, backend, external_id):
         _super = super(AmazonSaleOrder, self)
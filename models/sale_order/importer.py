@@ -4,9 +4,12 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import random
 from datetime import datetime, timedelta
+import json
 import logging
 import re
 
+import odoo
+
 from odoo.addons.component.core import Component
 from odoo.addons.connector.components.mapper import mapping
 from odoo.addons.queue_job.exception import FailedJobError, RetryableJobError
@@ -16,6 +19,11 @@ from ...models.config.common import AMAZON_DEFAULT_PERCENTAGE_FEE
 
 _logger = logging.getLogger(__name__)
 
+# Maximum number of orders of a GetOrder request
+AMAZON_GET_ORDER_MAX_IDS = 50
+# The sales are updated when at least these days have passed since their purchase
+AMAZON_DAYS_TO_UPDATE_SALES = 5
+
 
 class SaleOrderBatchImporter(Component):
     _name = 'amazon.sale.order.batch.importer'
@@ -24,53 +32,99 @@ class SaleOrderBatchImporter(Component):
 
     def run(self, filters=None):
         """ Run the synchronization """
-        # Get new sales and sales updated
-        sales = self.backend_adapter.search(filters)
-        _logger.info('get report of saleorders returned %s', sales.keys())
-        for sale in sales.iteritems():
-            sale_binding_model = self.env['amazon.sale.order']
-            if not self.backend_record.check_same_import_jobs(model=sale_binding_model._name, key=sale[0] if isinstance(sale, (tuple, list)) else sale):
-                delayable = sale_binding_model.with_delay(priority=4, eta=datetime.now() + timedelta(minutes=2))
-                delayable.import_record(self.backend_record, sale)
+        # Get new sales and sales updated, the orders are listed page by page and the NextToken of the last page processed
+        # is saved on the backend, so if the listing is interrupted the next run with the same filters is resumed from it
+        backend = self.backend_record
+        filters = filters or {}
+        filters_key = json.dumps(filters, sort_keys=True)
+        arguments = dict(filters)
+        token_field, filters_field = backend._get_sales_next_token_fields(filters)
+        if backend[token_field] and backend[filters_field] == filters_key:
+            _logger.info('Resuming the listing of saleorders of %s from the last NextToken', backend.name)
+            arguments['NextToken'] = backend[token_field]
+
+        sale_binding_model = self.env['amazon.sale.order']
+        try:
+            for sales, next_token in self.backend_adapter.search(arguments):
+                _logger.info('get page of saleorders returned %s', [sale['order_id'] for sale in sales])
+                for sale in sales:
+                    # If there is already a job to import the sale, the job isn't enqueued again (job_identity)
+                    delayable = sale_binding_model.with_delay(priority=4, eta=datetime.now() + timedelta(minutes=2))
+                    delayable.import_record(backend, (sale['order_id'], sale))
+
+                backend.write({token_field:next_token or False,
+                               filters_field:filters_key if next_token else False})
+                # The jobs of the page and the token are committed together, so the page isn't listed again when we resume
+                if not odoo.tools.config['test_enable']:
+                    self.env.cr.commit()  # noqa
+        except RetryableJobError as e:
+            # The throttled requests are retried with the same NextToken, but if MWS has rejected the request the NextToken
+            # can be expired or invalid, so it is cleared and the listing starts again from the import dates, that haven't
+            # been moved while the listing was pending
+            if not e.ignore_retry and backend[token_field]:
+                _logger.warning('The listing of saleorders of %s has failed, its NextToken is cleared', backend.name)
+                backend.write({token_field:False, filters_field:False})
+                if not odoo.tools.config['test_enable']:
+                    self.env.cr.commit()  # noqa
+            raise
 
         if filters.get('update_sales_flag'):
-            # Get sales with more than 4 days and states updatables
-            status_updatable = self.env['amazon.config.order.status.updatable'].search([])
-            now_time = datetime.strptime(datetime.today().strftime('%Y-%m-%d %H:%M:%S'), '%Y-%m-%d %H:%M:%S')
-
-            sales = self.env['amazon.sale.order'].search(["|",
-                                                          ('order_status_id', 'in', status_updatable.ids),
-                                                          ('order_status_id', '=', False)])
-
-            sales = sales.filtered(lambda sale:(now_time - datetime.strptime(sale.date_purchase, '%Y-%m-%d %H:%M:%S')).days > 4)
-
-            jobs = self.env['queue.job'].search([('state', 'in', ('pending', 'enqueued', 'started')),
-                                                 ('model_name', '=', 'amazon.sale.order'),
-                                                 ('func_string', '=like', '%import_record%'),
-                                                 ('func_string', '=like', '%amazon.backend(' + str(self.backend_record.id) + '%')]).mapped('func_string')
-
-            for job in jobs:
-                sales = sales.filtered(lambda sale:(False if sale.id_amazon_order in job else True))
+            self._update_sales()
 
-            sale_binding_model = self.env['amazon.sale.order']
-
-            i = 0
-            # We read fifty sales each call because is the limit of MWS API
-            while i * 50 < len(sales):
-                aux_sales = sales[i:i + 50]
-                order_ids = aux_sales.mapped('id_amazon_order')
-                try:
-                    # Read the orders by ids
-                    aux_sales = self.backend_adapter.read(order_ids)
-                    for sale in aux_sales:
-                        if sale['order_id'] not in jobs:
-                            if not self.backend_record.check_same_import_jobs(model=sale_binding_model._name, key=sale['order_id']):
-                                delayable = sale_binding_model.with_delay(priority=4, eta=datetime.now() + timedelta(seconds=10))
-                                delayable.import_record(self.backend_record, (sale['order_id'], sale))
-                except Exception as e:
-                    # If there are errors we break the loop and we are going to finish to get sales to update
-                    break
-                i += 1
+    def _get_updatable_sales(self):
+        """
+        Get the sales of the backend with an updatable or empty status and AMAZON_DAYS_TO_UPDATE_SALES days since their purchase
+        that haven't got a pending job to import them, the sales that haven't been checked for longer go first
+        :return: list of tuples with the amazon id and the status of the sales
+        """
+        self.env.cr.execute("""SELECT sale.id_amazon_order, sale.order_status_id
+                               FROM amazon_sale_order sale
+                               WHERE sale.backend_id = %(backend_id)s
+                                     AND sale.date_purchase <= (now() AT TIME ZONE 'UTC') - interval '1 day' * %(days)s
+                                     AND (sale.order_status_id IS NULL OR
+                                          sale.order_status_id IN (SELECT status.id
+                                                                   FROM amazon_config_order_status status
+                                                                   JOIN amazon_config_order_status_updatable updatable ON updatable.name = status.name))
+                                     AND NOT EXISTS (SELECT 1
+                                                     FROM queue_job job
+                                                     WHERE job.amazon_identity_key = %(key_prefix)s || sale.id_amazon_order || ',import_record'
+                                                           AND job.state IN ('pending', 'enqueued', 'started'))
+                               ORDER BY sale.last_status_check NULLS FIRST, sale.date_purchase""",
+                            {'backend_id':self.backend_record.id,
+                             'days':AMAZON_DAYS_TO_UPDATE_SALES,
+                             # Prefix of the identity keys of the jobs to import the sales (get_job_identity_key)
+                             'key_prefix':'amazon.sale.order,%d,' % self.backend_record.id})
+        return self.env.cr.fetchall()
+
+    def _update_sales(self):
+        """
+        Read the updatable sales with GetOrder on chunks of AMAZON_GET_ORDER_MAX_IDS and import only the sales whose status
+        has changed on Amazon
+        """
+        sales = self._get_updatable_sales()
+
+        sale_binding_model = self.env['amazon.sale.order']
+        for i in xrange(0, len(sales), AMAZON_GET_ORDER_MAX_IDS):
+            stored_status = dict(sales[i:i + AMAZON_GET_ORDER_MAX_IDS])
+            try:
+                # Only the headers of the orders are read, the lines are read when the order is imported
+                orders = self.backend_adapter.get_orders([stored_status.keys(), False]) or []
+            except Exception as e:
+                # If there are errors we break the loop and we are going to finish to get sales to update
+                _logger.error('Getting the sales to update of %s failed (%s)', self.backend_record.name, e)
+                break
+
+            # The sales checked go to the end of the next sweeps
+            self.env.cr.execute("""UPDATE amazon_sale_order SET last_status_check = (now() AT TIME ZONE 'UTC')
+                                   WHERE backend_id = %s AND id_amazon_order IN %s""",
+                                (self.backend_record.id, tuple(stored_status.keys())))
+
+            orders = orders if isinstance(orders, list) else [orders]
+            for order in orders:
+                if (order.get('order_status_id') or None) == stored_status.get(order['order_id']):
+                    continue
+                delayable = sale_binding_model.with_delay(priority=4, eta=datetime.now() + timedelta(seconds=10))
+                delayable.import_record(self.backend_record, (order['order_id'], order))
 
 
 class SaleOrderImportMapper(Component):
@@ -278,7 +332,8 @@ class SaleOrderImporter(Component):
         if not self._get_binding() and status in ('Canceled', 'Pending'):
             # If the status is pending we are throw a job two hours later to get the order
             if status in 'Pending':
-                sale_binding_model = self.env['amazon.sale.order']
+                # This job is still started, so its identity isn't used to enqueue itself again
+                sale_binding_model = self.env['amazon.sale.order'].with_context(amazon_no_job_identity=True)
                 delayable = sale_binding_model.with_delay(priority=1, eta=datetime.now() + timedelta(hours=2))
                 delayable.import_record(self.backend_record, external_id=self.external_id)
             return 'Not importable order'
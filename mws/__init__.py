@@ -3,5 +3,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 from . import quota_control
+from . import telemetry
 from . import mws
+from . import envelope
+from . import feed_parts
 from . import utils
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Streaming writer of the xml envelope of the feeds of MWS
+
+import base64
+import hashlib
+import tempfile
+
+from lxml import etree
+
+from odoo.tools import config
+
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+ENVELOPE_SCHEMA = 'amzn-envelope.xsd'
+ENVELOPE_DOCUMENT_VERSION = '1.01'
+
+# Bytes of the envelope kept on memory, the bigger envelopes are written on disk. It is set with amazon_feed_spool_size
+# on the odoo configuration file
+ENVELOPE_SPOOL_SIZE = int(config.get('amazon_feed_spool_size', 1024 * 1024))
+
+
+class EnvelopeWriter(object):
+    """
+        Write an AmazonEnvelope message by message with etree.xmlfile on a spooled temporary file, the tree of the feed
+        is never built on memory and the document isn't pretty printed. The MD5 of the content is calculated while it is
+        written, so it can be sent as Content-MD5 without read the feed again.
+
+        Usage::
+
+            with EnvelopeWriter(merchant_id, 'Inventory') as envelope:
+                envelope.add_message('Update', 'Inventory', [('SKU', sku), ('Quantity', quantity)])
+            feeds_api.submit_feed(feed=envelope.file, content_md5=envelope.md5, ...)
+            envelope.close()
+    """
+
+    def __init__(self, merchant_id, message_type):
+        self.merchant_id = merchant_id
+        self.message_type = message_type
+        self.messages = 0
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=ENVELOPE_SPOOL_SIZE)
+        self.md5 = None
+        self._hash = hashlib.md5()
+        self._xmlfile = None
+        self._writer = None
+        self._envelope = None
+
+    def write(self, data):
+        """ Output of etree.xmlfile """
+        self._hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def __enter__(self):
+        # The output isn't buffered by lxml, so size is the size of the envelope after each message
+        self._xmlfile = etree.xmlfile(self, encoding='UTF-8', buffered=False)
+        self._writer = self._xmlfile.__enter__()
+        self._writer.write_declaration()
+        self._envelope = self._writer.element('AmazonEnvelope',
+                                              {'{%s}noNamespaceSchemaLocation' % XSI_NAMESPACE:ENVELOPE_SCHEMA},
+                                              nsmap={'xsi':XSI_NAMESPACE})
+        self._envelope.__enter__()
+
+        header = etree.Element('Header')
+        etree.SubElement(header, 'DocumentVersion').text = ENVELOPE_DOCUMENT_VERSION
+        etree.SubElement(header, 'MerchantIdentifier').text = self.merchant_id
+        self._writer.write(header)
+        message_type = etree.Element('MessageType')
+        message_type.text = self.message_type
+        self._writer.write(message_type)
+        return self
+
+    @staticmethod
+    def build_message(message_id, operation_type, node, values):
+        """
+        Build the element of a message
+        :param operation_type: Update, Delete...
+        :param node: tag of the data of the message (Inventory, Price, Product...)
+        :param values: list of tuples (tag, text) or (tag, text, attributes) of the children of the node
+        """
+        message = etree.Element('Message')
+        etree.SubElement(message, 'MessageID').text = str(message_id)
+        etree.SubElement(message, 'OperationType').text = operation_type
+        data = etree.SubElement(message, node)
+        for value in values:
+            child = etree.SubElement(data, value[0], value[2] if len(value) > 2 else {})
+            child.text = value[1]
+        return message
+
+    def add_message(self, operation_type, node, values):
+        """
+        Write a message of the envelope, the parameters are the same than build_message
+        """
+        self.write_message(self.build_message(self.messages + 1, operation_type, node, values))
+
+    def write_message(self, message):
+        """
+        Write a message built with build_message, its MessageID must be the next of the envelope
+        """
+        self.messages += 1
+        self._writer.write(message)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._envelope.__exit__(exc_type, exc_value, traceback)
+        self._xmlfile.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.file.seek(0)
+            self.md5 = base64.encodestring(self._hash.digest()).strip('\n')
+        else:
+            self.close()
+        return False
+
+    @property
+    def content(self):
+        """ The envelope as a string, only for the callers that need it all (to save the feed) """
+        self.file.seek(0)
+        content = self.file.read()
+        self.file.seek(0)
+        return content
+
+    def close(self):
+        self.file.close()
+
+    def summary(self):
+        return '%d messages of %s, %d bytes, MD5 %s' % (self.messages, self.message_type, self.size, self.md5)
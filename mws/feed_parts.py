@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Split of the outbound feeds on parts, Amazon processes the big feeds slowly and if a feed fails all its messages fail
+
+from lxml import etree
+
+from odoo.tools import config
+
+from .envelope import EnvelopeWriter
+
+# Limits of each part of a feed, these are set with amazon_feed_max_rows and amazon_feed_max_bytes on the odoo
+# configuration file. The rows are the messages of the xml feeds and the lines (without the header) of the flat files
+FEED_MAX_ROWS = int(config.get('amazon_feed_max_rows', 10000))
+FEED_MAX_BYTES = int(config.get('amazon_feed_max_bytes', 5 * 1024 * 1024))
+
+# Bytes of the end of the envelope (</AmazonEnvelope>) that are written when a part is closed
+ENVELOPE_END_SIZE = len('</AmazonEnvelope>')
+
+
+def _get_limits(max_rows, max_bytes):
+    return max_rows or FEED_MAX_ROWS, max_bytes or FEED_MAX_BYTES
+
+
+def split_flat_file(header, rows, max_rows=None, max_bytes=None):
+    """
+    Generator of the parts of a flat file feed, each part has the header and as many rows as the limits allow
+    :param header: first lines of the file, with their line breaks
+    :param rows: iterable of the lines of the file, with their line breaks
+    :return: tuples with the content of the part and its number of rows
+    """
+    max_rows, max_bytes = _get_limits(max_rows, max_bytes)
+    part = [header]
+    size = len(header)
+    for row in rows:
+        if len(part) > 1 and (len(part) > max_rows or size + len(row) > max_bytes):
+            yield ''.join(part), len(part) - 1
+            part = [header]
+            size = len(header)
+        part.append(row)
+        size += len(row)
+
+    if len(part) > 1:
+        yield ''.join(part), len(part) - 1
+
+
+def split_envelope(merchant_id, message_type, messages, max_rows=None, max_bytes=None):
+    """
+    Generator of the parts of a xml feed, each part is an envelope with as many messages as the limits allow
+    :param messages: iterable of tuples (operation_type, node, values) as EnvelopeWriter.add_message gets them
+    :return: closed EnvelopeWriter of each part
+    """
+    max_rows, max_bytes = _get_limits(max_rows, max_bytes)
+    envelope = None
+    for operation_type, node, values in messages:
+        message = EnvelopeWriter.build_message(envelope.messages + 1 if envelope else 1, operation_type, node, values)
+        if envelope and (envelope.messages >= max_rows or
+                         envelope.size + len(etree.tostring(message, encoding='utf-8', xml_declaration=False)) + ENVELOPE_END_SIZE > max_bytes):
+            envelope.__exit__(None, None, None)
+            yield envelope
+            envelope = None
+            message = EnvelopeWriter.build_message(1, operation_type, node, values)
+
+        if not envelope:
+            envelope = EnvelopeWriter(merchant_id, message_type).__enter__()
+        envelope.write_message(message)
+
+    if envelope:
+        envelope.__exit__(None, None, None)
+        yield envelope
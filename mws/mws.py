@@ -7,21 +7,30 @@
 
 from time import gmtime, strftime
 import urllib
+import urlparse
 import hashlib
 import hmac
 import base64
-import re
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
+import telemetry
 import utils
 
 try:
-    from xml.etree.ElementTree import ParseError as XMLError
+    from xml.etree.cElementTree import ParseError as XMLError
 except ImportError:
     from xml.parsers.expat import ExpatError as XMLError
 
-from requests import request
+from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
+from odoo.tools import config
+
 __all__ = [
     'Feeds',
     'Inventory',
@@ -51,6 +60,46 @@ MARKETPLACES = {
 }
 
 
+# Number of keep-alive connections kept per endpoint and process, it can be changed with amazon_mws_pool_size on
+# the odoo configuration file. It should be at least the number of threads of a worker that call to MWS
+POOL_SIZE = int(config.get('amazon_mws_pool_size', 10))
+
+# Bytes of a streamed response that are kept on memory before the spooled file is moved to disk
+STREAM_SPOOL_SIZE = int(config.get('amazon_mws_stream_spool_size', 1024 * 1024))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Endpoint used for all the regions instead of the Amazon ones, it is set with amazon_mws_endpoint on the odoo
+# configuration file to run the connector against a local stand-in of MWS
+ENDPOINT = config.get('amazon_mws_endpoint')
+
+# Maximum number of requests on flight when several requests are sent concurrently (make_requests), it is set with
+# amazon_mws_concurrent_requests on the odoo configuration file and it shouldn't be greater than POOL_SIZE
+CONCURRENT_REQUESTS = int(config.get('amazon_mws_concurrent_requests', 5))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(domain):
+    """
+        Return the requests session shared by all the API instances of the current process for the domain.
+        The sessions are keyed by pid too because the odoo workers are forked and an ssl connection can't be shared
+        between processes.
+    """
+    key = (os.getpid(), domain)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount(domain, adapter)
+                session.headers.update({'Connection':'keep-alive'})
+                _sessions[key] = session
+    return session
+
+
 class MWSError(Exception):
     """
         Main MWS Exception class
@@ -79,18 +128,47 @@ def remove_empty(d):
     return d
 
 
-def remove_namespace(xml):
-    regex = re.compile(' xmlns(:ns2)?="[^"]+"|(ns2:)|(xml:)')
-    return regex.sub('', xml)
+def is_xml_response(data, header):
+    """
+        Sniff the response to know if it is a xml document. The first bytes are checked because sometimes
+        Amazon's MWS API returns XML error responses with "text/plain" as the Content-Type, so a flat file
+        (reports and feed results) is only detected because it doesn't start with a tag.
+    """
+    content_type = header.get('content-type', '').lower()
+    if 'tab-separated' in content_type or 'csv' in content_type:
+        return False
+    return data[:64].lstrip(' \t\r\n\xef\xbb\xbf').startswith('<')
 
 
 class DictWrapper(object):
-    def __init__(self, xml, rootkey=None):
+    """
+        Xml wrapper, the document is parsed the first time that _response_dict or parsed are accessed.
+    """
+
+    def __init__(self, xml, rootkey=None, telemetry_key=None):
         self.original = xml
         self._rootkey = rootkey
-        self._mydict = utils.xml2dict().fromstring(remove_namespace(xml))
-        self._response_dict = self._mydict.get(self._mydict.keys()[0],
-                                               self._mydict)
+        self._parsed_dict = None
+        self._telemetry_key = telemetry_key
+
+    @property
+    def _mydict(self):
+        if self._parsed_dict is None:
+            start = time.time()
+            try:
+                self._parsed_dict = utils.iterxml2dict().fromstring(self.original)
+            except XMLError as e:
+                error = MWSError("The response can't be parsed as xml: %s" % e)
+                error.response = getattr(self, 'response', None)
+                raise error
+            finally:
+                if self._telemetry_key:
+                    telemetry.record_parse(self._telemetry_key, time.time() - start)
+        return self._parsed_dict
+
+    @property
+    def _response_dict(self):
+        return self._mydict.get(self._mydict.keys()[0], self._mydict)
 
     @property
     def parsed(self):
@@ -117,6 +195,39 @@ class DataWrapper(object):
         return self.original
 
 
+class StreamWrapper(object):
+    """
+        Wrapper of a streamed response, the body is written chunk by chunk on a spooled temporary file
+        and the hash sent by Amazon is validated incrementally, so the body is never all on memory.
+    """
+
+    def __init__(self):
+        self.original = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_SIZE)
+        self.size = 0
+
+    def write_response(self, response, header):
+        """
+        Write the body of the response on the file, if the body can't be read or its hash is wrong the file is closed
+        """
+        try:
+            md = hashlib.md5()
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                md.update(chunk)
+                self.original.write(chunk)
+                self.size += len(chunk)
+            self.original.seek(0)
+            if 'content-md5' in header:
+                if header['content-md5'] != base64.encodestring(md.digest()).strip('\n'):
+                    raise MWSError("Wrong Contentlength, maybe amazon error...")
+        except Exception:
+            self.original.close()
+            raise
+
+    @property
+    def parsed(self):
+        return self.original
+
+
 class MWS(object):
     """ Base Amazon API class """
 
@@ -149,7 +260,10 @@ class MWS(object):
         self.version = version or self.VERSION
         self.uri = self.URI
 
-        if self._backend.region.code in MARKETPLACES:
+        if ENDPOINT:
+            # The requests are sent to a stand-in of MWS (benchmarks/fake_mws.py)
+            self.domain = ENDPOINT
+        elif self._backend.region.code in MARKETPLACES:
             self.domain = MARKETPLACES[self._backend.region.code]
         else:
             error_msg = "Incorrect region supplied ('%(region)s'). Must be one of the following: %(marketplaces)s" % {
@@ -161,7 +275,53 @@ class MWS(object):
     def make_request(self, extra_data, method="GET", **kwargs):
         """Make request to Amazon MWS API with these parameters
         """
-
+        request = self._prepare_request(extra_data, method, **kwargs)
+        try:
+            return self._send_request(request)
+        except MWSError as error:
+            self._check_throttled(request, error)
+            raise
+        finally:
+            telemetry.maybe_flush(request['telemetry_key'][0])
+
+    def make_requests(self, requests_data, method="GET", workers=None):
+        """
+        Make several requests to Amazon MWS API concurrently. The quota of each request is acquired on the current
+        thread before it is sent, so the requests are paced by the token bucket of their action, and only the http call
+        and the parsing of the responses are done on the threads of the pool
+        :param requests_data: list with the parameters of each request
+        :param workers: maximum number of requests on flight, amazon_mws_concurrent_requests of the configuration by default
+        :return: list with the parsed responses on the same order than requests_data
+        """
+        if not requests_data:
+            return []
+
+        thread_pool = ThreadPool(min(workers or CONCURRENT_REQUESTS, len(requests_data)))
+        pending = []
+        try:
+            for extra_data in requests_data:
+                request = self._prepare_request(extra_data, method)
+                pending.append((request, thread_pool.apply_async(self._send_request, (request, True))))
+
+            responses = []
+            for request, result in pending:
+                try:
+                    responses.append(result.get())
+                except MWSError as error:
+                    self._check_throttled(request, error)
+                    raise
+            return responses
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+            if pending:
+                telemetry.maybe_flush(pending[0][0]['telemetry_key'][0])
+
+    def _prepare_request(self, extra_data, method="GET", **kwargs):
+        """
+        Acquire the quota of the request and sign it
+        :return: dictionary with all the data needed to send the request
+        """
         # Remove all keys with an empty value because
         # Amazon's MWS does not allow such a thing.
         extra_data = remove_empty(extra_data)
@@ -180,7 +340,7 @@ class MWS(object):
         pool = self._backend.pool.get('amazon.control.request')
         env = self._backend.env['amazon.control.request']
         try:
-            pool.use_quota_if_avaiable(env, request_name=extra_data.get('Action'), backend_id=self._backend.id)
+            pool.acquire_quota(env, request_name=extra_data.get('Action'), backend_id=self._backend.id)
         except AssertionError as ae:
             error = MWSError(str(ae.response.text))
             error.response = ae.response
@@ -190,40 +350,88 @@ class MWS(object):
 
         request_description = '&'.join(['%s=%s' % (k, urllib.quote(params[k], safe='-_.~').encode('utf-8')) for k in sorted(params)])
         signature = self.calc_signature(method, request_description)
-        url = '%s%s?%s&Signature=%s' % (self.domain, self.uri, request_description, urllib.quote(signature))
         headers = {'User-Agent':'python-amazon-mws/0.0.1 (Language=Python)'}
         headers.update(kwargs.get('extra_headers', {}))
 
+        return {'action':extra_data.get('Action'),
+                'method':method,
+                'url':'%s%s?%s&Signature=%s' % (self.domain, self.uri, request_description, urllib.quote(signature)),
+                'headers':headers,
+                'body':kwargs.get('body', ''),
+                'stream':kwargs.get('stream', False),
+                # The telemetry of the request is aggregated by database, backend and action
+                'telemetry_key':(self._backend.env.cr.dbname, self._backend.id, extra_data.get('Action'))}
+
+    def _send_request(self, request, parse=False):
+        """
+        Send a request prepared by _prepare_request, it doesn't use the odoo environment so it can be called from
+        other threads
+        :param parse: parse the xml of the response now instead of the first time that it is accessed
+        """
+        telemetry_key = request['telemetry_key']
+        start = time.time()
+        recorded = False
         try:
             # Some might wonder as to why i don't pass the params dict as the params argument to request.
             # My answer is, here i have to get the url parsed string of params in order to sign it, so
             # if i pass the params dict as params to request, request will repeat that step because it will need
             # to convert the dict to a url parsed string, so why do it twice if i can just pass the full url :).
-            response = request(method, url, data=kwargs.get('body', ''), headers=headers)
+            stream = request['stream']
+            response = get_session(self.domain).request(request['method'], request['url'], data=request['body'], headers=request['headers'],
+                                                        stream=stream)
             response.raise_for_status()
+            if stream:
+                # The streamed responses are flat files (reports and feed results), they are never parsed as xml
+                parsed_response = StreamWrapper()
+                try:
+                    parsed_response.write_response(response, response.headers)
+                finally:
+                    # A stream that fails is recorded as an error with the bytes read until the failure
+                    recorded = True
+                    telemetry.record_call(telemetry_key, time.time() - start, parsed_response.size,
+                                          error=parsed_response.original.closed)
+                parsed_response.response = response
+                return parsed_response
+
             # When retrieving data from the response object,
             # be aware that response.content returns the content in bytes while response.text calls
             # response.content and converts it to unicode.
             data = response.content
+            recorded = True
+            telemetry.record_call(telemetry_key, time.time() - start, len(data))
 
-            # I do not check the headers to decide which content structure to server simply because sometimes
-            # Amazon's MWS API returns XML error responses with "text/plain" as the Content-Type.
-            try:
-                parsed_response = DictWrapper(data, extra_data.get("Action") + "Result")
-            except XMLError:
+            if is_xml_response(data, response.headers):
+                parsed_response = DictWrapper(data, request['action'] + "Result", telemetry_key=telemetry_key)
+            else:
                 parsed_response = DataWrapper(data, response.headers)
 
         except HTTPError as httpe:
             error = MWSError(str(httpe.response.text))
             error.response = httpe.response
-            if 'RequestThrottled' in error.response.text:
-                raise pool.throw_retry_exception_for_throttled(env, request_name=extra_data.get('Action'), backend_id=self._backend.id)
+            throttled = 'RequestThrottled' in error.response.text
+            telemetry.record_call(telemetry_key, time.time() - start, len(httpe.response.content), error=True, throttled=throttled)
             raise error
+        except Exception:
+            if not recorded:
+                telemetry.record_call(telemetry_key, time.time() - start, 0, error=True)
+            raise
 
         # Store the response object in the parsed_response for quick access
         parsed_response.response = response
+        if parse and isinstance(parsed_response, DictWrapper):
+            # The xml is parsed the first time that the dictionary is accessed
+            parsed_response._mydict
         return parsed_response
 
+    def _check_throttled(self, request, error):
+        """
+        If MWS has throttled the request, its bucket is blocked and the job is retried when it will be restored
+        """
+        if error.response is not None and 'RequestThrottled' in error.response.text:
+            pool = self._backend.pool.get('amazon.control.request')
+            env = self._backend.env['amazon.control.request']
+            raise pool.throw_retry_exception_for_throttled(env, request_name=request['action'], backend_id=self._backend.id)
+
     def get_service_status(self):
         """
             Returns a GREEN, GREEN_I, YELLOW or RED status.
@@ -235,7 +443,7 @@ class MWS(object):
     def calc_signature(self, method, request_description):
         """Calculate MWS signature to interface with Amazon
         """
-        sig_data = method + '\n' + self.domain.replace('https://', '').lower() + '\n' + self.uri + '\n' + request_description
+        sig_data = method + '\n' + urlparse.urlparse(self.domain).netloc.lower() + '\n' + self.uri + '\n' + request_description
         return base64.b64encode(hmac.new(str(self._backend.key), sig_data, hashlib.sha256).digest())
 
     def enumerate_param(self, param, values):
@@ -266,16 +474,17 @@ class Feeds(MWS):
     ACCOUNT_TYPE = "Merchant"
 
     def submit_feed(self, feed, feed_type, marketplaceids=None,
-                    content_type="text/xml", purge='false'):
+                    content_type="text/xml", purge='false', content_md5=None):
         """
         Uploads a feed ( xml or .tsv ) to the seller's inventory.
         Can be used for creating/updating products on Amazon.
+        :param content_md5: MD5 of the feed if it has been calculated while the feed was written (EnvelopeWriter)
         """
         data = dict(Action='SubmitFeed',
                     FeedType=feed_type,
                     PurgeAndReplace=purge)
         data.update(self.enumerate_param('MarketplaceIdList.Id.', marketplaceids))
-        md = calc_md5(feed)
+        md = content_md5 or calc_md5(feed)
         return self.make_request(data, method="POST", body=feed,
                                  extra_headers={'Content-MD5':md, 'Content-Type':content_type})
 
@@ -315,9 +524,9 @@ class Feeds(MWS):
         data.update(self.enumerate_param('FeedTypeList.Type.', feedtypes))
         return self.make_request(data)
 
-    def get_feed_submission_result(self, feedid):
+    def get_feed_submission_result(self, feedid, stream=False):
         data = dict(Action='GetFeedSubmissionResult', FeedSubmissionId=feedid)
-        return self.make_request(data)
+        return self.make_request(data, stream=stream)
 
 
 class Reports(MWS):
@@ -327,9 +536,9 @@ class Reports(MWS):
 
     ## REPORTS ###
 
-    def get_report(self, report_id):
+    def get_report(self, report_id, stream=False):
         data = dict(Action='GetReport', ReportId=report_id)
-        return self.make_request(data)
+        return self.make_request(data, stream=stream)
 
     def get_report_count(self, report_types=(), acknowledged=None, fromdate=None, todate=None):
         data = dict(Action='GetReportCount',
@@ -444,6 +653,20 @@ class Orders(MWS):
         data = dict(Action='ListOrderItemsByNextToken', NextToken=token)
         return self.make_request(data)
 
+    def list_order_items_concurrently(self, amazon_order_ids):
+        """
+        :param amazon_order_ids: list of order ids, a ListOrderItems request is sent concurrently for each one
+        :return: list of responses on the same order than the ids
+        """
+        return self.make_requests([dict(Action='ListOrderItems', AmazonOrderId=amazon_order_id) for amazon_order_id in amazon_order_ids])
+
+    def list_order_items_by_next_tokens(self, tokens):
+        """
+        :param tokens: list of NextToken, a ListOrderItemsByNextToken request is sent concurrently for each one
+        :return: list of responses on the same order than the tokens
+        """
+        return self.make_requests([dict(Action='ListOrderItemsByNextToken', NextToken=token) for token in tokens])
+
 
 class Products(MWS):
     """ Amazon MWS Products API """
@@ -571,8 +794,8 @@ class Products(MWS):
         if len(marketplaceids) == len(types) == len(ids) == len(prices):
             i = 0
             t = len(marketplaceids)
-            dict_data = {}
             while i < t:
+                dict_data = {}
                 dict_data['MarketplaceId'] = marketplaceids[i]
                 dict_data['IdType'] = types[i]
                 dict_data['IdValue'] = ids[i]
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
 from math import ceil
 
+import odoo
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from odoo.addons.queue_job.exception import FailedJobError, RetryableJobError
@@ -11,11 +13,90 @@ from odoo.addons.queue_job.exception import FailedJobError, RetryableJobError
 
 _logger = logging.getLogger(__name__)
 
+# If the quota of a request will be available before these seconds the process waits for it instead of retry the job
+MAX_SECONDS_WAIT_QUOTA = 5
 
-class RequestDate(models.Model):
-    _name = 'amazon.control.date.request'
-    request_id = fields.Many2one('amazon.control.request')
-    backend_id = fields.Many2one('amazon.backend', required=True)
+
+QUOTA_CLASSES = [('order', 'Orders'),
+                 ('stock', 'Stock'),
+                 ('pricing', 'Pricing'),
+                 ('other', 'Other'), ]
+
+# Quota classes of the requests (data/quota_mws_data.xml), the requests that aren't here are of the class 'other'
+REQUEST_QUOTA_CLASSES = {'SubmitFeed':'stock',
+                         'GetFeedSubmissionResult':'stock',
+                         'GetMyPriceForSKU':'pricing',
+                         'GetMyFeesEstimate':'pricing',
+                         'GetLowestPricedOffersForSKU':'pricing',
+                         'GetLowestOfferListingsForSKU':'pricing',
+                         'ListOrders':'order',
+                         'ListOrdersByNextToken':'order',
+                         'ListOrderItems':'order',
+                         'GetOrder':'order', }
+
+# Number of minute slots kept for each backend and request, it is the longest period that can be controlled (a day)
+QUOTA_MINUTE_SLOTS = 60 * 24
+
+# Buckets projected with the jobs enqueued by this process, {(dbname, backend_id, request_id): [tokens, time, read time]}
+_projected_buckets = {}
+_projected_buckets_lock = threading.Lock()
+
+# First key of the advisory lock of the hourly budget of a backend, the locks of the requests use their id (> 0)
+QUOTA_BUDGET_LOCK = 0
+
+
+class QuotaMinute(models.Model):
+    """
+    Number of requests done on a minute for a backend and request. There are at most QUOTA_MINUTE_SLOTS rows
+    for each backend and request, the slot of a minute is reused when the ring gives a full turn.
+    """
+    _name = 'amazon.control.quota.minute'
+
+    backend_id = fields.Many2one('amazon.backend', required=True, ondelete='cascade')
+    request_id = fields.Many2one('amazon.control.request', required=True, ondelete='cascade')
+    slot = fields.Integer(required=True)
+    minute = fields.Integer(required=True)  # Minutes since epoch
+    count = fields.Integer()
+
+    _sql_constraints = [
+        ('backend_request_slot_uniq', 'unique(backend_id, request_id, slot)', 'There is already a slot for the request and the backend.'),
+    ]
+
+
+class QuotaBucket(models.Model):
+    """
+    Token bucket of a MWS request for a backend. The bucket has max_quota tokens and it recovers one token
+    each restore_rate seconds, the state is only a row for each backend and request that is updated with a
+    single sql statement.
+    """
+    _name = 'amazon.control.quota.bucket'
+
+    backend_id = fields.Many2one('amazon.backend', required=True, ondelete='cascade')
+    request_id = fields.Many2one('amazon.control.request', required=True, ondelete='cascade')
+    tokens = fields.Float()
+    last_refill = fields.Datetime()
+    # When MWS throttles a request, the bucket is blocked until this date
+    blocked_until = fields.Datetime()
+
+    _sql_constraints = [
+        ('backend_request_uniq', 'unique(backend_id, request_id)', 'There is already a bucket for the request and the backend.'),
+    ]
+
+
+class QuotaReservation(models.Model):
+    """
+    Share of the hourly MWS budget of a backend that is reserved for the requests of a quota class, the requests
+    of the other classes can't use the reserved share that the class hasn't used yet.
+    """
+    _name = 'amazon.control.quota.reservation'
+
+    backend_id = fields.Many2one('amazon.backend', required=True, ondelete='cascade')
+    quota_class = fields.Selection(selection=QUOTA_CLASSES, required=True)
+    share = fields.Float('Reserved share (%)', required=True)
+
+    _sql_constraints = [
+        ('backend_class_uniq', 'unique(backend_id, quota_class)', 'There is already a reservation for the quota class on the backend.'),
+    ]
 
 
 class ControlRequest(models.Model):
@@ -30,60 +111,344 @@ class ControlRequest(models.Model):
                                                          ('min', 'Minutes'),
                                                          ('hor', 'Hours'),
                                                          ('day', 'Days'), ])
+    quota_class = fields.Selection(selection=QUOTA_CLASSES, default='other', required=True)
 
-    request_date_ids = fields.One2many('amazon.control.date.request', 'request_id')
+    @api.model_cr
+    def init(self):
+        # The data of the requests is noupdate, when the quota class is added to an existing database all the requests
+        # have the default class, so they are classified here. If some request has a class they have been classified.
+        self.env.cr.execute("SELECT 1 FROM amazon_control_request WHERE quota_class <> 'other' LIMIT 1")
+        if self.env.cr.fetchone():
+            return
+        for request_name, quota_class in REQUEST_QUOTA_CLASSES.iteritems():
+            self.env.cr.execute("UPDATE amazon_control_request SET quota_class = %s WHERE request_name = %s",
+                                (quota_class, request_name))
 
-    @api.model
-    def use_quota_if_avaiable(self, request_name, backend_id):
-        # TODO: finish the method to control the quota of the methods
+    def _get_period_seconds(self):
+        if self.units_of_mesaure_quota == 'sec':
+            return 1
+        elif self.units_of_mesaure_quota == 'min':
+            return 60
+        elif self.units_of_mesaure_quota == 'hor':
+            return 60 * 60
+        elif self.units_of_mesaure_quota == 'day':
+            return 60 * 60 * 24
+        return 0
+
+    def _get_period_wait(self, cr, params):
+        """
+        Add the minute slots of the period of the quota, params gets the current minute
+        :return: 0 if the quota has room or the seconds to wait until the oldest minute of the period leaves it
+        """
+        period_minutes = min(max(self.max_request_quota_units, 1) * self._get_period_seconds() / 60, QUOTA_MINUTE_SLOTS) or 1
+        params['period_minutes'] = period_minutes
+        cr.execute("""SELECT COALESCE(sum(count), 0), min(minute)
+                      FROM amazon_control_quota_minute
+                      WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s
+                            AND minute > %(minute)s - %(period_minutes)s""", params)
+        record_count, oldest_minute = cr.fetchone()
+        if record_count >= self.max_request_quota_time:
+            return max((oldest_minute + period_minutes) * 60 - params['now'], 1)
+        return 0
+
+    def _set_clock(self, cr, params):
+        cr.execute("""SELECT floor(EXTRACT(EPOCH FROM clock_timestamp()) / 60)::integer,
+                             EXTRACT(EPOCH FROM clock_timestamp())""")
+        params['minute'], params['now'] = cr.fetchone()
+
+    def _get_reservation_wait(self, cr, params, backend):
+        """
+        Check that the request doesn't use the hourly budget of the backend reserved for other quota classes
+        :return: 0 if the budget has room for the quota class of the request or the seconds to wait until the oldest
+        minute of the last hour leaves it
+        """
+        budget = backend.mws_hourly_budget
+        cr.execute("""SELECT request.quota_class, sum(slot.count), min(slot.minute)
+                      FROM amazon_control_quota_minute slot
+                      JOIN amazon_control_request request ON request.id = slot.request_id
+                      WHERE slot.backend_id = %(backend_id)s AND slot.minute > %(minute)s - 60
+                      GROUP BY request.quota_class""", params)
+        used = {}
+        oldest_minute = None
+        for quota_class, count, minute in cr.fetchall():
+            used[quota_class] = count
+            oldest_minute = minute if oldest_minute is None else min(oldest_minute, minute)
+
+        free = budget - sum(used.values())
+        for reservation in backend.quota_reservation_ids:
+            if reservation.quota_class != self.quota_class:
+                free -= max(budget * reservation.share / 100.0 - used.get(reservation.quota_class, 0), 0)
+
+        if free < 1:
+            return max(((oldest_minute or params['minute']) + 60) * 60 - params['now'], 1)
+        return 0
+
+    def _count_period_quota(self, cr, params):
+        """
+        Count a request on the minute slot of the request for the backend, the slots are used to check the hourly (or
+        daily...) quota of the request and the hourly budget of the backend
+        """
+        cr.execute("""INSERT INTO amazon_control_quota_minute (backend_id, request_id, slot, minute, count,
+                                                                create_uid, create_date, write_uid, write_date)
+                      VALUES (%(backend_id)s, %(request_id)s, %(minute)s %% %(slots)s, %(minute)s, 1,
+                              %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC')
+                      ON CONFLICT (backend_id, request_id, slot) DO UPDATE
+                      SET count = CASE WHEN amazon_control_quota_minute.minute = EXCLUDED.minute
+                                       THEN amazon_control_quota_minute.count + 1 ELSE 1 END,
+                          minute = EXCLUDED.minute""", params)
+
+    def _get_token_wait(self, cr, params):
+        """
+        The next token will be available when the bucket is unblocked and it recovers the fraction that it lacks
+        :return: the seconds to wait, negative if there are tokens or None if the bucket doesn't exist yet
+        """
+        cr.execute("""SELECT GREATEST((1 - LEAST(%(max_quota)s, tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - last_refill)) /
+                                                                 %(restore_rate)s)) * %(restore_rate)s,
+                             EXTRACT(EPOCH FROM (blocked_until - clock_timestamp() AT TIME ZONE 'UTC')))
+                      FROM amazon_control_quota_bucket
+                      WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s""", params)
+        row = cr.fetchone()
+        return row[0] if row else None
+
+    def _get_bucket_wait(self, cr, params):
+        """
+        Check the bucket of the request and the backend without take its token, the bucket is created full
+        :return: 0 if there is a token or the seconds to wait until the next token is available
+        """
+        cr.execute("""INSERT INTO amazon_control_quota_bucket (backend_id, request_id, tokens, last_refill,
+                                                                create_uid, create_date, write_uid, write_date)
+                      VALUES (%(backend_id)s, %(request_id)s, %(max_quota)s, clock_timestamp() AT TIME ZONE 'UTC',
+                              %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC')
+                      ON CONFLICT (backend_id, request_id) DO NOTHING""", params)
+        wait = self._get_token_wait(cr, params)
+        if wait is not None and wait <= 0:
+            return 0
+        return max(wait if wait is not None else self.restore_rate, 0.001)
+
+    def _consume_token(self, cr, params):
+        """
+        Take a token of the bucket of the request and the backend, the bucket is refilled and decremented on the same
+        statement
+        :return: True if the token has been taken
+        """
+        cr.execute("""UPDATE amazon_control_quota_bucket
+                      SET tokens = LEAST(%(max_quota)s, tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - last_refill)) /
+                                                                 %(restore_rate)s) - 1,
+                          last_refill = clock_timestamp() AT TIME ZONE 'UTC'
+                      WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s
+                            AND (blocked_until IS NULL OR blocked_until <= clock_timestamp() AT TIME ZONE 'UTC')
+                            AND LEAST(%(max_quota)s, tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - last_refill)) /
+                                                      %(restore_rate)s) >= 1
+                      RETURNING tokens""", params)
+        return bool(cr.fetchone())
+
+    def _take_bucket_token(self, cr, params):
+        """
+        Take a token of the bucket of the request and the backend with a single statement, the bucket is created full,
+        refilled and decremented on the same upsert. The row isn't updated when there isn't a token, then the wait is
+        read.
+        :return: 0 if the token has been taken or the seconds to wait until the next token is available
+        """
+        cr.execute("""INSERT INTO amazon_control_quota_bucket AS bucket (backend_id, request_id, tokens, last_refill,
+                                                                          create_uid, create_date, write_uid, write_date)
+                      VALUES (%(backend_id)s, %(request_id)s, %(max_quota)s - 1, clock_timestamp() AT TIME ZONE 'UTC',
+                              %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC')
+                      ON CONFLICT (backend_id, request_id) DO UPDATE
+                      SET tokens = LEAST(%(max_quota)s, bucket.tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - bucket.last_refill)) /
+                                                        %(restore_rate)s) - 1,
+                          last_refill = clock_timestamp() AT TIME ZONE 'UTC'
+                      WHERE (bucket.blocked_until IS NULL OR bucket.blocked_until <= clock_timestamp() AT TIME ZONE 'UTC')
+                            AND LEAST(%(max_quota)s, bucket.tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - bucket.last_refill)) /
+                                                     %(restore_rate)s) >= 1
+                      RETURNING tokens""", params)
+        if cr.fetchone():
+            return 0
+        return max(self._get_token_wait(cr, params) or 0, 0.001)
+
+    def _take_quota(self, backend_id):
+        """
+        Use the quota of the request for the backend if this is available. When there is only a bucket it is a single
+        statement, in other case the bucket, the period quota and the reservations of the budget are checked before take
+        anything, so a deferred request doesn't spend a token. Everything is done on a short transaction of its own
+        cursor, so the rows aren't locked until the end of the job.
+        :return: 0 if the quota has been used or the seconds to wait until it will be available
+        """
+        self.ensure_one()
+        backend = self.env['amazon.backend'].browse(backend_id)
+        use_bucket = self.restore_rate > 0 and self.max_quota > 0
+        use_period = self.max_request_quota_time > 0
+        use_budget = backend.mws_hourly_budget > 0
+        if not use_bucket and not use_period and not use_budget:
+            return 0
+
+        params = {'backend_id':backend_id,
+                  'request_id':self.id,
+                  'max_quota':self.max_quota,
+                  'restore_rate':self.restore_rate,
+                  'slots':QUOTA_MINUTE_SLOTS,
+                  'uid':self.env.uid}
+        with odoo.registry(self.env.cr.dbname).cursor() as cr:
+            if not use_period and not use_budget:
+                # The upsert locks the row of the bucket, so it doesn't need the advisory lock
+                return self._take_bucket_token(cr, params)
+            # The lock is released at the end of the transaction. The budget is shared by all the requests of the
+            # backend, so then there is a lock for the backend instead of one for each request
+            cr.execute("SELECT pg_advisory_xact_lock(%s, %s)", (QUOTA_BUDGET_LOCK if use_budget else self.id, backend_id))
+            self._set_clock(cr, params)
+            if use_bucket:
+                wait = self._get_bucket_wait(cr, params)
+                if wait:
+                    return wait
+            if use_period:
+                wait = self._get_period_wait(cr, params)
+                if wait:
+                    return wait
+            if use_budget:
+                wait = self._get_reservation_wait(cr, params, backend)
+                if wait:
+                    return wait
+
+            if use_bucket and not self._consume_token(cr, params):
+                return max(self._get_token_wait(cr, params) or 0, 0.001)
+            if use_period or use_budget:
+                self._count_period_quota(cr, params)
+        return 0
+
+    def _get_control(self, request_name):
         assert request_name
         control = self.search([('request_name', '=', request_name)])
         try:
             assert control
         except AssertionError:
             raise FailedJobError("The action %s doesn't exist on the quota control module (MWS)" % request_name)
+        return control
 
-        time_now = datetime.now()
-        if control.max_request_quota_time > 0:
-
-            max_request_factor = 0
-
-            if control.units_of_mesaure_quota == 'min':
-                max_request_factor = 60
-            elif control.units_of_mesaure_quota == 'hor':
-                max_request_factor = 60 * 60
-            elif control.units_of_mesaure_quota == 'day':
-                max_request_factor = 60 * 60 * 24
+    @api.model
+    def get_quota_eta(self, request_names, backend_id):
+        """
+        Get when the quotas of the requests will be available for the backend without use them
+        :param request_names: list of MWS actions
+        :return: the seconds to wait until all the quotas have room, 0 if these are available now
+        """
+        eta = 0
+        backend = self.env['amazon.backend'].browse(backend_id)
+        for control in self.search([('request_name', 'in', list(request_names))]):
+            params = {'backend_id':backend_id,
+                      'request_id':control.id,
+                      'max_quota':control.max_quota,
+                      'restore_rate':control.restore_rate}
+            control._set_clock(self.env.cr, params)
+            if control.restore_rate > 0 and control.max_quota > 0:
+                eta = max(eta, control._get_token_wait(self.env.cr, params) or 0)
+            if control.max_request_quota_time > 0:
+                eta = max(eta, control._get_period_wait(self.env.cr, params))
+            if backend.mws_hourly_budget > 0:
+                eta = max(eta, control._get_reservation_wait(self.env.cr, params, backend))
+        return eta
 
-            # Control to hourly quota
-            record_count = self.env['amazon.control.date.request'].search_count([('backend_id', '=', backend_id),
-                                                                            ('request_id', '=', control.id),
-                                                                            ('create_date', '>', (time_now - timedelta(seconds=(max_request_factor-(max_request_factor*0.1)))).isoformat())],
-                                                                           )
+    def _get_bucket_state(self, params):
+        """
+        Tokens that the bucket of the request has now for the backend, a full bucket if it doesn't exist yet, and the
+        seconds that it is still blocked by a throttle of MWS
+        """
+        self.env.cr.execute("""SELECT LEAST(%(max_quota)s, tokens + EXTRACT(EPOCH FROM (clock_timestamp() AT TIME ZONE 'UTC' - last_refill)) /
+                                                            %(restore_rate)s),
+                                      COALESCE(EXTRACT(EPOCH FROM (blocked_until - clock_timestamp() AT TIME ZONE 'UTC')), 0)
+                               FROM amazon_control_quota_bucket
+                               WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s""", params)
+        row = self.env.cr.fetchone()
+        return row if row else (self.max_quota, 0)
 
-            if record_count>control.max_request_quota_time:
-                raise UserError(_("The quota of %s is empty (MWS)" % request_name))
+    @api.model
+    def reserve_quota_eta(self, request_names, backend_id):
+        """
+        Get when a job that uses the requests can be dispatched and reserve a token of the projected buckets of the
+        requests for it. The projected buckets count the jobs enqueued by this process that haven't used their tokens
+        yet, so the jobs enqueued together get increasing etas instead of being dispatched on a burst. The bucket is
+        only read from the database when its projection is older than a restore period, so a page of jobs enqueued
+        together reads it once.
+        :param request_names: list of MWS actions
+        :return: the seconds to wait until the job can be dispatched
+        """
+        eta = 0
+        now = time.time()
+        backend = self.env['amazon.backend'].browse(backend_id)
+        for control in self.search([('request_name', 'in', list(request_names))]):
+            params = {'backend_id':backend_id,
+                      'request_id':control.id,
+                      'max_quota':control.max_quota,
+                      'restore_rate':control.restore_rate,
+                      'minute':int(now // 60),
+                      'now':now}
+            if control.max_request_quota_time > 0:
+                eta = max(eta, control._get_period_wait(self.env.cr, params))
+            if backend.mws_hourly_budget > 0:
+                eta = max(eta, control._get_reservation_wait(self.env.cr, params, backend))
+            if control.restore_rate <= 0 or control.max_quota <= 0:
+                continue
 
-            # Control max quota
-            seconds_control = control.max_quota*control.restore_rate
-            record_count = self.env['amazon.control.date.request'].search_count([('backend_id', '=', backend_id),
-                                                                                 ('request_id', '=', control.id),
-                                                                                 ('create_date', '>', (time_now - timedelta(seconds=(seconds_control-(seconds_control*0.2)))).isoformat())],
-                                                                                )
+            key = (self.env.cr.dbname, backend_id, control.id)
+            with _projected_buckets_lock:
+                projected = _projected_buckets.get(key)
+            if projected and now - projected[2] < control.restore_rate:
+                tokens = projected[0] + (now - projected[1]) / control.restore_rate
+                checked = projected[2]
+            else:
+                tokens, blocked_wait = control._get_bucket_state(params)
+                if projected:
+                    # The tokens used by the jobs that have been dispatched are already discounted on the bucket
+                    tokens = min(tokens, projected[0] + (now - projected[1]) / control.restore_rate)
+                # A blocked bucket doesn't recover tokens until it is unblocked
+                tokens -= max(blocked_wait, 0) / control.restore_rate
+                checked = now
+            if tokens < 1:
+                eta = max(eta, (1 - tokens) * control.restore_rate)
+            with _projected_buckets_lock:
+                _projected_buckets[key] = [tokens - 1, now, checked]
+        return eta
 
-            if record_count > control.max_quota:
-                raise UserError(_("The quota of %s is empty (MWS)" % request_name))
+    @api.model
+    def use_quota_if_avaiable(self, request_name, backend_id):
+        control = self._get_control(request_name)
+        if control._take_quota(backend_id):
+            raise UserError(_("The quota of %s is empty (MWS)" % request_name))
 
-        self.env['amazon.control.date.request'].create({'backend_id':backend_id, 'request_id':control.id})
+    @api.model
+    def acquire_quota(self, request_name, backend_id):
+        """
+        Use the quota of the request for the backend waiting until this is available. If the wait is short
+        the process sleeps, in other case the job is retried when the quota will be available.
+        """
+        control = self._get_control(request_name)
+        while True:
+            wait = control._take_quota(backend_id)
+            if not wait:
+                return
+            if wait > MAX_SECONDS_WAIT_QUOTA:
+                raise RetryableJobError("The quota of %s is empty (MWS)" % request_name,
+                                        seconds=int(ceil(wait)),
+                                        ignore_retry=True)
+            time.sleep(wait)
 
     def throw_retry_exception_for_throttled(self, request_name, backend_id, ignore_retry=True):
-        control = self.search([('request_name', '=', request_name)])
-        time_now = datetime.now()
-        i = 0
-        while i < control.max_quota:
-            self.env['amazon.control.date.request'].create({'backend_id':backend_id, 'request_id':control.id})
-            i += 1
+        """
+        MWS has throttled the request, so its bucket is emptied and blocked for a restore period with a single statement
+        """
+        control = self._get_control(request_name)
+        with odoo.registry(self.env.cr.dbname).cursor() as cr:
+            cr.execute("""INSERT INTO amazon_control_quota_bucket (backend_id, request_id, tokens, last_refill, blocked_until,
+                                                                    create_uid, create_date, write_uid, write_date)
+                          VALUES (%(backend_id)s, %(request_id)s, 0, clock_timestamp() AT TIME ZONE 'UTC',
+                                  clock_timestamp() AT TIME ZONE 'UTC' + interval '1 second' * %(restore_rate)s,
+                                  %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC')
+                          ON CONFLICT (backend_id, request_id) DO UPDATE
+                          SET tokens = 0,
+                              last_refill = EXCLUDED.last_refill,
+                              blocked_until = GREATEST(amazon_control_quota_bucket.blocked_until, EXCLUDED.blocked_until)
+                          RETURNING EXTRACT(EPOCH FROM (blocked_until - clock_timestamp() AT TIME ZONE 'UTC'))""",
+                       {'backend_id':backend_id, 'request_id':control.id, 'restore_rate':control.restore_rate, 'uid':self.env.uid})
+            wait = cr.fetchone()[0]
 
         raise RetryableJobError("MWS API has been an error produced on %s for Request Throttled" % request_name,
-                                seconds=ceil(control.restore_rate) + 1,
+                                seconds=int(ceil(max(wait, 1))),
                                 ignore_retry=ignore_retry)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+# Telemetry of the requests to Amazon MWS. The calls are aggregated on memory by database, backend and action,
+# and these are flushed periodically to amazon.control.request.stat with a row by hour
+
+import logging
+import threading
+import time
+
+import odoo
+from odoo import models, fields, api
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the aggregated data of a process to the database
+FLUSH_INTERVAL = int(config.get('amazon_mws_telemetry_flush_interval', 60))
+
+# Index of the counters on the aggregated lists
+CALLS, ERRORS, THROTTLED, HTTP_TIME, PARSE_TIME, BYTES = range(6)
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = {}
+
+
+def _get_counters(key):
+    counters = _stats.get(key)
+    if counters is None:
+        counters = _stats[key] = [0, 0, 0, 0., 0., 0]
+    return counters
+
+
+def record_call(key, http_time, size, error=False, throttled=False):
+    """
+    Save a request on the aggregator
+    :param key: tuple (dbname, backend_id, action)
+    """
+    with _lock:
+        counters = _get_counters(key)
+        counters[CALLS] += 1
+        counters[HTTP_TIME] += http_time
+        counters[BYTES] += size
+        if error:
+            counters[ERRORS] += 1
+        if throttled:
+            counters[THROTTLED] += 1
+
+
+def record_parse(key, parse_time):
+    with _lock:
+        _get_counters(key)[PARSE_TIME] += parse_time
+
+
+def maybe_flush(dbname):
+    """
+    Flush the aggregated data of the database if the last flush was FLUSH_INTERVAL seconds ago
+    """
+    now = time.time()
+    if now - _last_flush.setdefault(dbname, now) < FLUSH_INTERVAL:
+        return
+    flush(dbname)
+
+
+def flush(dbname):
+    with _lock:
+        _last_flush[dbname] = time.time()
+        keys = [key for key in _stats if key[0] == dbname]
+        rows = [(key[1], key[2], _stats.pop(key)) for key in keys]
+
+    if not rows:
+        return
+
+    try:
+        with odoo.registry(dbname).cursor() as cr:
+            for backend_id, action, counters in rows:
+                cr.execute("""INSERT INTO amazon_control_request_stat (backend_id, request_name, period, calls, errors, throttled,
+                                                                       http_time, parse_time, bytes,
+                                                                       create_uid, create_date, write_uid, write_date)
+                              VALUES (%s, %s, date_trunc('hour', now() AT TIME ZONE 'UTC'), %s, %s, %s, %s, %s, %s,
+                                      %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC')
+                              ON CONFLICT (backend_id, request_name, period) DO UPDATE
+                              SET calls = amazon_control_request_stat.calls + EXCLUDED.calls,
+                                  errors = amazon_control_request_stat.errors + EXCLUDED.errors,
+                                  throttled = amazon_control_request_stat.throttled + EXCLUDED.throttled,
+                                  http_time = amazon_control_request_stat.http_time + EXCLUDED.http_time,
+                                  parse_time = amazon_control_request_stat.parse_time + EXCLUDED.parse_time,
+                                  bytes = amazon_control_request_stat.bytes + EXCLUDED.bytes,
+                                  write_date = EXCLUDED.write_date""",
+                           (backend_id, action, counters[CALLS], counters[ERRORS], counters[THROTTLED],
+                            counters[HTTP_TIME], counters[PARSE_TIME], counters[BYTES], odoo.SUPERUSER_ID, odoo.SUPERUSER_ID))
+    except Exception as e:
+        # The telemetry can't break the requests to MWS, the data of this interval is lost
+        _logger.warning('Connector_amazon log: the MWS telemetry can\'t be saved on %s: %s' % (dbname, e))
+
+
+class RequestStat(models.Model):
+    _name = 'amazon.control.request.stat'
+    _description = 'Telemetry of the MWS requests'
+    _order = 'period desc'
+
+    backend_id = fields.Many2one('amazon.backend', required=True, ondelete='cascade')
+    request_name = fields.Char(required=True)
+    period = fields.Datetime(required=True, help='Hour of the requests')
+    calls = fields.Integer(group_operator='sum')
+    errors = fields.Integer(group_operator='sum')
+    throttled = fields.Integer(group_operator='sum')
+    http_time = fields.Float('HTTP time (s)', group_operator='sum')
+    parse_time = fields.Float('Parse time (s)', group_operator='sum')
+    # Float because the bytes of an hour of reports overflow an integer column
+    bytes = fields.Float('Bytes received', digits=(16, 0), group_operator='sum')
+    avg_http_time = fields.Float('Average HTTP time (s)', compute='_compute_averages')
+    avg_bytes = fields.Float('Average bytes', compute='_compute_averages')
+
+    _sql_constraints = [
+        ('backend_request_period_uniq', 'unique(backend_id, request_name, period)', 'There is already a stat for the request on the period.'),
+    ]
+
+    @api.multi
+    def _compute_averages(self):
+        for stat in self:
+            stat.avg_http_time = stat.http_time / stat.calls if stat.calls else 0
+            stat.avg_bytes = float(stat.bytes) / stat.calls if stat.calls else 0
+
+    @api.model
+    def get_prometheus_metrics(self):
+        """
+        Totals of the requests by backend and action on the Prometheus text format
+        """
+        self.env.cr.execute("""SELECT backend.name, stat.request_name, sum(stat.calls), sum(stat.errors), sum(stat.throttled),
+                                      sum(stat.http_time), sum(stat.parse_time), sum(stat.bytes)
+                               FROM amazon_control_request_stat stat
+                               JOIN amazon_backend backend ON backend.id = stat.backend_id
+                               GROUP BY backend.name, stat.request_name
+                               ORDER BY backend.name, stat.request_name""")
+        rows = self.env.cr.fetchall()
+        metrics = [('amazon_mws_calls_total', 'counter', 'Requests sent to MWS'),
+                   ('amazon_mws_errors_total', 'counter', 'Requests to MWS that returned an error'),
+                   ('amazon_mws_throttled_total', 'counter', 'Requests to MWS that returned RequestThrottled'),
+                   ('amazon_mws_http_seconds_total', 'counter', 'Seconds waiting for the responses of MWS'),
+                   ('amazon_mws_parse_seconds_total', 'counter', 'Seconds parsing the xml responses of MWS'),
+                   ('amazon_mws_received_bytes_total', 'counter', 'Bytes received from MWS'), ]
+        lines = []
+        for index, (name, metric_type, help_text) in enumerate(metrics):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for row in rows:
+                backend_name = (row[0] or '').replace('\\', '\\\\').replace('"', '\\"')
+                lines.append('%s{backend="%s",action="%s"} %s' % (name, backend_name, row[1], row[index + 2] or 0))
+        return '\n'.join(lines) + '\n'
@@ -9,7 +9,11 @@ Borrowed from https://github.com/timotheus/ebaysdk-python
 
 import xml.etree.ElementTree as ET
 import re
+from io import BytesIO
 from time import strftime, gmtime
+from xml.etree.cElementTree import iterparse
+
+NAMESPACE_REGEX = re.compile("\{(.*)\}(.*)")
 
 
 class object_dict(dict):
@@ -86,7 +90,7 @@ class xml2dict(object):
         ns = http://cs.sfsu.edu/csc867/myscheduler
         name = patients
         """
-        result = re.compile("\{(.*)\}(.*)").search(tag)
+        result = NAMESPACE_REGEX.search(tag)
         if result:
             value.namespace, tag = result.groups()
 
@@ -104,6 +108,51 @@ class xml2dict(object):
         return object_dict({root_tag:root_tree})
 
 
+class iterxml2dict(xml2dict):
+    """
+    Parser with the same output that xml2dict but built on cElementTree.iterparse, the namespaces are dropped
+    from tags and attributes while the document is read, so there isn't needed a regex pass over the raw xml.
+    The elements are cleared as soon as they are converted to keep the memory low on big responses.
+    """
+
+    def fromstring(self, s):
+        """parse a string"""
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        return self.fromfile(BytesIO(s))
+
+    def fromfile(self, f):
+        """parse a file object"""
+        stack = []
+        root_tag = root_tree = None
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                node_tree = object_dict()
+                for (k, v) in elem.attrib.items():
+                    node_tree[k.rpartition('}')[2]] = object_dict({'value':v})
+                stack.append(node_tree)
+                continue
+
+            node_tree = stack.pop()
+            if elem.text:
+                node_tree.value = elem.text
+            tag = elem.tag.rpartition('}')[2]
+            elem.clear()
+            if not stack:
+                root_tag, root_tree = tag, node_tree
+                continue
+            parent = stack[-1]
+            if tag not in parent:  # the first time, so store it in dict
+                parent[tag] = node_tree
+                continue
+            old = parent[tag]
+            if not isinstance(old, list):
+                parent[tag] = [old]  # multi times, so change old dict to a list
+            parent[tag].append(node_tree)  # add the new one
+
+        return object_dict({root_tag:root_tree})
+
+
 def get_timestamp():
     """
         Returns the current timestamp in proper format.
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from . import test_mws_parser
+from . import test_quota_control
+from . import test_job_identity
+from . import test_feed_parts
+from . import test_feed_tothrow
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+
+class AmazonTestCase(TransactionCase):
+    """ Base of the tests that need an Amazon backend """
+
+    def setUp(self):
+        super(AmazonTestCase, self).setUp()
+        self.backend = self.env['amazon.backend'].create({
+            'name':'Test backend',
+            'access_key':'TEST',
+            'key':'TEST',
+            'seller':'TESTSELLER',
+            'token':'amzn.mws.test',
+            'warehouse_id':self.env.ref('stock.warehouse0').id,
+        })
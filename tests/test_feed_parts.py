@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import base64
+import hashlib
+
+from lxml import etree
+from odoo.tests.common import TransactionCase
+
+from ..mws.feed_parts import split_envelope, split_flat_file
+
+
+class TestFeedParts(TransactionCase):
+
+    def test_split_flat_file_rows(self):
+        parts = list(split_flat_file('sku\tquantity\n', ['A\t1\n', 'B\t2\n', 'C\t3\n'], max_rows=2, max_bytes=1000))
+        self.assertEqual(parts, [('sku\tquantity\nA\t1\nB\t2\n', 2), ('sku\tquantity\nC\t3\n', 1)])
+
+    def test_split_flat_file_bytes(self):
+        header = 'sku\n'
+        parts = list(split_flat_file(header, ['A\n', 'B\n', 'C\n'], max_rows=100, max_bytes=len(header) + 4))
+        self.assertEqual(parts, [('sku\nA\nB\n', 2), ('sku\nC\n', 1)])
+        # A row bigger than the limit is sent alone instead of being lost
+        parts = list(split_flat_file(header, ['LONG-SKU\n', 'A\n'], max_rows=100, max_bytes=len(header) + 2))
+        self.assertEqual(parts, [('sku\nLONG-SKU\n', 1), ('sku\nA\n', 1)])
+
+    def test_split_flat_file_empty(self):
+        self.assertEqual(list(split_flat_file('sku\n', [])), [])
+
+    def _get_messages(self, number):
+        return (('Update', 'Inventory', [('SKU', 'SKU-%d' % index), ('Quantity', str(index))]) for index in range(number))
+
+    def _check_envelope(self, envelope, skus):
+        content = envelope.content
+        self.assertEqual(envelope.size, len(content))
+        self.assertEqual(envelope.md5, base64.encodestring(hashlib.md5(content).digest()).strip('\n'))
+        root = etree.fromstring(content)
+        self.assertEqual(root.findtext('Header/MerchantIdentifier'), 'MERCHANT')
+        self.assertEqual(root.findtext('MessageType'), 'Inventory')
+        # The messages of each part are numbered from 1
+        self.assertEqual([message.findtext('MessageID') for message in root.findall('Message')],
+                         [str(index + 1) for index in range(len(skus))])
+        self.assertEqual([message.findtext('Inventory/SKU') for message in root.findall('Message')], skus)
+        envelope.close()
+
+    def test_split_envelope_rows(self):
+        envelopes = list(split_envelope('MERCHANT', 'Inventory', self._get_messages(5), max_rows=2, max_bytes=1024 * 1024))
+        self.assertEqual([envelope.messages for envelope in envelopes], [2, 2, 1])
+        for envelope, skus in zip(envelopes, [['SKU-0', 'SKU-1'], ['SKU-2', 'SKU-3'], ['SKU-4']]):
+            self._check_envelope(envelope, skus)
+
+    def test_split_envelope_bytes(self):
+        whole = list(split_envelope('MERCHANT', 'Inventory', self._get_messages(10), max_rows=100, max_bytes=1024 * 1024))
+        self.assertEqual(len(whole), 1)
+        max_bytes = whole[0].size / 3
+        whole[0].close()
+
+        envelopes = list(split_envelope('MERCHANT', 'Inventory', self._get_messages(10), max_rows=100, max_bytes=max_bytes))
+        self.assertGreater(len(envelopes), 1)
+        self.assertEqual(sum(envelope.messages for envelope in envelopes), 10)
+        skus = ['SKU-%d' % index for index in range(10)]
+        for envelope in envelopes:
+            self.assertLessEqual(envelope.size, max_bytes)
+            self._check_envelope(envelope, skus[:envelope.messages])
+            skus = skus[envelope.messages:]
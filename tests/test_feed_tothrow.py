@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import mock
+
+from .common import AmazonTestCase
+from ..components import backend_adapter
+from ..components.backend_adapter import AmazonAPI
+
+FEED_TYPE = '_POST_INVENTORY_AVAILABILITY_DATA_'
+
+
+class TestFeedToThrow(AmazonTestCase):
+
+    def setUp(self):
+        super(TestFeedToThrow, self).setUp()
+        self.api = AmazonAPI(self.backend)
+
+    def _create_change(self, data):
+        return self.env['amazon.feed.tothrow'].create({'backend_id':self.backend.id,
+                                                       'type':FEED_TYPE,
+                                                       'model':'amazon.product.product.detail',
+                                                       'identificator':'1',
+                                                       'data':data})
+
+    def _get_pending(self):
+        return self.env['amazon.feed.tothrow'].search([('backend_id', '=', self.backend.id), ('launched', '=', False)])
+
+    def test_pending_key(self):
+        """ A new change of a sku on a marketplace replaces the pending one """
+        self._create_change({'sku':'SKU-1', 'Quantity':'1', 'id_mws':'A1'})
+        last = self._create_change({'sku':'SKU-1', 'Quantity':'2', 'id_mws':'A1'})
+        other = self._create_change({'sku':'SKU-1', 'Quantity':'3', 'id_mws':'A2'})
+        self.assertEqual(self._get_pending(), last | other)
+        self.assertEqual(last.pending_key, 'A1,SKU-1')
+        self.assertEqual((last.sku, last.id_mws), ('SKU-1', 'A1'))
+
+    def test_feeds_to_throw_groups(self):
+        self._create_change({'sku':'SKU-1', 'Quantity':'1', 'id_mws':'A1'})
+        self._create_change({'sku':'SKU-1', 'Quantity':'1', 'id_mws':'A2'})
+        self._create_change({'Quantity':'1'})
+        self.assertEqual(sorted(self.api._get_feeds_to_throw_groups(FEED_TYPE)), ['', 'A1', 'A2'])
+
+    def test_feeds_to_throw_pages(self):
+        """ The pages of a group are read by id until the limit """
+        changes = self.env['amazon.feed.tothrow']
+        for index in range(5):
+            changes |= self._create_change({'sku':'SKU-%d' % index, 'Quantity':'1', 'id_mws':'A1'})
+        self._create_change({'sku':'SKU-1', 'Quantity':'1', 'id_mws':'A2'})
+
+        with mock.patch.object(backend_adapter, 'FEEDS_TO_THROW_PAGE_SIZE', 2):
+            pages = list(self.api._get_feeds_to_throw_pages(FEED_TYPE, 'A1', 100))
+            self.assertEqual([page.ids for page in pages], [changes.ids[0:2], changes.ids[2:4], changes.ids[4:5]])
+            pages = list(self.api._get_feeds_to_throw_pages(FEED_TYPE, 'A1', 3))
+            self.assertEqual([page.ids for page in pages], [changes.ids[0:2], changes.ids[2:3]])
+
+    def test_read_last_feeds_data(self):
+        """ The changes of the same sku are read once with the data of the last one """
+        first = self._create_change({'sku':'SKU-1', 'Quantity':4})
+        last = self._create_change({'sku':'SKU-1', 'Quantity':5})
+        other = self._create_change({'sku':'SKU-2', 'Quantity':6, 'id_mws':'A1'})
+        dict_products = self.api._read_last_feeds_data(first | last | other, keys=('sku', 'Quantity'))
+        self.assertEqual(sorted(dict_products[None]['SKU-1'].pop('_feed_ids')), sorted((first | last).ids))
+        self.assertEqual(dict_products, {None:{'SKU-1':{'sku':'SKU-1', 'Quantity':'5'}},
+                                         'A1':{'SKU-2':{'sku':'SKU-2', 'Quantity':'6', '_feed_ids':other.ids}}})
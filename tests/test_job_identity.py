@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from .common import AmazonTestCase
+from ..models.amazon_binding.common import get_job_identity_key
+
+
+class TestJobIdentity(AmazonTestCase):
+
+    def _get_stored_job(self, job):
+        return self.env['queue.job'].search([('uuid', '=', job.uuid)])
+
+    def test_get_job_identity_key(self):
+        key = get_job_identity_key('amazon.sale.order', self.backend, 'ORDER-1', 'import_record')
+        self.assertEqual(key, 'amazon.sale.order,%s,ORDER-1,import_record' % self.backend.id)
+        # The data of the record that is sent with the id isn't part of the key
+        self.assertEqual(get_job_identity_key('amazon.sale.order', self.backend, ('ORDER-1', {'order_id':'ORDER-1'}), 'import_record'),
+                         key)
+        self.assertIsNone(get_job_identity_key('amazon.sale.order', self.backend, None, 'import_record'))
+        self.assertIsNone(get_job_identity_key('amazon.sale.order', self.backend, {'sku':'SKU-1'}, 'import_record'))
+
+    def test_delay_same_identity(self):
+        """ The work that is already enqueued returns its job instead of store a new one """
+        sale_model = self.env['amazon.sale.order']
+        job = sale_model.with_delay().import_record(self.backend, 'ORDER-1')
+        stored_job = self._get_stored_job(job)
+        self.assertEqual(stored_job.amazon_identity_key, get_job_identity_key('amazon.sale.order', self.backend, 'ORDER-1', 'import_record'))
+
+        same_job = sale_model.with_delay().import_record(self.backend, ('ORDER-1', {'order_id':'ORDER-1'}))
+        self.assertEqual(same_job.uuid, job.uuid)
+        self.assertEqual(self.env['queue.job'].search_count([('amazon_identity_key', '=', stored_job.amazon_identity_key)]), 1)
+
+        other_job = sale_model.with_delay().import_record(self.backend, 'ORDER-2')
+        self.assertNotEqual(other_job.uuid, job.uuid)
+
+    def test_delay_override_identity(self):
+        """ The overrides of import_record keep the identity of amazon.binding """
+        product_model = self.env['amazon.product.product']
+        job = product_model.with_delay().import_record(self.backend, 'SKU-1')
+        self.assertTrue(self._get_stored_job(job).amazon_identity_key)
+        self.assertEqual(product_model.with_delay().import_record(self.backend, 'SKU-1').uuid, job.uuid)
+
+    def test_create_same_identity(self):
+        """ A job stored with the key of a live job returns the live job """
+        stored_job = self._get_stored_job(self.env['amazon.sale.order'].with_delay().import_record(self.backend, 'ORDER-1'))
+        vals = {'uuid':'same-identity-job',
+                'name':stored_job.name,
+                'model_name':stored_job.model_name,
+                'method_name':stored_job.method_name,
+                'record_ids':stored_job.record_ids,
+                'args':stored_job.args,
+                'kwargs':stored_job.kwargs,
+                'func_string':stored_job.func_string,
+                'state':'pending'}
+        job_model = self.env['queue.job'].with_context(amazon_identity_key=stored_job.amazon_identity_key)
+        self.assertEqual(job_model.create(vals), stored_job)
+        self.assertFalse(self.env['queue.job'].search([('uuid', '=', 'same-identity-job')]))
+
+    def test_requeue_same_identity(self):
+        """ A failed job isn't requeued while other job of its key is live, it is set as done """
+        sale_model = self.env['amazon.sale.order']
+        failed_job = self._get_stored_job(sale_model.with_delay().import_record(self.backend, 'ORDER-1'))
+        failed_job.write({'state':'failed'})
+        live_job = self._get_stored_job(sale_model.with_delay().import_record(self.backend, 'ORDER-1'))
+        self.assertNotEqual(live_job, failed_job)
+
+        failed_job.requeue()
+        self.assertEqual(failed_job.state, 'done')
+        self.assertEqual(live_job.state, 'pending')
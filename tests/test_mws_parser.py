@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+from ..mws.mws import DictWrapper, MWSError, is_xml_response
+from ..mws.utils import iterxml2dict
+
+LIST_ORDERS_XML = """<?xml version="1.0"?>
+<ListOrdersResponse xmlns="https://mws.amazonservices.com/Orders/2013-09-01">
+  <ListOrdersResult>
+    <Orders>
+      <Order><AmazonOrderId>171-1</AmazonOrderId><OrderStatus>Shipped</OrderStatus></Order>
+      <Order><AmazonOrderId>171-2</AmazonOrderId><OrderStatus>Unshipped</OrderStatus></Order>
+    </Orders>
+    <NextToken>token</NextToken>
+  </ListOrdersResult>
+  <ResponseMetadata><RequestId currency="EUR">request</RequestId></ResponseMetadata>
+</ListOrdersResponse>"""
+
+
+class TestMwsParser(TransactionCase):
+
+    def test_iterxml2dict(self):
+        """ The namespaces are dropped and the repeated tags are lists """
+        result = iterxml2dict().fromstring(LIST_ORDERS_XML)
+        self.assertEqual(result.keys(), ['ListOrdersResponse'])
+        orders_result = result.ListOrdersResponse.ListOrdersResult
+        orders = orders_result.Orders.Order
+        self.assertEqual(len(orders), 2)
+        self.assertEqual(orders[0].getvalue('AmazonOrderId'), '171-1')
+        self.assertEqual(orders[1].getvalue('OrderStatus'), 'Unshipped')
+        self.assertEqual(orders_result.NextToken, 'token')
+        request_id = result.ListOrdersResponse.ResponseMetadata.RequestId
+        self.assertEqual(request_id.value, 'request')
+        self.assertEqual(request_id.currency, 'EUR')
+
+    def test_iterxml2dict_single_element(self):
+        """ A tag that is only once is a dict instead of a list """
+        result = iterxml2dict().fromstring(u'<A xmlns="ns"><B><C>ñ</C></B></A>')
+        self.assertEqual(result.A.B.C, u'ñ')
+
+    def test_dict_wrapper_lazy(self):
+        """ The xml is parsed the first time that the result is accessed """
+        wrapper = DictWrapper(LIST_ORDERS_XML, 'ListOrdersResult')
+        self.assertIsNone(wrapper._parsed_dict)
+        self.assertEqual(wrapper.parsed.NextToken, 'token')
+        self.assertIsNotNone(wrapper._parsed_dict)
+        self.assertEqual(wrapper._response_dict['ListOrdersResult'].NextToken, 'token')
+
+    def test_dict_wrapper_invalid_xml(self):
+        wrapper = DictWrapper('<ListOrdersResponse>', 'ListOrdersResult')
+        with self.assertRaises(MWSError):
+            wrapper.parsed
+
+    def test_is_xml_response(self):
+        self.assertTrue(is_xml_response('\xef\xbb\xbf  <?xml version="1.0"?><A/>', {}))
+        self.assertTrue(is_xml_response('<ErrorResponse/>', {'content-type':'text/plain'}))
+        self.assertFalse(is_xml_response('sku\tquantity\n', {}))
+        self.assertFalse(is_xml_response('<sku>\tquantity\n', {'content-type':'text/tab-separated-values'}))
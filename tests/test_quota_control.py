@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# © 2018 Halltic eSolutions S.L.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from .common import AmazonTestCase
+from ..mws import quota_control
+
+
+class TestQuotaControl(AmazonTestCase):
+
+    def setUp(self):
+        super(TestQuotaControl, self).setUp()
+        # A bucket of two tokens that recovers a token each minute
+        self.control = self.env['amazon.control.request'].create({'request_name':'TestAction',
+                                                                  'max_quota':2,
+                                                                  'restore_rate':60})
+        self.params = {'backend_id':self.backend.id,
+                       'request_id':self.control.id,
+                       'max_quota':self.control.max_quota,
+                       'restore_rate':self.control.restore_rate,
+                       'uid':self.env.uid}
+
+    def tearDown(self):
+        quota_control._projected_buckets.pop((self.env.cr.dbname, self.backend.id, self.control.id), None)
+        super(TestQuotaControl, self).tearDown()
+
+    def _get_tokens(self):
+        return self.control._get_bucket_state(self.params)[0]
+
+    def test_take_bucket_token(self):
+        """ The bucket is created full and each call takes a token until it is empty """
+        self.assertEqual(self.control._take_bucket_token(self.env.cr, self.params), 0)
+        self.assertAlmostEqual(self._get_tokens(), 1, delta=0.1)
+        self.assertEqual(self.control._take_bucket_token(self.env.cr, self.params), 0)
+        self.assertAlmostEqual(self._get_tokens(), 0, delta=0.1)
+
+        # The empty bucket isn't decremented, the wait is the time to recover a token
+        wait = self.control._take_bucket_token(self.env.cr, self.params)
+        self.assertAlmostEqual(wait, 60, delta=1)
+        self.assertAlmostEqual(self._get_tokens(), 0, delta=0.1)
+
+    def test_take_bucket_token_refill(self):
+        """ The tokens are recovered with the time since the last refill, up to the size of the bucket """
+        self.control._take_bucket_token(self.env.cr, self.params)
+        self.env.cr.execute("""UPDATE amazon_control_quota_bucket SET tokens = 0, last_refill = last_refill - interval '90 seconds'
+                               WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s""", self.params)
+        self.assertAlmostEqual(self._get_tokens(), 1.5, delta=0.1)
+        self.assertEqual(self.control._take_bucket_token(self.env.cr, self.params), 0)
+        self.assertAlmostEqual(self._get_tokens(), 0.5, delta=0.1)
+        self.assertAlmostEqual(self.control._take_bucket_token(self.env.cr, self.params), 30, delta=1)
+
+        self.env.cr.execute("""UPDATE amazon_control_quota_bucket SET last_refill = last_refill - interval '1 day'
+                               WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s""", self.params)
+        self.assertAlmostEqual(self._get_tokens(), 2, delta=0.001)
+
+    def test_take_bucket_token_blocked(self):
+        """ A bucket blocked by a throttle of MWS doesn't give tokens until it is unblocked """
+        self.control._take_bucket_token(self.env.cr, self.params)
+        self.env.cr.execute("""UPDATE amazon_control_quota_bucket
+                               SET tokens = 2, blocked_until = clock_timestamp() AT TIME ZONE 'UTC' + interval '30 seconds'
+                               WHERE backend_id = %(backend_id)s AND request_id = %(request_id)s""", self.params)
+        self.assertAlmostEqual(self.control._take_bucket_token(self.env.cr, self.params), 30, delta=1)
+        self.assertAlmostEqual(self._get_tokens(), 2, delta=0.001)
+
+    def test_reserve_quota_eta(self):
+        """ The jobs enqueued together reserve the tokens of the projected bucket and get increasing etas """
+        request_names = ['TestAction']
+        reserve = self.env['amazon.control.request'].reserve_quota_eta
+        self.assertEqual(reserve(request_names, self.backend.id), 0)
+        self.assertEqual(reserve(request_names, self.backend.id), 0)
+        self.assertAlmostEqual(reserve(request_names, self.backend.id), 60, delta=1)
+        self.assertAlmostEqual(reserve(request_names, self.backend.id), 120, delta=1)
+        # The actions without quota control don't delay the jobs
+        self.assertEqual(reserve(['ActionWithoutControl'], self.backend.id), 0)